@@ -0,0 +1 @@
+"""Benchmark suite of logan_blaster (see benchmarks/run.py)."""
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""Benchmarks of the hot paths of logan_blaster, on synthetic data (see synthetic.py).
+
+    python benchmarks/run.py [--scale small|medium|large] [--repeat N] [--only NAME ...] [-o results.json]
+    python benchmarks/run.py --compare baseline.json results.json [--threshold 0.1]
+
+Each benchmark is run --repeat times and its minimal, median and mean times are recorded in a
+json file (by default benchmarks/results/<version>_<date>.json) along with the version of
+logan_blaster, so that results of two versions can be compared with --compare.
+The end-to-end benchmark runs LoganBlaster.run() on accessions served by a local HTTP server,
+with the stub blastn and back_to_sequences of benchmarks/stubs (zstd is required).
+"""
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import logan_blaster  # noqa: E402
+from benchmarks import synthetic  # noqa: E402
+
+STUBS_DIR = os.path.join(ROOT, "benchmarks", "stubs")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Sizes of the synthetic data for each scale
+SCALES = {
+    "small": {"query_length": 2_000, "nb_hsps": 2_000, "nb_contigs": 20_000, "nb_accessions": 2},
+    "medium": {"query_length": 10_000, "nb_hsps": 20_000, "nb_contigs": 200_000, "nb_accessions": 4},
+    "large": {"query_length": 50_000, "nb_hsps": 200_000, "nb_contigs": 1_000_000, "nb_accessions": 8},
+}
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def file_server(directory):
+    handler = functools.partial(QuietHandler, directory=directory)
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+# Each benchmark prepares its data in work_dir, registers the resources to release in
+# the ExitStack `resources`, and returns (function to time, parameters)
+
+def bench_parse_blastn(work_dir, scale, resources):
+    query = synthetic.random_sequence(synthetic.random.Random(0), scale["query_length"])
+    report = os.path.join(work_dir, "report.txt")
+    synthetic.make_blast_report(report, "bench_query", query, scale["nb_hsps"])
+    return (lambda: logan_blaster.parse_blastn(report)), {
+        "query_length": scale["query_length"], "nb_hsps": scale["nb_hsps"], "report_bytes": os.path.getsize(report)}
+
+
+def bench_visualize_matches(work_dir, scale, resources):
+    length = scale["query_length"]
+    query = synthetic.random_sequence(synthetic.random.Random(0), length)
+    rng = synthetic.random.Random(1)
+    intervals = [(s, s + rng.randint(50, 500)) for s in (rng.randint(1, length) for _ in range(scale["nb_hsps"]))]
+    coverage = logan_blaster.coverage_from_intervals(intervals, length)
+
+    def run():
+        logan_blaster.visualize_matches(query, "bench_query", length, coverage, print_abundance=True, out=io.StringIO())
+    return run, {"query_length": length, "nb_hsps": scale["nb_hsps"]}
+
+
+def _contigs(work_dir, scale):
+    query_file = os.path.join(work_dir, "query.fa")
+    query = synthetic.make_query(query_file, scale["query_length"])
+    contigs = os.path.join(work_dir, "contigs.fa")
+    synthetic.make_contigs(contigs, query, scale["nb_contigs"])
+    with open(contigs, "rb") as f:
+        return query_file, f.read()
+
+
+def bench_recruitment(work_dir, scale, resources):
+    query_file, contigs = _contigs(work_dir, scale)
+
+    def run():
+        index = logan_blaster.QueryKmerIndex(query_file, 17)
+        logan_blaster.recruit_sequences(io.BytesIO(contigs), index, io.BytesIO(), logan_blaster.CoverageStats())
+    return run, {"query_length": scale["query_length"], "nb_contigs": scale["nb_contigs"], "contigs_bytes": len(contigs)}
+
+
+def bench_coverage_stats(work_dir, scale, resources):
+    _, contigs = _contigs(work_dir, scale)
+
+    def run():
+        stats = logan_blaster.CoverageStats()
+        for i in range(0, len(contigs), logan_blaster.STREAM_BUFFER_SIZE):
+            stats.feed(contigs[i: i + logan_blaster.STREAM_BUFFER_SIZE])
+        stats.close()
+    return run, {"nb_contigs": scale["nb_contigs"], "contigs_bytes": len(contigs)}
+
+
+def bench_back_to_sequences(work_dir, scale, resources, stats=False):
+    """Recruitment of a .zst file by the stub back_to_sequences, with or without the coverage statistics
+    of the tigs, computed from a second decompression of the file"""
+    if shutil.which("zstd") is None:
+        raise RuntimeError("zstd is required")
+    query_file, contigs = _contigs(work_dir, scale)
+    zst = os.path.join(work_dir, "contigs.fa.zst")
+    subprocess.run(["zstd", "-q", "-o", zst], input=contigs, check=True)
+    blaster = logan_blaster.LoganBlaster(None, None, query_file, False, False, 17, 0, work_dir)
+    blaster.query_file = query_file
+    recruited = os.path.join(work_dir, "recruited.fa")
+
+    def run():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            success, error = blaster._run_back_to_sequences(zst, recruited, logan_blaster.CoverageStats() if stats else None)
+        if not success:
+            raise RuntimeError(error)
+    return run, {"nb_contigs": scale["nb_contigs"], "contigs_bytes": len(contigs), "stats": stats}
+
+
+def bench_end_to_end(work_dir, scale, resources):
+    if shutil.which("zstd") is None:
+        raise RuntimeError("zstd is required")
+    served = os.path.join(work_dir, "served")
+    os.makedirs(served)
+    query_file = os.path.join(work_dir, "query.fa")
+    query = synthetic.make_query(query_file, scale["query_length"])
+    accessions = [f"SRR{i:07d}" for i in range(scale["nb_accessions"])]
+    for seed, accession in enumerate(accessions):
+        contigs = os.path.join(work_dir, f"{accession}.contigs.fa")
+        synthetic.make_contigs(contigs, query, scale["nb_contigs"], seed=seed, accession=accession)
+        subprocess.run(["zstd", "-q", "--rm", contigs, "-o", os.path.join(served, f"{accession}.contigs.fa.zst")], check=True)
+    accession_file = os.path.join(work_dir, "accessions.txt")
+    with open(accession_file, "w") as f:
+        f.writelines(f"{accession}\n" for accession in accessions)
+    runs = []
+
+    def run():
+        output_dir = os.path.join(work_dir, f"run_{len(runs)}")
+        runs.append(output_dir)
+        blaster = logan_blaster.LoganBlaster(None, accession_file, query_file, True, False, 17, 0, output_dir)
+        blaster._tigs_url = lambda accession: f"{url}/{accession}.contigs.fa.zst"
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                blaster.run(abs_query_file=query_file, abs_accession_file=accession_file)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    url = resources.enter_context(file_server(served))
+    return run, {"query_length": scale["query_length"], "nb_contigs": scale["nb_contigs"], "nb_accessions": len(accessions)}
+
+
+BENCHMARKS = {
+    "parse_blastn": bench_parse_blastn,
+    "visualize_matches": bench_visualize_matches,
+    "recruitment": bench_recruitment,
+    "coverage_stats": bench_coverage_stats,
+    "back_to_sequences": bench_back_to_sequences,
+    "back_to_sequences_stats": functools.partial(bench_back_to_sequences, stats=True),
+    "end_to_end": bench_end_to_end,
+}
+
+
+def time_function(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "mean": statistics.mean(times), "times": times}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(names, scale_name, repeat):
+    scale = SCALES[scale_name]
+    results = {}
+    path = os.environ["PATH"]
+    os.environ["PATH"] = f"{STUBS_DIR}{os.pathsep}{path}"
+    try:
+        for name in names:
+            with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as work_dir, contextlib.ExitStack() as resources:
+                try:
+                    function, parameters = BENCHMARKS[name](work_dir, scale, resources)
+                except RuntimeError as e:
+                    print(f"{name:<20} skipped: {e}")
+                    continue
+                timing = time_function(function, repeat)
+            results[name] = {"parameters": parameters, **timing}
+            print(f"{name:<20} min {timing['min']:9.4f}s  median {timing['median']:9.4f}s  {parameters}")
+    finally:
+        os.environ["PATH"] = path
+    return {
+        "version": logan_blaster.__version__,
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale_name,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(baseline_file, results_file, threshold):
+    """Prints the median time ratios of two result files. Returns the number of regressions"""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(results_file) as f:
+        results = json.load(f)
+    if baseline.get("scale") != results.get("scale"):
+        print(f"Warning: comparing the {baseline.get('scale')} and {results.get('scale')} scales")
+    print(f"{'benchmark':<20} {baseline.get('version')!s:>12} {results.get('version')!s:>12}    ratio")
+    nb_regressions = 0
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before, after = baseline["results"][name]["median"], result["median"]
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            nb_regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  improvement"
+        print(f"{name:<20} {before:11.4f}s {after:11.4f}s {ratio:8.2f}{flag}")
+    return nb_regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of logan_blaster on synthetic data.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="Size of the synthetic data (default: small)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each benchmark (default: 3)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument("-o", "--output", type=str, help="Result file (default: benchmarks/results/<version>_<date>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RESULTS"), help="Compare two result files instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.1, help="With --compare, relative slowdown reported as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    results = run_benchmarks(args.only or list(BENCHMARKS), args.scale, args.repeat)
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{results['version']}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Generators of synthetic, Logan-like data for the benchmarks: queries, contig sets and
+pairwise blast reports of configurable size. All generators are deterministic for a given seed.
+
+Contigs sharing a piece of the query carry a `bench:q:<start>-<end>` token (1-based query
+coordinates of the piece) in their header, used by the stub executables of benchmarks/stubs
+to recruit and align them without doing the actual work.
+"""
+import json
+import random
+
+LINE_WIDTH = 60
+# Number of subjects reported by blastn by default
+DEFAULT_MAX_TARGET_SEQS = 500
+DEFAULT_NUM_ALIGNMENTS = 250
+
+
+def random_sequence(rng, length):
+    return "".join(rng.choices("ACGT", k=length))
+
+
+def make_query(path, length, seed=0, name="bench_query"):
+    """Writes a random query of the given length. Returns its sequence"""
+    seq = random_sequence(random.Random(seed), length)
+    with open(path, "w") as f:
+        f.write(f">{name}\n{seq}\n")
+    return seq
+
+
+def iter_contigs(query, nb_contigs, contig_length=300, matching_fraction=0.01, seed=0, accession="SRR0000001"):
+    """Logan-like contig records (header, sequence). A matching_fraction of them embeds a piece of the query"""
+    rng = random.Random(seed)
+    for i in range(nb_contigs):
+        abundance = rng.lognormvariate(1.5, 0.8)
+        header = f">{accession}_{i} ka:f:{abundance:.1f}   L:+:{rng.randrange(nb_contigs)}:+"
+        seq = random_sequence(rng, contig_length)
+        if rng.random() < matching_fraction:
+            length = rng.randint(min(50, len(query)), min(contig_length, len(query)))
+            start = rng.randrange(len(query) - length + 1)
+            offset = rng.randrange(contig_length - length + 1)
+            seq = seq[:offset] + query[start: start + length] + seq[offset + length:]
+            header += f" bench:q:{start + 1}-{start + length}"
+        yield header, seq
+
+
+def make_contigs(path, query, nb_contigs, contig_length=300, matching_fraction=0.01, seed=0, accession="SRR0000001"):
+    """Writes a fasta file of Logan-like contigs. Returns the number of contigs embedding a piece of the query"""
+    nb_matching = 0
+    with open(path, "w") as f:
+        for header, seq in iter_contigs(query, nb_contigs, contig_length, matching_fraction, seed, accession):
+            nb_matching += "bench:q:" in header
+            f.write(f"{header}\n{seq}\n")
+    return nb_matching
+
+
+def write_hsp(out, subject, query, start, end):
+    """Writes an identity HSP between query[start-1:end] and a subject, in the blastn pairwise format"""
+    length = end - start + 1
+    out.write(f"> {subject}\nLength={length}\n\n"
+              f" Score = {2 * length:.1f} bits ({length}),  Expect = 0.0\n"
+              f" Identities = {length}/{length} (100%), Gaps = 0/{length} (0%)\n"
+              f" Strand=Plus/Plus\n\n")
+    for line_start in range(start, end + 1, LINE_WIDTH):
+        line_end = min(line_start + LINE_WIDTH - 1, end)
+        piece = query[line_start - 1: line_end]
+        subject_start = line_start - start + 1
+        subject_end = line_end - start + 1
+        out.write(f"Query  {line_start:<5}{piece}  {line_end}\n"
+                  f"{' ' * 12}{'|' * len(piece)}\n"
+                  f"Sbjct  {subject_start:<5}{piece}  {subject_end}\n\n")
+    out.write("\n")
+
+
+def write_report_header(out, query_name, query_length):
+    out.write(f"BLASTN 2.16.0+\n\n\nQuery= {query_name}\n\nLength={query_length}\n\n\n")
+
+
+def make_blast_report(path, query_name, query, nb_hsps, min_length=50, max_length=500, seed=0):
+    """Writes a pairwise blast report of nb_hsps identity HSPs at random query positions.
+    Returns the (start, end) query intervals of the HSPs"""
+    rng = random.Random(seed)
+    max_length = min(max_length, len(query))
+    intervals = []
+    with open(path, "w") as out:
+        write_report_header(out, query_name, len(query))
+        for i in range(nb_hsps):
+            length = rng.randint(min(min_length, max_length), max_length)
+            start = rng.randrange(len(query) - length + 1) + 1
+            write_hsp(out, f"tig_{i}", query, start, start + length - 1)
+            intervals.append((start, start + length - 1))
+    return intervals
+
+
+def write_blast_output(args, query_name, query, hits):
+    """Writes the (subject, start, end) identity hits of a stub blastn or blast_formatter in the
+    format of its -outfmt argument (tabular, pairwise or, as JSON, archive). Like blastn, only the
+    hits of -max_target_seqs (-num_alignments for pairwise reports) subjects are reported"""
+    if args["-outfmt"] == "0":
+        max_targets = int(args.get("-num_alignments", DEFAULT_NUM_ALIGNMENTS))
+    else:
+        max_targets = int(args.get("-max_target_seqs", DEFAULT_MAX_TARGET_SEQS))
+    kept = set(list(dict.fromkeys(subject for subject, _, _ in hits))[:max_targets])
+    hits = [hit for hit in hits if hit[0] in kept]
+    with open(args["-out"], "w") as out:
+        if args["-outfmt"] == "11":
+            json.dump({"query_name": query_name, "query": query, "hits": hits}, out)
+        elif args["-outfmt"] != "0":
+            for subject, start, end in hits:
+                length = end - start + 1
+                out.write(f"{subject}\t{start}\t{end}\t1\t{length}\t100.000\t0.0\t{2 * length:.1f}\n")
+        else:
+            write_report_header(out, query_name, len(query))
+            if not hits:
+                out.write("\n\n***** No hits found *****\n\n")
+            for subject, start, end in hits:
+                write_hsp(out, subject, query, start, end)
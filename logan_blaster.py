@@ -1,15 +1,43 @@
 #!/usr/bin/env python3
 import os
+import re
+import ast
+import operator
 import sys
+import math
+import mmap
+import json
+import fcntl
+import hashlib
+import io
 import argparse
+import contextlib
+import functools
 import subprocess
 import shutil
+import queue
+import time
+import tempfile
+import threading
+import zipfile
+import socketserver
+import stat
+import uuid
+import csv
+from array import array
+from itertools import accumulate, groupby, repeat
+import http.client
+import http.server
+from urllib.parse import urljoin, urlsplit
 from urllib.request import urlopen
 from pathlib import Path
 import ssl
+import zlib
+import heapq
 
 __author__ = 'Pierre Peterlongo'
 
+@functools.lru_cache(maxsize=None)
 def _resolve_version():
     # Primary: read live from git tags — no extra dependency
     try:
@@ -29,7 +57,12 @@ def _resolve_version():
         pass
     return "0+unknown"
 
-__version__ = _resolve_version()
+
+def __getattr__(name):
+    # The version is resolved on first use, `git describe` is not run at each import
+    if name == "__version__":
+        return _resolve_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Message colors
 GREEN = "\033[0;32m"
@@ -39,6 +72,9 @@ BLUE = "\033[1;34m"
 CYAN = "\033[1;36m"
 NOCOLOR = "\033[0m"
 
+# Size of the reads from network streams
+STREAM_BUFFER_SIZE = 1 << 20
+
 
 # --- Blast parser utilities ---
 def get_query_ACGT(file_path):
@@ -70,420 +106,4125 @@ def get_query_length(file_path):
     return None
 
 
+# One regular expression for the three kinds of lines used from a blast report,
+# so that the report is scanned in a single pass
+_BLAST_REPORT_LINE = re.compile(
+    rb"^(?:Query=(?P<name>[^\n]*)|Length=\s*(?P<length>\d+)|Query\s+(?P<start>\d+)\s+\S+\s+(?P<end>\d+))",
+    re.MULTILINE,
+)
+
+
 def parse_blastn(file_path):
-    query_name = get_query_name(file_path)
-    query_length = get_query_length(file_path)
+    """Returns the query name, the query length and, for each query position, the number
+    of alignments covering it (as an array of unsigned integers).
+    The report is memory-mapped and read once; coverage is built from the HSP intervals
+    with a difference array."""
+    query_name = None
+    query_length = None
+    intervals = []
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None, None, array('I')
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as report:
+            for match in _BLAST_REPORT_LINE.finditer(report):
+                start = match.group('start')
+                if start is not None:
+                    intervals.append((int(start), int(match.group('end'))))
+                elif match.group('length') is not None:
+                    if query_length is None:
+                        query_length = int(match.group('length'))
+                elif query_name is None:
+                    query_name = match.group('name').decode().split('=')[0].strip()
     if query_length is None:
-        return None, None, []
-    query_positions = [0] * query_length
-    with open(file_path, 'r') as file:
-        for line in file:
-            if line.startswith('Query '):
-                parts = line.split()
-                try:
-                    start = int(parts[1])
-                    end = int(parts[3])
-                    for pos in range(start, end + 1):
-                        query_positions[pos - 1] += 1
-                except (IndexError, ValueError):
+        return None, None, array('I')
+    return query_name, query_length, coverage_from_intervals(intervals, query_length)
+
+
+def coverage_from_intervals(intervals, query_length):
+    """Number of (start, end) intervals (1-based, inclusive) covering each query position,
+    computed with a difference array"""
+    diff = array('i', [0]) * (query_length + 1)
+    for start, end in intervals:
+        start = max(start, 1)
+        end = min(end, query_length)
+        if start <= end:
+            diff[start - 1] += 1
+            diff[end] -= 1
+    return array('I', accumulate(diff[:query_length]))
+
+
+# --- Tabular blast results ---
+BLAST_SCORING_PARAMETERS = ["-word_size", "11", "-gapextend", "2", "-gapopen", "5", "-reward", "2", "-penalty", "-3"]
+BLAST_TABULAR_COLUMNS = ["sseqid", "qstart", "qend", "sstart", "send", "pident", "evalue", "bitscore"]
+BLAST_TABULAR_OUTFMT = "6 " + " ".join(BLAST_TABULAR_COLUMNS)
+# Blast archive (ASN.1), rendered in other formats by blast_formatter
+BLAST_ARCHIVE_OUTFMT = "11"
+
+
+def _blast_output_options(output_file, outfmt, max_targets=None):
+    """Output options of blastn and blast_formatter. With max_targets, the hits of up to max_targets
+    subjects are reported instead of the blastn defaults (500 subjects, 250 in pairwise reports)"""
+    options = ["-out", output_file, "-outfmt", outfmt]
+    if outfmt == "0":
+        options += ["-sorthits", "0"]
+        if max_targets is not None:
+            options += ["-num_descriptions", str(max_targets), "-num_alignments", str(max_targets)]
+    elif max_targets is not None:
+        options += ["-max_target_seqs", str(max_targets)]
+    return options
+
+
+class HSPTable:
+    """Columnar store of the HSPs of a blast run, one typed array per field.
+    Subjects are stored as indexes in the `subjects` list.
+    Saved as a small json header followed by the raw little-endian columns."""
+
+    MAGIC = b"LOGAN_BLASTER_HSP 1\n"
+    COLUMNS = (
+        ("qstart", "I"),
+        ("qend", "I"),
+        ("sstart", "I"),
+        ("send", "I"),
+        ("pident", "f"),
+        ("evalue", "d"),
+        ("bitscore", "f"),
+        ("subject", "I"),
+    )
+
+    def __init__(self):
+        self.subjects = []
+        self.columns = {name: array(typecode) for name, typecode in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["qstart"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def append(self, subject, qstart, qend, sstart, send, pident, evalue, bitscore):
+        if not self.subjects or self.subjects[-1] != subject:
+            self.subjects.append(subject)
+        values = (qstart, qend, sstart, send, pident, evalue, bitscore, len(self.subjects) - 1)
+        for (name, _), value in zip(self.COLUMNS, values):
+            self.columns[name].append(value)
+
+    @classmethod
+    def from_tabular(cls, file_path):
+        """Reads a blast tabular output (outfmt 6 or 7) with the BLAST_TABULAR_COLUMNS columns"""
+        table = cls()
+        with open(file_path, "r") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
                     continue
-    return query_name, query_length, query_positions
+                sseqid, qstart, qend, sstart, send, pident, evalue, bitscore = line.rstrip("\n").split("\t")
+                table.append(sseqid, int(qstart), int(qend), int(sstart), int(send),
+                             float(pident), float(evalue), float(bitscore))
+        return table
 
+    def coverage(self, query_length):
+        return coverage_from_intervals(zip(self.columns["qstart"], self.columns["qend"]), query_length)
 
-def print_value(v, matched_positions):
-    if matched_positions:
-        if v == 0:
-            print('-', end='')
-        else:
-            if v <= 26:
-                print(chr(ord('a') + v - 1), end='')
-            if v > 26:
-                print('Z', end='')
+    def save(self, file_path):
+        header = {
+            "nb_hsps": len(self),
+            "columns": [[name, typecode] for name, typecode in self.COLUMNS],
+            "subjects": self.subjects,
+        }
+        with open(file_path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(json.dumps(header).encode() + b"\n")
+            for name, _ in self.COLUMNS:
+                column = self.columns[name]
+                if sys.byteorder != "little":
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+
+    @classmethod
+    def load(cls, file_path):
+        table = cls()
+        with open(file_path, "rb") as f:
+            if f.readline() != cls.MAGIC:
+                raise ValueError(f"{file_path} is not a logan_blaster HSP file")
+            header = json.loads(f.readline())
+            table.subjects = header["subjects"]
+            for name, typecode in header["columns"]:
+                column = array(typecode)
+                column.fromfile(f, header["nb_hsps"])
+                if sys.byteorder != "little":
+                    column.byteswap()
+                table.columns[name] = column
+        return table
+
+
+def run_hsp_parser(fasta_file, hsp_table, abundance=False, out=None, rle=False):
+    """Same as run_blast_parser, from a HSPTable instead of a pairwise blast report"""
+    with open(fasta_file, "rb") as f:
+        header, seq = next(iter_fasta_records(f), (b">", b""))
+    query_ACGT = seq.decode()
+    query_name = header.decode()[1:].strip()
+    query_length = len(query_ACGT)
+    coverage = hsp_table.coverage(query_length)
+    if rle:
+        write_coverage_runs(query_name, coverage, out if out is not None else sys.stdout)
     else:
-        if v == 0:
-            print('-', end='')
-        else:
-            print('|', end='')
+        visualize_matches(query_ACGT, query_name, query_length, coverage, print_abundance=abundance, out=out)
+    return coverage
+
+
+# Separates the accession from the original identifier of a tig in blast batches
+BATCH_TAG_SEPARATOR = "__"
+
+
+def _untag(subject_id):
+    """(accession, original id) of a tig identifier tagged for a blast batch, or (None, subject_id)"""
+    if subject_id.startswith("lcl|"):
+        subject_id = subject_id[4:]
+    accession, separator, original_id = subject_id.partition(BATCH_TAG_SEPARATOR)
+    if not separator:
+        return None, subject_id
+    return accession, original_id
+
 
+def demultiplex_tabular(file_path, accessions):
+    """Splits the tabular results of a blast batch. Returns a HSPTable per accession"""
+    tables = {accession: HSPTable() for accession in accessions}
+    batch_table = HSPTable.from_tabular(file_path)
+    for i in range(len(batch_table)):
+        accession, original_id = _untag(batch_table.subjects[batch_table["subject"][i]])
+        if accession not in tables:
+            continue
+        tables[accession].append(original_id, *(batch_table[name][i] for name, _ in HSPTable.COLUMNS[:-1]))
+    return tables
 
-def print_spaces(n):
-    for _ in range(n):
-        print(' ', end='')
 
+def demultiplex_pairwise_report(report_file, output_files):
+    """Splits a pairwise blast report (outfmt 0) of a blast batch into one report per accession.
+    output_files maps each accession to its report. Tags are removed from the tig identifiers."""
+    preamble, table, footer = [], [], []
+    blocks = {accession: [] for accession in output_files}
+    section = "preamble"
+    current = None
+    with open(report_file, "r") as f:
+        for line in f:
+            if section in ("preamble", "table") and line.startswith("> "):
+                section = "blocks"
+            elif section == "blocks" and line.startswith("Lambda"):
+                section = "footer"
 
-def visualize_matches(query_ACGT, query_name, query_length, matched_positions, print_abundance=False):
-    nb_chars_before_line = 9
+            if section == "preamble":
+                preamble.append(line)
+                if line.startswith("Sequences producing significant alignments"):
+                    section = "table"
+            elif section == "table":
+                accession, _ = _untag(line.split()[0]) if line.strip() else (None, None)
+                table.append((accession, line))
+            elif section == "blocks":
+                if line.startswith("> "):
+                    current, _ = _untag(line[2:].split()[0])
+                if current in blocks:
+                    blocks[current].append(line)
+            else:
+                footer.append(line)
+
+    head_length = next((i + 1 for i, line in enumerate(preamble) if line.startswith("Length=")), len(preamble))
+    for accession, output_file in output_files.items():
+        tag = f"{accession}{BATCH_TAG_SEPARATOR}"
+        with open(output_file, "w") as out:
+            if not blocks[accession]:
+                out.writelines(preamble[:head_length])
+                out.write("\n\n***** No hits found *****\n\n\n\n")
+            else:
+                out.writelines(preamble)
+                out.writelines(line.replace(tag, "", 1) for line_accession, line in table
+                               if line_accession in (None, accession))
+                out.writelines(line.replace(tag, "", 1) if line.startswith("> ") else line
+                               for line in blocks[accession])
+            out.writelines(footer)
+
+
+# Symbols of the synth match lines, indexed by the coverage of a position clipped to
+# MAX_SYNTH_COVERAGE: '-' for uncovered positions, then 'a' to 'z' and 'Z' beyond 26 alignments
+MAX_SYNTH_COVERAGE = 27
+_ABUNDANCE_SYMBOLS = b"-" + bytes(range(ord("a"), ord("z") + 1)) + b"Z" * (256 - MAX_SYNTH_COVERAGE)
+_PRESENCE_SYMBOLS = b"-" + b"|" * 255
+# Number of query lines written to the output stream at once
+SYNTH_BLOCK_LINES = 1024
+
+
+def synth_symbols(matched_positions, print_abundance=False):
+    """Match line of a coverage array: with print_abundance, the number of alignments covering
+    each position as a letter, else '|' for covered positions"""
+    clipped = bytes(map(min, matched_positions, repeat(MAX_SYNTH_COVERAGE)))
+    return clipped.translate(_ABUNDANCE_SYMBOLS if print_abundance else _PRESENCE_SYMBOLS).decode("ascii")
+
+
+def visualize_matches(query_ACGT, query_name, query_length, matched_positions, print_abundance=False, out=None):
+    """Prints the query and its matched positions. Writes to `out` (default: sys.stdout)
+    by blocks of SYNTH_BLOCK_LINES lines"""
+    if out is None:
+        out = sys.stdout
     nb_chars_for_len = len(str(query_length))
-    nb_chars_before_line += nb_chars_for_len
+    margin = " " * (9 + nb_chars_for_len)
     len_line = 80
-    print(f"Query: {query_name}")
+    symbols = synth_symbols(matched_positions, print_abundance)
+    block = [f"Query: {query_name}\n"]
     pos = 0
     while True:
-        diff = len(str(query_length)) - len(str(pos + 1))
-        print("query  ", end='')
-        print_spaces(diff)
-        print(f"{pos + 1}  ", end='')
-        if pos + len_line < query_length:
-            print(query_ACGT[pos: pos + len_line])
-            print_spaces(nb_chars_before_line)
-            for v in matched_positions[pos: pos + len_line]:
-                print_value(v, print_abundance)
-            print("\n")
-            pos += len_line
-        else:
-            print(query_ACGT[pos:])
-            print_spaces(nb_chars_before_line)
-            for v in matched_positions[pos:]:
-                print_value(v, print_abundance)
-            print("\n")
+        end = pos + len_line if pos + len_line < query_length else None
+        block.append(f"query  {pos + 1:>{nb_chars_for_len}}  {query_ACGT[pos:end]}\n"
+                     f"{margin}{symbols[pos:end]}\n\n")
+        if end is None:
             break
+        pos = end
+        if len(block) >= SYNTH_BLOCK_LINES:
+            out.write("".join(block))
+            block.clear()
+    out.write("".join(block))
+
+
+def write_coverage_runs(query_name, coverage, out):
+    """Writes the coverage of the query positions run-length encoded, the compact form of a synth file:
+    `#query=` and `#length=` header lines, then a `<coverage>\t<number of positions>` line per run of
+    positions of equal coverage. Rendered as a synth file by `logan_blaster view`"""
+    out.write(f"#query={query_name}\n#length={len(coverage)}\n")
+    out.write("".join(f"{value}\t{sum(1 for _ in run)}\n" for value, run in groupby(coverage)))
 
 
-def run_blast_parser(fasta_file, blastn_file, abundance=False):
+def read_coverage_runs(file_path):
+    """Query name and coverage of the query positions of a run-length encoded synth file"""
+    query_name = None
+    query_length = None
+    coverage = array('I')
+    with open(file_path, 'r') as f:
+        for line in f:
+            if line.startswith("#query="):
+                query_name = line[len("#query="):].rstrip("\n")
+            elif line.startswith("#length="):
+                query_length = int(line[len("#length="):])
+            elif line.strip():
+                value, length = line.split("\t")
+                coverage.extend(array('I', [int(value)]) * int(length))
+    if query_length is None or len(coverage) != query_length:
+        raise ValueError(f"{file_path} is not a run-length encoded synth file, or is truncated")
+    return query_name, coverage
+
+
+def run_blast_parser(fasta_file, blastn_file, abundance=False, out=None, rle=False):
+    """Writes the synth visualisation of a pairwise blast report, or with rle its run-length encoded
+    coverage (see write_coverage_runs). Returns the coverage of the query positions"""
     query_ACGT = get_query_ACGT(fasta_file)
     query_name, query_length, matched_positions = parse_blastn(blastn_file)
     assert len(query_ACGT) == query_length, (
         f"Error, query given in {fasta_file} is of length {len(query_ACGT)}, "
         f"while the blastn result indicates a sequence of length {query_length}"
     )
-    visualize_matches(query_ACGT, query_name, query_length, matched_positions, print_abundance=abundance)
+    if rle:
+        write_coverage_runs(query_name, matched_positions, out if out is not None else sys.stdout)
+    else:
+        visualize_matches(query_ACGT, query_name, query_length, matched_positions, print_abundance=abundance, out=out)
+    return matched_positions
 
 
-def download_file(url, destination):
-    try:
-        context = ssl._create_unverified_context()
-        with urlopen(url, context=context) as response, open(destination, "wb") as f:
-            while chunk := response.read(8192):
-                f.write(chunk)
-    except Exception as e:
-        print(f"{RED}Error: Failed to download {url}.{NOCOLOR}")
-        print(e)
-        sys.exit(1)
+def compress_file(file_path):
+    """Replaces file_path by its zstd-compressed version, file_path.zst. Returns the compressed file"""
+    subprocess.run(["zstd", "-q", "-f", "--rm", file_path, "-o", f"{file_path}.zst"],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return f"{file_path}.zst"
 
 
-class LoganBlaster:
-    LOGAN_DIR_NAME = "logan_data"
-    ALIGNEMENT_DIR_NAME = "alignments"
-    INPUT_DATA_DIR_NAME = "input_data"
+def fasta_id(header):
+    """Identifier of a fasta header: its first word, usable as a file name"""
+    fields = header.strip().lstrip(">").split()
+    identifier = fields[0] if fields else "query"
+    return identifier.replace(os.sep, "_")
 
-    def __init__(self, session_id, accession_file, query_file, delete, unitigs, kmer_size, limit, output_dir):
-        self.session_id = session_id
-        self.accession_file = accession_file
-        self.query_file = query_file
-        self.delete = delete
-        self.unitigs = unitigs
+
+def split_query_file(fasta_file, directory):
+    """Writes each record of a multi-fasta file in its own file of directory.
+    Returns the list of (query id, query file)"""
+    queries = []
+    with open(fasta_file, "rb") as f:
+        records = list(iter_fasta_records(f))
+    query_ids = [fasta_id(header.decode()) for header, _ in records]
+    seen = set()
+    for query_id in query_ids:
+        if query_id in seen:
+            raise LoganBlasterError(f"Query identifier {query_id} is used by several sequences of {fasta_file}")
+        seen.add(query_id)
+    os.makedirs(directory, exist_ok=True)
+    for query_id, (header, seq) in zip(query_ids, records):
+        query_file = os.path.join(directory, f"{query_id}.fa")
+        with open(query_file, "wb") as out:
+            out.write(b"%s\n%s\n" % (header, seq))
+        queries.append((query_id, query_file))
+    return queries
+
+
+# --- K-mer recruitment ---
+_COMPLEMENT = bytes.maketrans(b"ACGT", b"TGCA")
+# Seeds of a QueryKmerIndex are sized so that about one m-mer in SEED_SPARSITY is a seed
+SEED_SPARSITY = 1024
+
+
+def is_url(source):
+    return source.startswith(("https://", "http://"))
+
+
+def iter_fasta_records(stream):
+    """Yields (header, sequence) from a binary fasta stream. Headers keep their '>'"""
+    header = None
+    chunks = []
+    for line in stream:
+        if line.startswith(b">"):
+            if header is not None:
+                yield header, b"".join(chunks)
+            header = line.rstrip()
+            chunks = []
+        else:
+            chunks.append(line.rstrip())
+    if header is not None:
+        yield header, b"".join(chunks)
+
+
+class QueryKmerIndex:
+    """Canonical k-mers of the query sequences.
+    Each k-mer is stored in both orientations, so that a k-mer of a tig is
+    looked up with a single hash query, without computing its canonical form.
+    `kmers` maps each k-mer to the bit mask of the queries containing it, and
+    `nb_kmers` gives the number of distinct canonical k-mers of each query.
+    `seeds` holds the m-mers (m = `seed_size` < k) of these k-mers: any k-mer of a
+    sequence contains an m-mer starting at a multiple of k - m + 1, so sequences
+    without seeds at these positions, most tigs, are rejected with few lookups."""
+
+    def __init__(self, fasta_file, kmer_size):
         self.kmer_size = kmer_size
-        self.limit = limit
-        self.main_dir_name = output_dir
-        self.type = "unitig" if unitigs else "contig"
-        self.failed_accession_list = ""
-        self.cli_installed = shutil.which("aws") is not None
+        self.kmers = {}
+        self.query_ids = []
+        self.nb_kmers = []
+        with open(fasta_file, "rb") as f:
+            for query_rank, (header, seq) in enumerate(iter_fasta_records(f)):
+                self.query_ids.append(fasta_id(header.decode()))
+                mask = 1 << query_rank
+                seq = seq.upper()
+                canonical_kmers = set()
+                for i in range(len(seq) - kmer_size + 1):
+                    kmer = seq[i: i + kmer_size]
+                    if kmer.translate(None, b"ACGT"):
+                        continue  # k-mers with non ACGT characters are ignored
+                    self.kmers[kmer] = self.kmers.get(kmer, 0) | mask
+                    rev_comp = kmer.translate(_COMPLEMENT)[::-1]
+                    self.kmers[rev_comp] = self.kmers.get(rev_comp, 0) | mask
+                    canonical_kmers.add(min(kmer, rev_comp))
+                self.nb_kmers.append(len(canonical_kmers))
+        self.seed_size = min(kmer_size - 1, math.ceil(math.log(max(len(self.kmers), 1) * SEED_SPARSITY, 4)))
+        self.seeds = set()
+        if self.seed_size > 0:
+            m = self.seed_size
+            for kmer in self.kmers:
+                self.seeds.update(kmer[i: i + m] for i in range(kmer_size - m + 1))
 
-    def _setup_directories(self):
-        if not self.main_dir_name:
-            if self.session_id:
-                self.main_dir_name = f"session_{self.session_id}"
-            else:
-                query_basename = os.path.basename(self.query_file).split(".")[0]
-                found_free_name = False
-                for i in range(1, 1001):
-                    candidate = f"{query_basename}_{i}"
-                    if not os.path.exists(candidate):
-                        self.main_dir_name = candidate
-                        found_free_name = True
-                        break
-                if not found_free_name:
-                    print(f"{RED}Error: Could not find a free directory name based on {query_basename} "
-                          f"after 1000 attempts. Please specify an output directory with --output.{NOCOLOR}")
-                    sys.exit(1)
+    def may_share_kmers(self, seq):
+        """False if seq (bytes, upper case) shares no k-mer with the query, checking its seeds only"""
+        m = self.seed_size
+        if m <= 0:
+            return True
+        stride = self.kmer_size - m + 1
+        return any(map(self.seeds.__contains__, [seq[i: i + m] for i in range(0, len(seq) - m + 1, stride)]))
 
-        os.makedirs(self.main_dir_name, exist_ok=True)
-        os.chdir(self.main_dir_name)
-        os.makedirs(self.LOGAN_DIR_NAME, exist_ok=True)
-        os.makedirs(self.ALIGNEMENT_DIR_NAME, exist_ok=True)
+    def count_shared_kmers(self, seq):
+        """Number of k-mers of seq (bytes, upper case) present in the query"""
+        if not self.may_share_kmers(seq):
+            return 0
+        k = self.kmer_size
+        return sum(map(self.kmers.__contains__, [seq[i: i + k] for i in range(len(seq) - k + 1)]))
 
-        if not self.unitigs:
-            self.failed_accession_list = "failed_accessions.txt"
-            Path(self.failed_accession_list).touch()
+    def shared_kmers(self, seq):
+        """{query rank: canonical k-mers of the query found in seq (bytes, upper case), with repetitions}"""
+        k = self.kmer_size
+        shared = {}
+        if not self.may_share_kmers(seq):
+            return shared
+        for i in range(len(seq) - k + 1):
+            kmer = seq[i: i + k]
+            mask = self.kmers.get(kmer, 0)
+            if not mask:
+                continue
+            kmer = min(kmer, kmer.translate(_COMPLEMENT)[::-1])
+            while mask:
+                query_rank = (mask & -mask).bit_length() - 1
+                shared.setdefault(query_rank, []).append(kmer)
+                mask &= mask - 1
+        return shared
 
-    def _setup_local_files(self, abs_query_file, abs_accession_file):
-        os.makedirs(self.INPUT_DATA_DIR_NAME, exist_ok=True)
-        shutil.copy(abs_query_file, self.INPUT_DATA_DIR_NAME)
-        shutil.copy(abs_accession_file, self.INPUT_DATA_DIR_NAME)
-        self.query_file = os.path.join(self.INPUT_DATA_DIR_NAME, os.path.basename(abs_query_file))
-        self.accession_file = os.path.join(self.INPUT_DATA_DIR_NAME, os.path.basename(abs_accession_file))
+    def sharing_queries(self, seq):
+        """Bit mask of the queries sharing at least one k-mer with seq (bytes, upper case)"""
+        k = self.kmer_size
+        mask = 0
+        if not self.may_share_kmers(seq):
+            return mask
+        for i in range(len(seq) - k + 1):
+            mask |= self.kmers.get(seq[i: i + k], 0)
+        return mask
 
-        if self.accession_file.endswith(".csv"):
-            accession_basename = self.accession_file.rstrip(".csv")
-            print(f"{YELLOW}[INFO] Extracting accession IDs from {accession_basename}.csv...{NOCOLOR}")
-            cmd_jq_acc = f"cat {accession_basename}.csv | tail -n +2 | cut -f 1 > {accession_basename}_acc.txt"
-            subprocess.run(cmd_jq_acc, shell=True, check=True)
-            self.accession_file = os.path.join(
-                self.INPUT_DATA_DIR_NAME, os.path.basename(f"{accession_basename}_acc.txt")
-            )
 
-    def _setup_session(self):
-        os.makedirs(self.INPUT_DATA_DIR_NAME, exist_ok=True)
-        os.chdir(self.INPUT_DATA_DIR_NAME)
-        accession_file = f"accessions_{self.session_id}.txt"
-        if not os.path.exists(accession_file):
-            zip_file = f"{self.session_id}.zip"
-            if not os.path.exists(zip_file):
-                print(f"{YELLOW}[INFO] Downloading session data for session ID {self.session_id}...{NOCOLOR}")
-                download_file(f"https://logan-search.org/api/download/{self.session_id}", zip_file)
-            else:
-                print(f"{YELLOW}[INFO] Using existing local version of {zip_file}...{NOCOLOR}")
+class QueryIndexCache:
+    """The QueryKmerIndex of the last max_size query files, shared by the runs of a process
+    and keyed by the content of the query file and the k-mer size"""
 
-            subprocess.run(["unzip", "-o", zip_file, "session.json"], check=True)
-            os.rename("session.json", f"{self.session_id}.json")
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._indexes = {}
+        self._lock = threading.Lock()
 
-            print(f"{YELLOW}[INFO] Extracting accession IDs from {self.session_id}.json...{NOCOLOR}")
-            cmd_jq_acc = f"jq -r '.. | ._metadata?.ID? // empty | .[]' {self.session_id}.json > {self.session_id}_acc.txt"
-            subprocess.run(cmd_jq_acc, shell=True, check=True)
+    def get(self, fasta_file, kmer_size):
+        key = (file_digest(fasta_file), kmer_size)
+        with self._lock:
+            index = self._indexes.pop(key, None)
+            if index is not None:
+                # Most recently used indexes are the last ones
+                self._indexes[key] = index
+                return index
+        index = QueryKmerIndex(fasta_file, kmer_size)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_size:
+                del self._indexes[next(iter(self._indexes))]
+        return index
 
-            print(f"{YELLOW}[INFO] Extracting query name and sequence from {self.session_id}.json...{NOCOLOR}")
-            with open(f"{self.session_id}_query.fa", "w") as f:
-                cmd_jq_name = f"jq -r '.. | ._query?._name? // empty' {self.session_id}.json"
-                query_name = subprocess.check_output(cmd_jq_name, shell=True, text=True).strip()
-                f.write(f">{query_name}\n")
 
-                cmd_jq_seq = f"jq -r '.. | ._query?._seq? // empty' {self.session_id}.json"
-                query_seq = subprocess.check_output(cmd_jq_seq, shell=True, text=True).strip()
-                f.write(f"{query_seq}\n")
+def recruit_sequences(stream, index, out, stats=None):
+    """Writes to out the fasta records of stream sharing at least one k-mer with the index.
+    As back_to_sequences, the number of shared k-mers is appended to the header.
+    Coverage statistics of the scanned sequences are added to stats (a CoverageStats) if given.
+    Returns the number of scanned and recruited sequences."""
+    nb_scanned = 0
+    nb_recruited = 0
+    for header, seq in iter_fasta_records(stream):
+        nb_scanned += 1
+        if stats is not None:
+            stats.add(header, len(seq))
+        nb_shared = index.count_shared_kmers(seq.upper())
+        if nb_shared > 0:
+            nb_recruited += 1
+            out.write(b"%s %d\n%s\n" % (header, nb_shared, seq))
+    return nb_scanned, nb_recruited
 
-        os.chdir("..")
-        self.accession_file = os.path.join(self.INPUT_DATA_DIR_NAME, f"{self.session_id}_acc.txt")
-        self.query_file = os.path.join(self.INPUT_DATA_DIR_NAME, f"{self.session_id}_query.fa")
 
-    def _run_coverage_stats(self, fasta_file, label):
-        if shutil.which("count_logan_tig_coverage") is None:
-            return
-        print(f"{YELLOW}[INFO] Coverage statistics for {label}:{NOCOLOR}")
-        cmd = ["count_logan_tig_coverage", "--in", fasta_file]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"{YELLOW}[WARNING] count_logan_tig_coverage failed: {result.stderr.strip()}{NOCOLOR}")
+class TigsStream:
+    """Decompressed fasta stream of Logan tigs, read from an URL, a .zst file or a plain file.
+    `stream` is a binary file object. Once closed, `error` describes any failure of the
+    transfer or of the decompression (None if everything went fine), `bytes_transferred`
+    is the size of the compressed data read from the URL and `rusage` the resources used by zstd.
+    With copy, an URL is also decompressed by a second zstd, whose output is the `copy` stream and
+    must be read to its end as well, along with `stream`."""
+
+    def __init__(self, source, copy=False):
+        self.source = source
+        self.error = None
+        self._zstd = None
+        self._copy_zstd = None
+        self._pump = None
+        self._pump_errors = []
+        self.bytes_transferred = 0
+        self.rusage = None
+        self.copy_rusage = None
+        self.copy = None
+        if is_url(source):
+            response = urlopen(source, context=ssl._create_unverified_context())
+            self._zstd = subprocess.Popen(["zstd", "-dcq"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.PIPE)
+            if copy:
+                self._copy_zstd = subprocess.Popen(["zstd", "-dcq"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                   stderr=subprocess.DEVNULL)
+                self.copy = self._copy_zstd.stdout
+            self._pump = threading.Thread(target=self._pump_response, args=(response,), daemon=True)
+            self._pump.start()
+            self.stream = self._zstd.stdout
+        elif source.endswith(".zst"):
+            self._zstd = subprocess.Popen(["zstd", "-dcq", source], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.stream = self._zstd.stdout
         else:
-            for line in result.stdout.splitlines():
-                print(f"  {line}")
+            self.stream = open(source, "rb")
 
-    def _run_blast(self, query_fasta, target_fasta):
-        query_basename = os.path.basename(query_fasta).split(".")[0]
-        target_basename = os.path.basename(target_fasta).split(".")[0]
-        with open(query_fasta, "r") as f:
-            query_id = f.readline().strip().lstrip(">").split()[0]
+    def _pump_response(self, response):
+        try:
+            with response:
+                while chunk := response.read(STREAM_BUFFER_SIZE):
+                    self._zstd.stdin.write(chunk)
+                    if self._copy_zstd is not None:
+                        self._copy_zstd.stdin.write(chunk)
+                    self.bytes_transferred += len(chunk)
+        except Exception as e:
+            self._pump_errors.append(f"Transfer of {self.source} interrupted: {e}")
+        finally:
+            for zstd in (self._zstd, self._copy_zstd):
+                if zstd is not None:
+                    try:
+                        zstd.stdin.close()
+                    except BrokenPipeError:
+                        pass
 
-        output_name = f"{query_id}_vs_{target_basename}.txt"
-        print(f"{YELLOW}[INFO] Aligning {target_basename} vs {query_basename}...{NOCOLOR}")
+    def close(self):
+        self.stream.close()
+        if self.copy is not None:
+            self.copy.close()
+        if self._pump is not None:
+            self._pump.join()
+        if self._copy_zstd is not None:
+            _, self.copy_rusage = wait_rusage(self._copy_zstd)
+        if self._zstd is not None:
+            zstd_stderr = self._zstd.stderr.read().decode(errors="replace")
+            self._zstd.stderr.close()
+            _, self.rusage = wait_rusage(self._zstd)
+            if self._zstd.returncode != 0:
+                self.error = f"zstd failed on {self.source}: {zstd_stderr.strip()}"
+            elif self._pump_errors:
+                self.error = self._pump_errors[0]
 
-        cmd = [
-            "blastn",
-            "-query", query_fasta,
-            "-subject", target_fasta,
-            "-out", os.path.join(self.ALIGNEMENT_DIR_NAME, output_name),
-            "-outfmt", "0",
-            "-sorthits", "0",
-            "-word_size", "11",
-            "-gapextend", "2",
-            "-gapopen", "5",
-            "-reward", "2",
-            "-penalty", "-3"
-        ]
+    def __enter__(self):
+        return self
 
-        print(f"{GREEN}Running command: {' '.join(cmd)}{NOCOLOR}")
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Coverage statistics ---
+_LOGAN_ABUNDANCE = re.compile(rb"\bka:f:([0-9.eE+-]+)")
+# A header line, with its abundance when it follows an identifier without ':' as in Logan headers, and is
+# then the abundance found by _LOGAN_ABUNDANCE ('>' only starts header lines in a fasta stream)
+_LOGAN_HEADER = re.compile(rb">[^ :\n]*(?: ka:f:([0-9.eE+-]+))?[^\n]*\n")
+
+
+def _sequence_length(data, start, end):
+    """Number of bases of data[start:end], a part of a fasta sequence"""
+    return end - start - data.count(b"\n", start, end) - data.count(b"\r", start, end)
+
+
+class CoverageStats:
+    """Streaming coverage statistics of Logan tigs, from the average k-mer abundance
+    (ka:f:) of their headers. The median is approximated from a histogram of
+    logarithmic bins, within MEDIAN_RELATIVE_ERROR."""
+
+    MEDIAN_RELATIVE_ERROR = 0.01
+
+    def __init__(self):
+        self.nb_tigs = 0
+        self.total_length = 0
+        self.nb_with_abundance = 0
+        self.abundance_sum = 0.0
+        self.weighted_abundance_sum = 0.0
+        self.length_with_abundance = 0
+        self.min_abundance = None
+        self.max_abundance = None
+        self._bins = {}
+        self._log_base = math.log1p(2 * self.MEDIAN_RELATIVE_ERROR)
+        self._header = None
+        self._length = 0
+        self._rest = b""
+
+    def add(self, header, length):
+        """Accounts for a tig given its header (bytes) and sequence length"""
+        self.nb_tigs += 1
+        self.total_length += length
+        match = _LOGAN_ABUNDANCE.search(header)
+        if match is None:
+            return
         try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=open("error.log", "w"))
-        except subprocess.CalledProcessError:
-            print(f"{RED}Error: blastn failed{NOCOLOR}")
-            with open("error.log", "r") as f:
-                print(f.read())
+            abundance = float(match.group(1))
+        except ValueError:
             return
+        self.nb_with_abundance += 1
+        self.abundance_sum += abundance
+        self.weighted_abundance_sum += abundance * length
+        self.length_with_abundance += length
+        if self.min_abundance is None or abundance < self.min_abundance:
+            self.min_abundance = abundance
+        if self.max_abundance is None or abundance > self.max_abundance:
+            self.max_abundance = abundance
+        bin_index = math.floor(math.log(abundance) / self._log_base) if abundance > 0 else None
+        self._bins[bin_index] = self._bins.get(bin_index, 0) + 1
 
-        print(f"{YELLOW}[INFO] Synthesize blast results{NOCOLOR}")
-        blastn_file = os.path.join(self.ALIGNEMENT_DIR_NAME, output_name)
-        synth_file = os.path.join(self.ALIGNEMENT_DIR_NAME, f"synth_{output_name}")
-        with open(synth_file, "w") as f:
-            sys.stdout = f
-            run_blast_parser(self.query_file, blastn_file, abundance=True)
-            sys.stdout = sys.__stdout__
-
-    def _process_accessions(self):
-        counter = 0
+    def _add_tigs(self, abundances, lengths):
+        """Accounts for tigs, all with an abundance, given their abundances (floats) and sequence lengths,
+        as add() does one by one"""
+        self.nb_tigs += len(lengths)
+        self.total_length += sum(lengths)
+        self.nb_with_abundance += len(abundances)
+        self.length_with_abundance += sum(lengths)
+        for abundance, length in zip(abundances, lengths):
+            self.abundance_sum += abundance
+            self.weighted_abundance_sum += abundance * length
+            bin_index = math.floor(math.log(abundance) / self._log_base) if abundance > 0 else None
+            self._bins[bin_index] = self._bins.get(bin_index, 0) + 1
+        low, high = min(abundances), max(abundances)
+        if self.min_abundance is None or low < self.min_abundance:
+            self.min_abundance = low
+        if self.max_abundance is None or high > self.max_abundance:
+            self.max_abundance = high
 
-        with open(self.accession_file, "r") as f:
-            for accession in f:
-                accession = accession.strip().split()[0]
+    def feed(self, chunk):
+        """Accounts for a chunk of a fasta stream, split anywhere. Call close() at the end of the stream.
 
-                if self.limit != 0 and counter >= self.limit:
-                    print(f"\n{YELLOW}[INFO] Reached limit of {self.limit} accessions. Stopping further processing.{NOCOLOR}")
-                    break
-                counter += 1
-
-                print(f"\n{BLUE}=========================================={NOCOLOR}")
-                print(f"{CYAN}>>> Processing accession: {accession} <<<{NOCOLOR}")
-                print(f"{BLUE}=========================================={NOCOLOR}")
-
-                local_file = os.path.join(self.LOGAN_DIR_NAME, f"{accession}.{self.type}s.fa.zst")
-                print(f"{YELLOW}[INFO] Checking for local file {local_file}...{NOCOLOR}")
-                if not os.path.exists(local_file):
-                    print(f"{YELLOW}[INFO] Downloading {accession}.{self.type}s.fa.zst...{NOCOLOR}")
-                    if self.cli_installed:
-                        if not self.unitigs:
-                            cmd_dl = f"aws s3 cp s3://logan-pub/c/{accession}/{accession}.contigs.fa.zst . --no-sign-request"
-                        else:
-                            cmd_dl = f"aws s3 cp s3://logan-pub/u/{accession}/{accession}.unitigs.fa.zst . --no-sign-request"
-                    else:
-                        if not self.unitigs:
-                            cmd_dl = f"wget https://s3.amazonaws.com/logan-pub/c/{accession}/{accession}.contigs.fa.zst"
-                        else:
-                            cmd_dl = f"wget https://s3.amazonaws.com/logan-pub/u/{accession}/{accession}.unitigs.fa.zst"
+        Only the complete lines of the chunk are read: a partial last line is carried over to the next
+        chunk (in _rest), so that a header line is always read whole. The tig of the last header of the
+        chunk is pending (_header, _length): the bases of the next chunks, up to their first header, are
+        added to its length. The length of a tig is the number of bytes between its header line and the
+        next one, less the line breaks of its sequence, which can span any number of lines.
 
-                    print(f"{GREEN}Running command: {cmd_dl}{NOCOLOR}")
-                    for attempt in range(3):
-                        try:
-                            subprocess.run(cmd_dl, shell=True, check=True)
-                            break
-                        except subprocess.CalledProcessError:
-                            print(f"{YELLOW}[WARNING] Attempt {attempt + 1} download failed for {accession}.{self.type}s.fa.zst. {NOCOLOR}")
-
-                    if not os.path.exists(f"{accession}.{self.type}s.fa.zst"):
-                        print(f"{RED}Error: Failed to download {accession}.{self.type}s.fa.zst after 3 attempts.{NOCOLOR}")
-                        if not self.unitigs:
-                            print(f"{YELLOW}[INFO] Contigs do not exist for accession {accession}. Adding {accession} to failed accession list.{NOCOLOR}")
-                            with open(self.failed_accession_list, "a") as f:
-                                f.write(f"{accession}\n")
-                        continue
-                    shutil.move(f"{accession}.{self.type}s.fa.zst", self.LOGAN_DIR_NAME)
-                else:
-                    print(f"{YELLOW}[INFO] Using existing local version of {local_file}...{NOCOLOR}")
-
-                self._run_coverage_stats(local_file, f"downloaded {self.type}s ({accession})")
-
-                recruited_file = os.path.join(self.LOGAN_DIR_NAME, f"{accession}.recruited_{self.type}s.fa")
-                print(f"{YELLOW}[INFO] Recruiting sequences from {accession}.{self.type}s.fa.zst with a match with {self.query_file}...{NOCOLOR}")
-                cmd_recruit = [
-                    "back_to_sequences",
-                    "--kmer-size", str(self.kmer_size),
-                    "--in-kmers", self.query_file,
-                    "--in-sequences", local_file,
-                    "--out-sequences", recruited_file
-                ]
-                print(f"{GREEN}Running command: {' '.join(cmd_recruit)}{NOCOLOR}")
+        Tigs are found by scanning header lines only. When the tigs between the first and the last header
+        of the chunk all have a Logan abundance and single line sequences (checked by counting the line
+        breaks between these headers, see below), their lengths are read from the header offsets and they
+        are accounted for by _add_tigs(). Otherwise, they are measured and accounted for one by one."""
+        data = self._rest + chunk
+        end = data.rfind(b"\n") + 1
+        self._rest = data[end:]
+        headers = list(_LOGAN_HEADER.finditer(data, 0, end))
+        if not headers:
+            self._length += _sequence_length(data, 0, end)
+            return
+        self._length += _sequence_length(data, 0, headers[0].start())
+        if self._header is not None:
+            self.add(self._header, self._length)
+        complete = headers[:-1]
+        if complete:
+            # Offsets of the sequence of each complete tig: from the end of its header line to the next header
+            starts = [header.end() for header in complete]
+            stops = [header.start() for header in headers[1:]]
+            sizes = [stop - start for start, stop in zip(starts, stops)]
+            abundances = [header.group(1) for header in complete]
+            # Each non empty sequence ends with a line break. It has no other one, for all the tigs, when the
+            # line breaks between the first and the last header are those of the headers in between and
+            # one per tig
+            single_lines = (min(sizes) > 0 and b"\r" not in data
+                            and data.count(b"\n", starts[0], stops[-1]) == (len(complete) - 1) + len(complete))
+            if single_lines and None not in abundances:
                 try:
-                    subprocess.run(cmd_recruit, check=True, stdout=subprocess.DEVNULL, stderr=open("error.log", "w"))
-                except subprocess.CalledProcessError:
-                    print(f"{RED}Error: back_to_sequences failed for accession {accession}.{NOCOLOR}")
-                    try:
-                        os.remove(recruited_file)
-                        os.remove(local_file)
-                    except FileNotFoundError:
-                        pass
-                    with open("error.log", "r") as f:
-                        print(f.read())
-                    with open(self.failed_accession_list, "a") as f:
-                        f.write(f"{accession}\n")
-                    continue
+                    abundances = [float(abundance) for abundance in abundances]
+                except ValueError:
+                    single_lines = False
+            if single_lines and None not in abundances:
+                self._add_tigs(abundances, [size - 1 for size in sizes])
+            else:
+                for header, start, stop in zip(complete, starts, stops):
+                    self.add(header.group(), _sequence_length(data, start, stop))
+        last = headers[-1]
+        self._header = data[last.start(): last.end() - 1]
+        self._length = _sequence_length(data, last.end(), end)
 
-                if os.path.getsize(recruited_file) == 0:
-                    print(f"{YELLOW}[INFO]\tNo sequences were recruited from {accession}.{self.type}s.fa.zst. Skipping BLAST step.{NOCOLOR}")
-                    if self.delete:
-                        print(f"{YELLOW}[INFO] Deleting {recruited_file} and {local_file}...{NOCOLOR}")
-                        try:
-                            os.remove(recruited_file)
-                            os.remove(local_file)
-                        except FileNotFoundError:
-                            pass
-                    if self.type == "contig":
-                        with open(self.failed_accession_list, "a") as f:
-                            f.write(f"{accession}\n")
-                    continue
+    def feed_stream(self, stream):
+        """Accounts for a whole fasta stream, read in chunks"""
+        while chunk := stream.read(STREAM_BUFFER_SIZE):
+            self.feed(chunk)
+        self.close()
+
+    def close(self):
+        if self._rest:
+            self.feed(b"\n")
+        if self._header is not None:
+            self.add(self._header, self._length)
+            self._header = None
+
+    @classmethod
+    def from_fasta(cls, fasta_file):
+        stats = cls()
+        with open(fasta_file, "rb") as f:
+            for header, seq in iter_fasta_records(f):
+                stats.add(header, len(seq))
+        return stats
+
+    def median(self):
+        if not self.nb_with_abundance:
+            return None
+        half = self.nb_with_abundance / 2
+        seen = 0
+        for bin_index in sorted(self._bins, key=lambda b: -math.inf if b is None else b):
+            seen += self._bins[bin_index]
+            if seen >= half:
+                break
+        if bin_index is None:
+            return 0.0
+        # Geometric center of the bin, clipped to the observed values
+        median = math.exp((bin_index + 0.5) * self._log_base)
+        return min(max(median, self.min_abundance), self.max_abundance)
+
+    def record(self):
+        """Statistics as a json-serializable dict"""
+        with_abundance = self.nb_with_abundance
+        return {
+            "nb_tigs": self.nb_tigs,
+            "total_length": self.total_length,
+            "mean_coverage": self.abundance_sum / with_abundance if with_abundance else None,
+            "weighted_mean_coverage": (self.weighted_abundance_sum / self.length_with_abundance
+                                       if self.length_with_abundance else None),
+            "median_coverage": self.median(),
+            "min_coverage": self.min_abundance,
+            "max_coverage": self.max_abundance,
+        }
+
+    def summary(self):
+        record = self.record()
+        if record["mean_coverage"] is None:
+            return f"{self.nb_tigs} tigs, {self.total_length} bp, no coverage information"
+        return (f"{self.nb_tigs} tigs, {self.total_length} bp, mean coverage {record['mean_coverage']:.2f}, "
+                f"median coverage {record['median_coverage']:.2f}")
+
+
+# --- Coverage matrix ---
+_NONZERO_BYTES = b"\x00" + b"\x01" * 255
+
+
+class CoverageMatrix:
+    """Accession x query position coverage of a query, in a .npy file of unsigned 16-bit integers
+    (coverages are clipped to MAX_COVERAGE) that can be memory-mapped, e.g. by numpy.load(mmap_mode="r").
+    Row i is the coverage of the i-th accession of the accession index, a text file with one accession
+    per line next to the matrix. Rows are appended as accessions are synthesized; the header has a fixed
+    size and is rewritten after each row, so that an interrupted run leaves a readable matrix.
+
+    Positions given to the query methods are 1-based and inclusive, like blast coordinates."""
+
+    HEADER_SIZE = 128
+    MAGIC = b"\x93NUMPY\x01\x00"
+    DESCR = "<u2"
+    MAX_COVERAGE = 0xFFFF
+
+    def __init__(self, file_path, query_length):
+        """Use create() to write a matrix and open() to query it"""
+        self.file_path = file_path
+        self.index_path = self.index_file(file_path)
+        self.query_length = query_length
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self.accessions = []
+        self._rows = {}
+
+    @staticmethod
+    def index_file(file_path):
+        return f"{file_path[:-len('.npy')] if file_path.endswith('.npy') else file_path}.accessions.txt"
+
+    @property
+    def row_size(self):
+        return 2 * self.query_length
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-                self._run_coverage_stats(recruited_file, f"recruited {self.type}s ({accession})")
+    @classmethod
+    def _read_header(cls, f):
+        header = f.read(cls.HEADER_SIZE)
+        if len(header) < len(cls.MAGIC) + 2 or header[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError(f"{f.name} is not a coverage matrix")
+        fields = ast.literal_eval(header[len(cls.MAGIC) + 2:].decode("latin1"))
+        if fields.get("descr") != cls.DESCR or fields.get("fortran_order") or len(fields.get("shape", ())) != 2:
+            raise ValueError(f"{f.name} is not a coverage matrix")
+        return fields["shape"]
 
-                print(f"{YELLOW}[INFO] Aligning recruited sequences from {accession}.{self.type}s.fa.zst with {self.query_file}...{NOCOLOR}")
-                self._run_blast(self.query_file, recruited_file)
+    def _write_header(self):
+        fields = f"{{'descr': '{self.DESCR}', 'fortran_order': False, 'shape': ({len(self.accessions)}, {self.query_length}), }}"
+        length = self.HEADER_SIZE - len(self.MAGIC) - 2
+        header = self.MAGIC + length.to_bytes(2, "little") + fields.ljust(length - 1).encode("latin1") + b"\n"
+        os.pwrite(self._fd, header, 0)
 
-                if self.delete:
-                    print(f"{YELLOW}[INFO] Deleting {recruited_file} and {local_file}...{NOCOLOR}")
+    @classmethod
+    def create(cls, file_path, query_length):
+        """Opens a matrix for appending rows, created if needed. Rows missing from the accession
+        index or from the header (interrupted write) are dropped"""
+        matrix = cls(file_path, query_length)
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                nb_rows, length = cls._read_header(f)
+            if length != query_length:
+                raise ValueError(f"{file_path} stores a query of length {length}, not {query_length}")
+            accessions = []
+            if os.path.exists(matrix.index_path):
+                with open(matrix.index_path) as f:
+                    accessions = [line.strip() for line in f if line.strip()]
+            nb_rows = min(nb_rows, len(accessions), (os.path.getsize(file_path) - cls.HEADER_SIZE) // matrix.row_size)
+            matrix.accessions = accessions[:nb_rows]
+        matrix._rows = {accession: row for row, accession in enumerate(matrix.accessions)}
+        matrix._fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(matrix._fd, cls.HEADER_SIZE + len(matrix.accessions) * matrix.row_size)
+        with open(matrix.index_path, "w") as f:
+            f.writelines(f"{accession}\n" for accession in matrix.accessions)
+        matrix._write_header()
+        return matrix
+
+    @classmethod
+    def open(cls, file_path):
+        """Opens a matrix read-only, memory-mapped"""
+        with open(file_path, "rb") as f:
+            nb_rows, query_length = cls._read_header(f)
+            matrix = cls(file_path, query_length)
+            with open(matrix.index_path) as index:
+                matrix.accessions = [line.strip() for line in index if line.strip()][:nb_rows]
+            matrix._rows = {accession: row for row, accession in enumerate(matrix.accessions)}
+            matrix._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return matrix
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def add(self, accession, coverage):
+        """Stores the coverage of an accession (replacing its previous row, if any)"""
+        coverage = coverage[:self.query_length]
+        if max(coverage, default=0) > self.MAX_COVERAGE:
+            coverage = map(min, coverage, repeat(self.MAX_COVERAGE))
+        values = array("H", coverage)
+        values.extend(repeat(0, self.query_length - len(values)))
+        if sys.byteorder != "little":
+            values.byteswap()
+        with self._lock:
+            row = self._rows.get(accession, len(self.accessions))
+            os.pwrite(self._fd, values.tobytes(), self.HEADER_SIZE + row * self.row_size)
+            if row == len(self.accessions):
+                with open(self.index_path, "a") as f:
+                    f.write(f"{accession}\n")
+                self.accessions.append(accession)
+                self._rows[accession] = row
+                self._write_header()
+
+    def _bounds(self, start, end):
+        start = max(start or 1, 1)
+        end = min(end or self.query_length, self.query_length)
+        if start > end:
+            raise ValueError(f"Empty region {start}-{end} of a query of length {self.query_length}")
+        return start, end
+
+    def _row_bytes(self, accession, start, end):
+        offset = self.HEADER_SIZE + self._rows[accession] * self.row_size
+        return self._map[offset + 2 * (start - 1): offset + 2 * end]
+
+    def row(self, accession, start=None, end=None):
+        """Coverage of the region start-end of the query by an accession (array of unsigned integers)"""
+        start, end = self._bounds(start, end)
+        values = array("H")
+        values.frombytes(self._row_bytes(accession, start, end))
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def region(self, start=None, end=None, min_coverage=1):
+        """Accessions covering the region start-end: list of (accession, number of positions covered at
+        least min_coverage times, mean coverage over the region), the most covering accessions first"""
+        start, end = self._bounds(start, end)
+        results = []
+        for accession in self.accessions:
+            values = self.row(accession, start, end)
+            if min_coverage <= 1:
+                covered = len(values) - values.count(0)
+            else:
+                covered = sum(map(min_coverage.__le__, values))
+            if covered:
+                results.append((accession, covered, sum(values) / len(values)))
+        results.sort(key=lambda result: (-result[1], -result[2], result[0]))
+        return results
+
+    def top(self, n=10, start=None, end=None, min_coverage=1):
+        """The n accessions covering most positions of the region start-end"""
+        return self.region(start, end, min_coverage)[:n]
+
+    def breadth(self, start=None, end=None, min_coverage=1):
+        """Number of accessions covering each position of the region start-end at least min_coverage times"""
+        start, end = self._bounds(start, end)
+        length = end - start + 1
+        breadth = array("I", repeat(0, length))
+        # The 0/1 flags of the rows are summed as big integers with a 16-bit field per position,
+        # added to the breadth before the fields can overflow
+        low_bits = int.from_bytes(b"\x01\x00" * length, "little")
+        total = 0
+        for rank, accession in enumerate(self.accessions, 1):
+            if min_coverage <= 1:
+                flags = int.from_bytes(self._row_bytes(accession, start, end).translate(_NONZERO_BYTES), "little")
+                total += (flags | flags >> 8) & low_bits
+            else:
+                flags = array("H", map(min_coverage.__le__, self.row(accession, start, end)))
+                if sys.byteorder != "little":
+                    flags.byteswap()
+                total += int.from_bytes(flags.tobytes(), "little")
+            if rank % self.MAX_COVERAGE == 0 or rank == len(self.accessions):
+                counts = array("H")
+                counts.frombytes(total.to_bytes(2 * length, "little"))
+                if sys.byteorder != "little":
+                    counts.byteswap()
+                breadth = array("I", map(operator.add, breadth, counts))
+                total = 0
+        return breadth
+
+
+# --- Shared download cache ---
+_SIZE_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size):
+    """Number of bytes of a size such as 500M, 20G or 1048576"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * _SIZE_SUFFIXES[match.group(2).upper()])
+
+
+class DownloadCache:
+    """Directory of Logan tigs shared by several runs, keyed by accession and tig type.
+    Runs use cached files through hard links (symbolic links across file systems).
+    The least recently used files are evicted when the cache exceeds max_bytes (0: unbounded).
+    Files are added atomically and evictions are serialized with a lock file,
+    so that several runs can use the same cache simultaneously."""
+
+    LOCK_FILE_NAME = ".lock"
+
+    def __init__(self, directory, max_bytes=0):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, accession, tig_type):
+        return os.path.join(self.directory, f"{tig_type}s", f"{accession}.{tig_type}s.fa.zst")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self.directory, self.LOCK_FILE_NAME), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def claim(self, accession, tig_type):
+        """Serializes the downloads of the tigs of an accession: a run (or a thread) downloading tigs
+        missing from the cache holds the claim, the others wait for it and then find them in the cache"""
+        lock_file = os.path.join(os.path.dirname(self.path(accession, tig_type)), f".{accession}.{tig_type}s.lock")
+        os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+        with open(lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _link(source, destination):
+        try:
+            os.link(source, destination)
+        except OSError:
+            os.symlink(source, destination)
+
+    def fetch(self, accession, tig_type, destination):
+        """Links the cached tigs of accession to destination. Returns False if they are not cached"""
+        cached = self.path(accession, tig_type)
+        with self._locked():
+            if not os.path.exists(cached):
+                return False
+            os.utime(cached)  # the modification time records the last use
+            self._link(cached, destination)
+        return True
+
+    def add(self, file_path, accession, tig_type):
+        """Moves a downloaded file in the cache and replaces it by a link to the cached copy"""
+        cached = self.path(accession, tig_type)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix=f".{accession}.", dir=os.path.dirname(cached))
+        os.close(tmp_fd)
+        try:
+            shutil.move(file_path, tmp_path)
+            with self._locked():
+                os.replace(tmp_path, cached)
+                self._link(cached, file_path)
+                self._evict(keep=cached)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _cached_files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".fa.zst") and not name.startswith("."):
+                    path = os.path.join(root, name)
                     try:
-                        os.remove(recruited_file)
-                        os.remove(local_file)
+                        stat = os.stat(path)
                     except FileNotFoundError:
-                        pass
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
 
-    def run(self, abs_query_file=None, abs_accession_file=None):
-        self._setup_directories()
+    def _evict(self, keep):
+        if self.max_bytes <= 0:
+            return
+        files = sorted(self._cached_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+            print(f"{YELLOW}[INFO] Evicted {os.path.basename(path)} from the download cache.{NOCOLOR}")
 
-        if not self.session_id:
-            self._setup_local_files(abs_query_file, abs_accession_file)
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(STREAM_BUFFER_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def kmer_set_digest(fasta_file, kmer_size):
+    """Hash of the set of canonical k-mers of a fasta file: independent of the order,
+    the orientation and the multiplicity of the k-mers"""
+    kmers = set()
+    with open(fasta_file, "rb") as f:
+        for _, seq in iter_fasta_records(f):
+            seq = seq.upper()
+            for i in range(len(seq) - kmer_size + 1):
+                kmer = seq[i: i + kmer_size]
+                if not kmer.translate(None, b"ACGT"):
+                    kmers.add(min(kmer, kmer.translate(_COMPLEMENT)[::-1]))
+    return hashlib.sha256(b"\n".join(sorted(kmers))).hexdigest()
+
+
+class StageCache:
+    """Content-addressed cache of the outputs of pipeline stages (recruitment, alignment).
+    An entry is a directory named after the hash of the stage inputs and parameters,
+    holding copies of the stage output files. Entries are created atomically."""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(**inputs):
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry(key))
+
+    def fetch(self, key, outputs):
+        """Copies the files of an entry to their destinations (outputs maps names to paths).
+        Returns False if the entry does not exist"""
+        entry = self._entry(key)
+        if not all(os.path.exists(os.path.join(entry, name)) for name in outputs):
+            return False
+        for name, destination in outputs.items():
+            shutil.copyfile(os.path.join(entry, name), destination)
+        return True
+
+    def store(self, key, outputs):
+        """Stores copies of the output files of a stage (outputs maps names to paths)"""
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(prefix=f".{key}.", dir=os.path.dirname(entry))
+        try:
+            for name, source in outputs.items():
+                shutil.copyfile(source, os.path.join(tmp_entry, name))
+            os.rename(tmp_entry, entry)
+        except OSError:
+            pass  # stored simultaneously by another run
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+# --- Logan-Search sessions ---
+def walk_json(document):
+    """Objects (dicts) of a parsed json document, in document order (as jq's `..`)"""
+    stack = [document]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            yield node
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+
+
+class LoganSession:
+    """Query and accessions of a Logan-Search session. `metadata` maps each column of the
+    session results to its values, aligned with the accessions of its ID column."""
+
+    JSON_MEMBER = "session.json"
+
+    def __init__(self, query_name, query_seq, metadata):
+        self.query_name = query_name
+        self.query_seq = query_seq
+        self.metadata = metadata
+
+    @property
+    def accessions(self):
+        return self.metadata.get("ID", [])
+
+    @classmethod
+    def from_zip(cls, zip_file):
+        """Parses the session.json member of a session archive, without extracting it"""
+        with zipfile.ZipFile(zip_file) as archive, archive.open(cls.JSON_MEMBER) as f:
+            return cls.from_document(json.load(f))
+
+    @classmethod
+    def from_document(cls, document):
+        query_name = query_seq = None
+        metadata = {}
+        nb_rows = 0
+        for node in walk_json(document):
+            query = node.get("_query")
+            if query_name is None and isinstance(query, dict) and "_seq" in query:
+                query_name, query_seq = query.get("_name", "query"), query["_seq"]
+            block = node.get("_metadata")
+            if not isinstance(block, dict) or "ID" not in block:
+                continue
+            ids = block["ID"] if isinstance(block["ID"], list) else [block["ID"]]
+            for column, values in block.items():
+                values = values if isinstance(values, list) and len(values) == len(ids) else [values] * len(ids)
+                metadata.setdefault(column, [None] * nb_rows).extend(values)
+            nb_rows += len(ids)
+            for values in metadata.values():
+                values.extend([None] * (nb_rows - len(values)))
+        if query_seq is None:
+            raise ValueError("No query found in the session")
+        return cls(query_name, query_seq, metadata)
+
+    @classmethod
+    def fetch(cls, session_id, directory):
+        """Downloads and parses session session_id in directory. The parsed session is cached there,
+        the archive is read only once"""
+        parsed_file = os.path.join(directory, f"{session_id}.session.json")
+        if os.path.exists(parsed_file):
+            print(f"{YELLOW}[INFO] Using parsed session {parsed_file}...{NOCOLOR}")
+            return cls.load(parsed_file)
+        zip_file = os.path.join(directory, f"{session_id}.zip")
+        if not os.path.exists(zip_file):
+            print(f"{YELLOW}[INFO] Downloading session data for session ID {session_id}...{NOCOLOR}")
+            download_file(f"https://logan-search.org/api/download/{session_id}", zip_file)
         else:
-            self._setup_session()
+            print(f"{YELLOW}[INFO] Using existing local version of {zip_file}...{NOCOLOR}")
+        print(f"{YELLOW}[INFO] Extracting accession IDs and query from {zip_file}...{NOCOLOR}")
+        try:
+            session = cls.from_zip(zip_file)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            raise LoganBlasterError(f"Could not read session {session_id} from {zip_file}: {e}")
+        session.save(parsed_file)
+        return session
 
-        if not os.path.exists(self.query_file):
-            print(f"{RED}Error: Query file '{self.query_file}' does not exist.{NOCOLOR}")
-            shutil.rmtree(self.main_dir_name, ignore_errors=True)
-            sys.exit(1)
+    def save(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump({"query_name": self.query_name, "query_seq": self.query_seq, "metadata": self.metadata}, f)
 
-        if not os.path.exists(self.accession_file):
-            print(f"{RED}Error: Accessions file '{self.accession_file}' does not exist.{NOCOLOR}")
-            sys.exit(1)
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, "r") as f:
+            session = json.load(f)
+        return cls(session["query_name"], session["query_seq"], session["metadata"])
 
-        self._process_accessions()
+    def write_inputs(self, accession_file, query_file):
+        """Writes the accession list and the query fasta file"""
+        with open(accession_file, "w") as f:
+            f.writelines(f"{accession}\n" for accession in self.accessions)
+        with open(query_file, "w") as f:
+            f.write(f">{self.query_name}\n{self.query_seq.strip()}\n")
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Process Logan session or accession/query files.")
-    parser.add_argument("-s", "--session", type=str, help="Logan session ID")
-    parser.add_argument("-a", "--accessions", type=str, help="Path to accessions.txt file or .csv file (containing a first header line, ignored, and storing accessions as the first column)")
-    parser.add_argument("-q", "--query", type=str, help="Path to query fasta file")
-    parser.add_argument("-o", "--output", type=str, default=None, help="Output directory name (default: based on query name if using --accessions and --query or session ID if using --session)")
-    parser.add_argument("-u", "--unitigs", action="store_true", help="Use unitigs instead of contigs")
-    parser.add_argument("-k", "--kmer-size", type=int, default=17, help="K-mer size for sequence recruitment")
-    parser.add_argument("-l", "--limit", type=int, default=0, help="Limit number of accessions to process")
-    parser.add_argument("-d", "--delete", action="store_true", help="Delete intermediate files after processing")
-    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
-    args = parser.parse_args()
+# --- Accession ordering ---
+def read_accession_table(file_path):
+    """Columns of an accession table with a header line (comma, tab or semicolon separated):
+    {column: values}. Accessions are in the first column, whose name is returned with them"""
+    with open(file_path, "r", newline="") as f:
+        # The delimiter is the most frequent one of the header line
+        header_line = next((line for line in f if line.strip()), "")
+        delimiter = max("\t,;", key=header_line.count)
+        f.seek(0)
+        rows = [row for row in csv.reader(f, delimiter=delimiter) if row and row[0].strip()]
+    if not rows:
+        raise ValueError(f"{file_path} is empty")
+    header = [column.strip() for column in rows[0]]
+    columns = {column: [] for column in header}
+    for row in rows[1:]:
+        for column, value in zip(header, row + [""] * (len(header) - len(row))):
+            columns[column].append(value.strip())
+    return header[0], columns
 
-    # Argument checks
-    if not args.session and (not args.accessions or not args.query):
-        print(f"{RED}Error: You must provide either --session (-s) or both --accessions (-a) and --query (-q).{NOCOLOR}")
-        sys.exit(1)
 
-    if args.session and (args.accessions or args.query):
-        print(f"{RED}Error: --session (-s) cannot be combined with --accessions (-a) or --query (-q).{NOCOLOR}")
-        sys.exit(1)
+def order_accessions(accessions, ids, values):
+    """Accessions sorted by decreasing value of a metadata column, whose values are those of the
+    accessions ids. Accessions without a numeric value come last, and ties keep their order"""
+    scores = {}
+    for accession, value in zip(ids, values):
+        if accession in scores or isinstance(value, bool):
+            continue
+        try:
+            scores[accession] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return sorted(accessions, key=lambda accession: (accession not in scores, -scores.get(accession, 0)))
 
-    if args.kmer_size <= 0:
-        print(f"{RED}Error: K-mer size must be a positive integer.{NOCOLOR}")
-        sys.exit(1)
 
-    if args.limit < 0:
-        print(f"{RED}Error: Limit must be a non-negative integer.{NOCOLOR}")
-        sys.exit(1)
+# --- Run journal ---
+class RunJournal:
+    """Append-only journal (json lines) of the stages reached by the accessions of a run:
+    downloaded, recruited (with the number of queries to align), aligned and synthesized
+    (for each query), or failed. Used to resume interrupted runs."""
 
-    if shutil.which("count_logan_tig_coverage") is None:
-        print(f"{YELLOW}[WARNING] 'count_logan_tig_coverage' not found — coverage statistics will be skipped.{NOCOLOR}")
+    FILE_NAME = "run_journal.jsonl"
 
-    for cmd in ["back_to_sequences", "blastn", "jq"]:
-        if shutil.which(cmd) is None:
-            print(f"{RED}Error: '{cmd}' could not be found. Please install it and ensure it's in your PATH.{NOCOLOR}")
-            sys.exit(1)
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
 
-    # Resolve absolute paths before any os.chdir
-    abs_query_file = os.path.abspath(args.query) if args.query else None
-    abs_accession_file = os.path.abspath(args.accessions) if args.accessions else None
+    def record(self, accession, state, **details):
+        entry = dict(accession=accession, state=state, time=round(time.time(), 3), **details)
+        with self._lock:
+            with open(self.file_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
 
-    blaster = LoganBlaster(
-        session_id=args.session,
-        accession_file=args.accessions,
-        query_file=args.query,
+    @staticmethod
+    def replay(file_path):
+        """Progress of each accession of a journal: {accession: {"state", "nb_queries", "aligned", "synthesized"}}"""
+        progress = {}
+        if not os.path.exists(file_path):
+            return progress
+        with open(file_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # line truncated by an interruption
+                accession_progress = progress.setdefault(entry["accession"], RunJournal._new_progress())
+                state = entry["state"]
+                if state == "failed":
+                    accession_progress.update(RunJournal._new_progress())
+                elif state == "recruited":
+                    accession_progress["nb_queries"] = entry.get("nb_queries", 1)
+                elif state in ("aligned", "synthesized"):
+                    accession_progress[state].add(entry.get("query"))
+                accession_progress["state"] = state
+        return progress
+
+    @staticmethod
+    def _new_progress():
+        return {"state": None, "nb_queries": None, "aligned": set(), "synthesized": set()}
+
+    @staticmethod
+    def is_complete(accession_progress):
+        return (accession_progress["state"] != "failed"
+                and accession_progress["nb_queries"] is not None
+                and len(accession_progress["synthesized"]) >= accession_progress["nb_queries"])
+
+
+# --- Run metrics ---
+def wait_rusage(process):
+    """Waits for a subprocess.Popen. Returns (return code, resource usage of the process)"""
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return process.returncode, rusage
+
+
+def count_report_hsps(file_path):
+    """Number of HSPs of a pairwise blast report"""
+    with open(file_path, "rb") as f:
+        return f.read().count(b" Score = ")
+
+
+class RunMetrics:
+    """Per stage performance metrics of a run, written as json lines. Each stage of an accession
+    (download, recruitment, coverage, blast, synth) is measured with stage(); values of the
+    running stage of a thread, such as the resources used by its subprocesses, are added with add().
+    summary() appends the totals of each stage."""
+
+    # Values aggregated with max() instead of sum()
+    PEAK_VALUES = ("max_rss_bytes",)
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._current = threading.local()
+        self._totals = {}
+
+    @contextlib.contextmanager
+    def stage(self, accession, stage):
+        values = {}
+        previous = getattr(self._current, "values", None)
+        self._current.values = values
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield values
+        finally:
+            self._current.values = previous
+            # CPU time of logan_blaster itself, subprocesses are accounted by add_rusage()
+            values["thread_cpu_time"] = round(time.thread_time() - cpu_start, 3)
+            self.record(accession, stage, time.perf_counter() - start, values)
+
+    def add(self, **values):
+        """Adds values to the running stage of the calling thread, if any"""
+        current = getattr(self._current, "values", None)
+        if current is None:
+            return
+        for name, value in values.items():
+            if name in self.PEAK_VALUES:
+                current[name] = max(current.get(name, 0), value)
+            else:
+                current[name] = current.get(name, 0) + value
+
+    def add_rusage(self, rusage):
+        """Adds the CPU time and peak memory of a finished subprocess to the running stage"""
+        self.add(cpu_user_time=round(rusage.ru_utime, 3), cpu_system_time=round(rusage.ru_stime, 3),
+                 max_rss_bytes=rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024), subprocesses=1)
+
+    def record(self, accession, stage, wall_time, values):
+        entry = {"accession": accession, "stage": stage, "wall_time": round(wall_time, 3), **values}
+        if values.get("bytes_downloaded") and wall_time > 0:
+            entry["throughput_bytes_per_s"] = round(values["bytes_downloaded"] / wall_time)
+        with self._lock:
+            totals = self._totals.setdefault(stage, {"count": 0, "wall_time": 0.0})
+            totals["count"] += 1
+            totals["wall_time"] += wall_time
+            for name, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if name in self.PEAK_VALUES:
+                    totals[name] = max(totals.get(name, 0), value)
+                else:
+                    totals[name] = totals.get(name, 0) + value
+            with open(self.file_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def summary(self, wall_time=None):
+        """Appends and returns the totals of each stage. wall_time defaults to the time since the creation of the metrics"""
+        with self._lock:
+            stages = {}
+            for stage, totals in self._totals.items():
+                totals = {name: round(value, 3) if isinstance(value, float) else value for name, value in totals.items()}
+                cpu_time = totals.get("cpu_user_time", 0) + totals.get("cpu_system_time", 0) + totals.get("thread_cpu_time", 0)
+                if cpu_time and totals["wall_time"]:
+                    # Close to the number of busy cores when CPU-bound, close to 0 when waiting for I/O
+                    totals["cpu_per_wall"] = round(cpu_time / totals["wall_time"], 3)
+                if totals.get("bytes_downloaded") and totals["wall_time"]:
+                    totals["throughput_bytes_per_s"] = round(totals["bytes_downloaded"] / totals["wall_time"])
+                stages[stage] = totals
+            if wall_time is None:
+                wall_time = time.perf_counter() - self.start
+            summary = {"summary": True, "wall_time": round(wall_time, 3), "stages": stages}
+            with open(self.file_path, "a") as f:
+                f.write(json.dumps(summary) + "\n")
+        return summary
+
+    @classmethod
+    def merge(cls, input_files, file_path):
+        """Merges the metrics of several runs, such as the shards of a run, into file_path.
+        The wall time of the merged summary is the longest one of the runs. Returns the summary"""
+        merged = cls(file_path)
+        wall_time = 0.0
+        for input_file in input_files:
+            with open(input_file, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("summary"):
+                        wall_time = max(wall_time, entry["wall_time"])
+                        continue
+                    values = {name: value for name, value in entry.items()
+                              if name not in ("accession", "stage", "wall_time", "throughput_bytes_per_s")}
+                    merged.record(entry["accession"], entry["stage"], entry["wall_time"], values)
+        return merged.summary(wall_time)
+
+
+# --- HTTP downloads ---
+class HTTPDownloader:
+    """In-process downloader. Keep-alive connections are pooled per host and shared by all
+    threads, large objects are fetched as parallel byte ranges written in place, failed
+    requests are retried with an exponential backoff, and interrupted downloads are resumed
+    from the ranges already on disk (recorded next to the partial file)."""
+
+    def __init__(self, parts=4, part_size=32 << 20, retries=5, backoff=1.0, timeout=60):
+        self.parts = parts
+        self.part_size = part_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+
+    def _connection(self, scheme, netloc):
+        with self._idle_lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout, context=ssl._create_unverified_context())
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _release(self, url, connection, response):
+        """Returns the connection to the pool once the response is entirely read"""
+        if response.will_close or not response.isclosed():
+            connection.close()
+            return
+        parts = urlsplit(url)
+        with self._idle_lock:
+            self._idle.setdefault((parts.scheme, parts.netloc), []).append(connection)
+
+    @contextlib.contextmanager
+    def _get(self, url, first=None, last=None, method="GET"):
+        """GET request (of bytes first to last when given) following redirections. Yields the response"""
+        for _ in range(5):
+            parts = urlsplit(url)
+            connection = self._connection(parts.scheme, parts.netloc)
+            headers = {} if first is None else {"Range": f"bytes={first}-{last}"}
+            try:
+                connection.request(method, parts.path + (f"?{parts.query}" if parts.query else ""), headers=headers)
+                response = connection.getresponse()
+            except BaseException:
+                connection.close()
+                raise
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                response.read()
+                self._release(url, connection, response)
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            try:
+                yield response
+            except BaseException:
+                connection.close()
+                raise
+            self._release(url, connection, response)
+            return
+        raise OSError(f"Too many redirections for {url}")
+
+    @staticmethod
+    def _check_status(url, response, *expected):
+        if response.status in expected:
+            return
+        if response.status == 404:
+            error = FileNotFoundError(f"{url} not found (HTTP 404)")
+        else:
+            error = OSError(f"{url}: HTTP {response.status} {response.reason}")
+        error.retryable = response.status >= 500 or response.status == 429
+        raise error
+
+    def _with_retries(self, url, function, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return function(*args)
+            except (OSError, http.client.HTTPException) as e:
+                if not getattr(e, "retryable", True):
+                    raise
+                if attempt == self.retries:
+                    raise OSError(f"Failed to download {url} after {self.retries + 1} attempts: {e}") from e
+                delay = self.backoff * 2 ** attempt
+                print(f"{YELLOW}[WARNING] Attempt {attempt + 1} to download {url} failed ({e}), retrying in {delay:g}s.{NOCOLOR}")
+                time.sleep(delay)
+
+    @staticmethod
+    def _write_body(response, fd, offset, length=None):
+        """Writes the response body at offset of the file. Returns the number of bytes written"""
+        buffer = bytearray(STREAM_BUFFER_SIZE)
+        view = memoryview(buffer)
+        written = 0
+        while (n := response.readinto(buffer)) > 0:
+            os.pwrite(fd, view[:n], offset + written)
+            written += n
+        if length is not None and written != length:
+            raise http.client.IncompleteRead(b"", length - written)
+        return written
+
+    def size(self, url):
+        """Size in bytes of url, from a HEAD request. Raises FileNotFoundError if url does not exist"""
+        def head():
+            with self._get(url, method="HEAD") as response:
+                response.read()
+                self._check_status(url, response, 200)
+                length = response.getheader("Content-Length")
+            if length is None:
+                error = OSError(f"{url}: size unknown (no Content-Length)")
+                error.retryable = False
+                raise error
+            return int(length)
+        return self._with_retries(url, head)
+
+    def download(self, url, destination):
+        """Downloads url into destination. Raises FileNotFoundError if url does not exist,
+        OSError on any other failure (the partial download is then kept for a later resume)"""
+        partial = f"{destination}.part"
+        ranges_file = f"{partial}.ranges"
+        size, done = self._resume(url, partial, ranges_file)
+        if size is None:
+            size, done = self._with_retries(url, self._start, url, partial, ranges_file)
+        if size is not None:
+            todo = queue.Queue()
+            for first in range(0, size, self.part_size):
+                if first not in done:
+                    todo.put(first)
+            errors = []
+            ranges_lock = threading.Lock()
+            fd = os.open(partial, os.O_WRONLY)
+            try:
+                threads = [threading.Thread(target=self._range_worker,
+                                            args=(url, fd, size, todo, ranges_file, ranges_lock, errors), daemon=True)
+                           for _ in range(min(self.parts, todo.qsize()))]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            if errors:
+                raise errors[0]
+        os.replace(partial, destination)
+        if os.path.exists(ranges_file):
+            os.remove(ranges_file)
+
+    def _resume(self, url, partial, ranges_file):
+        """(size, first bytes of the downloaded ranges) of a previous partial download of url, (None, None) if none"""
+        if not (os.path.exists(partial) and os.path.exists(ranges_file)):
+            return None, None
+        with open(ranges_file, "r") as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+            done = {int(line) for line in lines[1:] if line}
+        except (IndexError, ValueError):
+            return None, None
+        if header.get("url") != url or header.get("part_size") != self.part_size or os.path.getsize(partial) != header.get("size"):
+            return None, None
+        print(f"{YELLOW}[INFO] Resuming the download of {url} ({len(done)} parts already downloaded).{NOCOLOR}")
+        return header["size"], done
+
+    def _start(self, url, partial, ranges_file):
+        """Downloads the first part of url and records its size. Returns (size, downloaded ranges),
+        or (None, None) when the server does not support byte ranges and the whole file was downloaded"""
+        with self._get(url, 0, self.part_size - 1) as response:
+            self._check_status(url, response, 200, 206, 416)
+            fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if response.status == 200:
+                    self._write_body(response, fd, 0, response.length)
+                    return None, None
+                if response.status == 416:
+                    # Empty object
+                    response.read()
+                    size = 0
+                else:
+                    size = int(response.getheader("Content-Range").rsplit("/", 1)[1])
+                    os.ftruncate(fd, size)
+                    self._write_body(response, fd, 0, min(self.part_size, size))
+            finally:
+                os.close(fd)
+        with open(ranges_file, "w") as f:
+            f.write(json.dumps({"url": url, "size": size, "part_size": self.part_size}) + "\n0\n")
+        return size, {0}
+
+    def _fetch_range(self, url, fd, first, last):
+        with self._get(url, first, last) as response:
+            self._check_status(url, response, 206)
+            self._write_body(response, fd, first, last - first + 1)
+
+    def _range_worker(self, url, fd, size, todo, ranges_file, ranges_lock, errors):
+        while not errors:
+            try:
+                first = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._with_retries(url, self._fetch_range, url, fd, first, min(first + self.part_size, size) - 1)
+            except Exception as e:
+                errors.append(e)
+                return
+            with ranges_lock:
+                with open(ranges_file, "a") as f:
+                    f.write(f"{first}\n")
+
+
+def download_file(url, destination):
+    try:
+        HTTPDownloader().download(url, destination)
+    except Exception as e:
+        raise LoganBlasterError(f"Failed to download {url}: {e}") from e
+
+
+# --- Resource scheduling ---
+# Rough sizing of the external tools, used to split the cores and memory of a run between them:
+# one blastn thread per BLAST_BYTES_PER_THREAD of recruited sequences (with --makeblastdb), and one back_to_sequences
+# thread per RECRUITMENT_BYTES_PER_THREAD of compressed tigs
+BLAST_BYTES_PER_THREAD = 8 << 20
+RECRUITMENT_BYTES_PER_THREAD = 512 << 20
+BLAST_BASE_MEMORY = 256 << 20
+RECRUITMENT_MEMORY = 1 << 30
+
+
+def blast_memory(target_size):
+    """Estimated memory of a blastn run against target_size bytes of sequences"""
+    return BLAST_BASE_MEMORY + 4 * target_size
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def physical_memory():
+    """Physical memory of the machine in bytes, 0 if unknown"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+class ResourceScheduler:
+    """Shares a budget of cores and memory (0: unbounded) between the concurrent stages of a run.
+    A stage asks for a number of threads with reserve(), and is granted as many of the free cores
+    as possible, at least one: large jobs use the whole machine when it is idle, while many small
+    jobs run in parallel. Memory is reserved as asked, waiting for other stages to release it;
+    requests larger than the budget are reduced to it so that every stage eventually runs."""
+
+    def __init__(self, threads, memory=0):
+        self.threads = threads
+        self.memory = memory
+        self._free_threads = threads
+        self._free_memory = memory
+        self._condition = threading.Condition()
+
+    def threads_for(self, size, bytes_per_thread):
+        """Number of threads wanted to process size bytes, one per bytes_per_thread, within the budget"""
+        return max(1, min(self.threads, -(-size // bytes_per_thread)))
+
+    @contextlib.contextmanager
+    def reserve(self, threads=1, memory=0):
+        """Reserves up to threads cores and memory bytes. Yields the number of granted threads"""
+        memory = min(memory, self.memory)
+        with self._condition:
+            self._condition.wait_for(lambda: self._free_threads > 0 and self._free_memory >= memory)
+            granted = max(1, min(threads, self._free_threads))
+            self._free_threads -= granted
+            self._free_memory -= memory
+        try:
+            yield granted
+        finally:
+            with self._condition:
+                self._free_threads += granted
+                self._free_memory += memory
+                self._condition.notify_all()
+
+
+# --- Scratch space ---
+class ScratchSpace:
+    """Disk budget of the intermediate files of a run (tigs and recruited sequences, named after
+    their accession in directory, by default the logan_data directory of the run). An accession holds its files from reserve(), before its download,
+    until release(); park() marks a held accession that only waits for other ones (its blast batch).
+    reserve() pauses a download until the files on disk plus the reserved downloads fit in max_bytes,
+    evicting first the files of the accessions released earliest, then leftovers of previous runs.
+    When nothing can be evicted and no other accession is being downloaded or processed, one paused
+    download proceeds over the budget rather than waiting forever."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._condition = threading.Condition()
+        # Bytes reserved for the download of each accession, until it is downloaded
+        self._reservations = {}
+        self._held = {}
+        self._released = {}
+
+    @staticmethod
+    def accession_of(file_name):
+        return file_name.split(".")[0]
+
+    def _files(self):
+        """{accession: [(path, size, mtime)]} of the intermediate files on disk"""
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                files.setdefault(self.accession_of(entry.name), []).append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def usage(self):
+        return sum(size for accession_files in self._files().values() for _, size, _ in accession_files)
+
+    def _used(self, files):
+        """Bytes of the files on disk and of the reserved downloads. A download in progress counts
+        once: its partial file (allocated to its full size as soon as it starts) is within its reservation"""
+        used = {accession: sum(size for _, size, _ in accession_files) for accession, accession_files in files.items()}
+        for accession, nbytes in self._reservations.items():
+            used[accession] = max(used.get(accession, 0), nbytes)
+        return sum(used.values())
+
+    def _eviction_candidate(self, files):
+        """Accession whose files are evicted first, None if all files are held"""
+        evictable = [accession for accession in files if accession not in self._held]
+        if not evictable:
+            return None
+        return min(evictable, key=lambda accession: (
+            accession not in self._released,
+            self._released.get(accession, 0),
+            max(mtime for _, _, mtime in files[accession])))
+
+    def reserve(self, accession, nbytes):
+        """Holds accession and reserves nbytes for the download of its tigs, waiting for room"""
+        with self._condition:
+            self._held[accession] = "waiting"
+            self._released.pop(accession, None)
+            while True:
+                files = self._files()
+                if self._used(files) + nbytes <= self.max_bytes:
+                    break
+                victim = self._eviction_candidate(files)
+                if victim is not None:
+                    print(f"{YELLOW}[INFO] Scratch space full: evicting the intermediate files of {victim}.{NOCOLOR}")
+                    for path, _, _ in files[victim]:
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
+                    self._released.pop(victim, None)
+                    continue
+                if all(state != "active" for state in self._held.values()):
+                    print(f"{YELLOW}[WARNING] Scratch space exceeded by {accession}: nothing else can be evicted.{NOCOLOR}")
+                    break
+                print(f"{YELLOW}[INFO] Scratch space full: download of {accession} paused.{NOCOLOR}")
+                self._condition.wait()
+            self._held[accession] = "active"
+            if nbytes:
+                self._reservations[accession] = nbytes
+
+    def downloaded(self, accession):
+        """Ends the reservation of the download of accession, whose file is now on disk (or failed)"""
+        with self._condition:
+            self._reservations.pop(accession, None)
+            self._condition.notify_all()
+
+    def park(self, accession):
+        with self._condition:
+            if accession in self._held:
+                self._held[accession] = "parked"
+            self._condition.notify_all()
+
+    def release_parked(self, accession):
+        """Releases accession if it is parked"""
+        with self._condition:
+            if self._held.get(accession) == "parked":
+                self.release(accession)
+
+    def release(self, accession):
+        """The files of accession are no longer needed and can be evicted"""
+        with self._condition:
+            if self._held.pop(accession, None) is not None:
+                self._released[accession] = time.monotonic()
+            self._condition.notify_all()
+
+
+# --- Sharding ---
+# Number of concurrent HEAD requests fetching the sizes of the tigs to balance the shards
+SHARD_SIZE_REQUESTS = 16
+
+
+def parse_shard(shard):
+    """(index, count) of a shard given as i/N, with 1 <= i <= N"""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", shard)
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"Invalid shard {shard}, expected i/N with 1 <= i <= N")
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_accessions(accessions, index, count, sizes=None):
+    """Accessions of shard index (1-based) of count, in their original order. The partition is
+    deterministic: without sizes, accessions are assigned by a hash of their name. With sizes
+    ({accession: bytes}), the largest accessions are assigned first, each to the least loaded
+    shard, so that shards download and align similar amounts of data"""
+    if sizes is None:
+        return [accession for accession in accessions if zlib.crc32(accession.encode()) % count == index - 1]
+    loads = [(0, 0, shard) for shard in range(count)]
+    assignment = {}
+    for accession in sorted(dict.fromkeys(accessions), key=lambda accession: (-sizes.get(accession, 0), accession)):
+        load, nb_accessions, shard = heapq.heappop(loads)
+        assignment[accession] = shard
+        heapq.heappush(loads, (load + sizes.get(accession, 0), nb_accessions + 1, shard))
+    return [accession for accession in accessions if assignment[accession] == index - 1]
+
+
+class LoganBlasterError(Exception):
+    """Invalid inputs or setup of a run"""
+
+
+class AccessionResult:
+    """Outcome of the search of the queries in an accession, yielded by LoganBlaster.results() once
+    its alignments are done. `status` is "aligned" (at least one query aligned), "not_aligned" (no
+    recruited tigs, or tigs dropped by the shared k-mer thresholds) or "failed" (download, recruitment
+    or alignments). The other attributes map each query id to: the number of HSPs covering each query
+    position (`coverage`, an array), the HSPTable of the alignment (`hsps`, None unless tabular), the
+    alignment and synth files (`files`) and the k-mers shared with the query (`shared_kmers`). `stats`
+    is the coverage statistics record of the downloaded and recruited tigs."""
+
+    def __init__(self, accession):
+        self.accession = accession
+        self.status = "not_aligned"
+        self.coverage = {}
+        self.hsps = {}
+        self.files = {}
+        self.shared_kmers = {}
+        self.stats = None
+        self.failed_queries = []
+
+    @property
+    def hits(self):
+        """Ids of the queries covered by at least one HSP"""
+        return [query_id for query_id, coverage in self.coverage.items() if coverage is not None and any(coverage)]
+
+    def record(self):
+        """JSON record of the result, with the number of HSPs (None unless tabular) and of covered
+        positions of each query instead of the HSPs and the coverage"""
+        return {
+            "accession": self.accession,
+            "status": self.status,
+            "hits": self.hits,
+            "nb_hsps": {query_id: len(hsps) if hsps is not None else None for query_id, hsps in self.hsps.items()},
+            "covered_positions": {query_id: sum(map(bool, coverage)) if coverage is not None else None
+                                  for query_id, coverage in self.coverage.items()},
+            "files": self.files,
+            "failed_queries": self.failed_queries,
+        }
+
+    def __repr__(self):
+        return f"AccessionResult({self.accession!r}, status={self.status!r}, hits={self.hits!r})"
+
+
+class LoganBlaster:
+    LOGAN_DIR_NAME = "logan_data"
+    ALIGNEMENT_DIR_NAME = "alignments"
+    INPUT_DATA_DIR_NAME = "input_data"
+    FAILED_ACCESSIONS_FILE_NAME = "failed_accessions.txt"
+    COVERAGE_STATS_FILE_NAME = "coverage_stats.jsonl"
+    COVERAGE_MATRIX_FILE_NAME = "coverage_matrix_{query}.npy"
+    SHARED_KMERS_FILE_NAME = "shared_kmers.jsonl"
+
+    def __init__(self, session_id, accession_file, query_file, delete, unitigs, kmer_size, limit, output_dir,
+                 download_workers=2, workers=1, stream=False, recruiter="back_to_sequences",
+                 tabular=False, pairwise=False, blast_batch=1, makeblastdb=False, blast_threads=1,
+                 cache=None, stage_cache=None, resume=False, downloader=None, metrics=None,
+                 shard=None, shard_by_size=False, scheduler=None, scratch=None,
+                 order_by=None, stop_after_hits=0, min_shared_kmers=1, min_query_fraction=0.0,
+                 query_indexes=None, compress=False, rle_synth=False, query_accessions=None):
+        self.session_id = session_id
+        self.accession_file = accession_file
+        self.query_file = query_file
+        self.delete = delete
+        self.unitigs = unitigs
+        self.kmer_size = kmer_size
+        self.limit = limit
+        self.main_dir_name = output_dir
+        self.type = "unitig" if unitigs else "contig"
+        self.failed_accession_list = ""
+        self.downloader = downloader if downloader is not None else HTTPDownloader()
+        self.download_workers = download_workers
+        self.workers = workers
+        self.stream = stream
+        self.recruiter = recruiter
+        self.tabular = tabular
+        self.pairwise = pairwise
+        self.blast_batch = blast_batch
+        self.makeblastdb = makeblastdb
+        self.blast_threads = blast_threads
+        self._blast_batches = {}
+        self._blast_batches_lock = threading.Lock()
+        self.cache = cache
+        self.stage_cache = stage_cache
+        self._query_kmers_digest = None
+        self.resume = resume
+        self.session = None
+        self.metrics = metrics
+        self.journal = None
+        self._progress = {}
+        self._query_index = None
+        self._query_index_lock = threading.Lock()
+        # QueryIndexCache shared with other runs
+        self.query_indexes = query_indexes
+        self.compress = compress
+        self.rle_synth = rle_synth
+        self.queries = None
+        self._failed_lock = threading.Lock()
+        self._coverage_stats_lock = threading.Lock()
+        self._coverage_matrices = {}
+        self._coverage_matrices_lock = threading.Lock()
+        self.shard = shard
+        self.shard_by_size = shard_by_size
+        self.scheduler = scheduler
+        self.scratch = scratch
+        # Number of blast batches, queued or running, holding recruited sequences of each accession
+        self._batched = {}
+        self.order_by = order_by
+        # (name of the accession column, {column: values}) of a CSV accession file
+        self.accession_table = None
+        self.stop_after_hits = stop_after_hits
+        self._hits = set()
+        self._hits_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.min_shared_kmers = min_shared_kmers
+        self.min_query_fraction = min_query_fraction
+        # {query id: accessions} restricting the alignments of each query to its accessions
+        self.query_accessions = query_accessions
+        self._shared_kmers_lock = threading.Lock()
+        # Results of the accessions, collected only while results() runs
+        self._results = None
+        self._results_lock = threading.Lock()
+        self._pending_results = {}
+        self._pending_alignments = {}
+        self._emitted_results = set()
+
+    def _setup_directories(self):
+        if not self.main_dir_name:
+            # Shards of a run get their own directory, gathered by the merge subcommand
+            shard_suffix = f"_shard{self.shard[0]}of{self.shard[1]}" if self.shard is not None else ""
+            if self.session_id:
+                self.main_dir_name = f"session_{self.session_id}{shard_suffix}"
+            else:
+                query_basename = os.path.basename(self.query_file).split(".")[0] + shard_suffix
+                found_free_name = False
+                for i in range(1, 1001):
+                    candidate = f"{query_basename}_{i}"
+                    if not os.path.exists(candidate):
+                        self.main_dir_name = candidate
+                        found_free_name = True
+                        break
+                if not found_free_name:
+                    raise LoganBlasterError(f"Could not find a free directory name based on {query_basename} "
+                                            f"after 1000 attempts. Please specify an output directory with --output.")
+
+        # Files of the run are given by absolute paths: the working directory is left unchanged
+        self.main_dir_name = os.path.abspath(self.main_dir_name)
+        os.makedirs(self.main_dir_name, exist_ok=True)
+        os.makedirs(self._path(self.LOGAN_DIR_NAME), exist_ok=True)
+        os.makedirs(self._path(self.ALIGNEMENT_DIR_NAME), exist_ok=True)
+        if self.scratch is not None and self.scratch.directory is None:
+            self.scratch.directory = self._path(self.LOGAN_DIR_NAME)
+
+        if not self.unitigs:
+            self.failed_accession_list = self._path(self.FAILED_ACCESSIONS_FILE_NAME)
+            Path(self.failed_accession_list).touch()
+
+    def _path(self, *names):
+        """Path of a file of the output directory (relative to the working directory until it is set up)"""
+        return os.path.join(self.main_dir_name or "", *names)
+
+    def _setup_local_files(self, abs_query_file, abs_accession_file):
+        input_data_dir = self._path(self.INPUT_DATA_DIR_NAME)
+        os.makedirs(input_data_dir, exist_ok=True)
+        shutil.copy(abs_query_file, input_data_dir)
+        shutil.copy(abs_accession_file, input_data_dir)
+        self.query_file = os.path.join(input_data_dir, os.path.basename(abs_query_file))
+        self.accession_file = os.path.join(input_data_dir, os.path.basename(abs_accession_file))
+
+        if self.accession_file.endswith(".csv"):
+            accession_basename = self.accession_file[:-len(".csv")]
+            print(f"{YELLOW}[INFO] Extracting accession IDs from {accession_basename}.csv...{NOCOLOR}")
+            try:
+                self.accession_table = read_accession_table(self.accession_file)
+            except (OSError, ValueError, csv.Error) as e:
+                raise LoganBlasterError(f"Could not read {self.accession_file}: {e}")
+            id_column, columns = self.accession_table
+            self.accession_file = f"{accession_basename}_acc.txt"
+            with open(self.accession_file, "w") as f:
+                f.writelines(f"{accession}\n" for accession in columns[id_column])
+
+    def _setup_session(self):
+        input_data_dir = self._path(self.INPUT_DATA_DIR_NAME)
+        os.makedirs(input_data_dir, exist_ok=True)
+        self.accession_file = os.path.join(input_data_dir, f"{self.session_id}_acc.txt")
+        self.query_file = os.path.join(input_data_dir, f"{self.session_id}_query.fa")
+        self.session = LoganSession.fetch(self.session_id, input_data_dir)
+        if not (os.path.exists(self.accession_file) and os.path.exists(self.query_file)):
+            self.session.write_inputs(self.accession_file, self.query_file)
+        print(f"{YELLOW}[INFO] Session {self.session_id}: query {self.session.query_name}, "
+              f"{len(self.session.accessions)} accessions.{NOCOLOR}")
+
+    def _record_coverage_stats(self, accession, downloaded_stats, recruited_stats):
+        """Prints the coverage statistics of an accession and appends them to COVERAGE_STATS_FILE_NAME.
+        downloaded_stats is None when the tigs were not read (recruitment found in a cache)"""
+        for label, stats in ((f"downloaded {self.type}s", downloaded_stats), (f"recruited {self.type}s", recruited_stats)):
+            if stats is not None:
+                print(f"{YELLOW}[INFO] Coverage statistics for {label} ({accession}): {stats.summary()}{NOCOLOR}")
+        record = {
+            "accession": accession,
+            "type": self.type,
+            "downloaded": downloaded_stats.record() if downloaded_stats is not None else None,
+            "recruited": recruited_stats.record(),
+        }
+        with self._coverage_stats_lock:
+            with open(self._path(self.COVERAGE_STATS_FILE_NAME), "a") as f:
+                f.write(json.dumps(record) + "\n")
+        result = self._result(accession)
+        if result is not None:
+            result.stats = record
+
+    def _setup_queries(self):
+        """Lists the queries (id, fasta file). Each record of a multi-fasta query file is a query"""
+        with open(self.query_file, "rb") as f:
+            headers = [header for header, _ in iter_fasta_records(f)]
+        if len(headers) <= 1:
+            self.queries = [(fasta_id(headers[0].decode()) if headers else "query", self.query_file)]
+            return
+        queries_dir = os.path.join(os.path.dirname(self.query_file), "queries")
+        self.queries = split_query_file(self.query_file, queries_dir)
+        print(f"{YELLOW}[INFO] {len(self.queries)} queries found in {self.query_file}: "
+              f"each accession is recruited once for all of them.{NOCOLOR}")
+
+    def _attribute_recruited(self, accession, recruited_file):
+        """Splits the recruited sequences by query sharing k-mers with them. Sequences sharing less than
+        --min-shared-kmers k-mers with a query are dropped for this query, and so is the whole accession
+        when its sequences share less than --min-query-fraction of the k-mers of the query.
+        Queries not searched in the accession (see query_accessions) are ignored.
+        Returns the list of (query file, recruited file of this query), restricted to queries with recruited sequences"""
+        searched = {query_rank for query_rank, (query_id, _) in enumerate(self.queries)
+                    if self.query_accessions is None or accession in self.query_accessions.get(query_id, ())}
+        if not searched:
+            return []
+        if len(self.queries) == 1 and self.min_shared_kmers <= 1 and not self.min_query_fraction:
+            # Nothing to split or drop: the shared k-mers are those counted by the recruiter in the headers,
+            # the distinct k-mers of the query they hit are not known
+            nb_tigs = nb_shared = 0
+            with open(recruited_file, "rb") as f:
+                for header, _ in iter_fasta_records(f):
+                    nb_tigs += 1
+                    count = header.rsplit(None, 1)[-1]
+                    nb_shared += int(count) if count.isdigit() else 0
+            if nb_tigs:
+                self._record_shared_kmers(accession, self.queries[0][0], nb_tigs, 0, nb_shared, None, None, False)
+            return [(self.queries[0][1], recruited_file)]
+        index = self._get_query_index()
+        outputs = {}
+        # Query rank: [kept tigs, dropped tigs, shared k-mers of the kept tigs, distinct query k-mers they share]
+        counts = {}
+        try:
+            with open(recruited_file, "rb") as f:
+                for header, seq in iter_fasta_records(f):
+                    for query_rank, kmers in index.shared_kmers(seq.upper()).items():
+                        if query_rank not in searched:
+                            continue
+                        query_counts = counts.setdefault(query_rank, [0, 0, 0, set()])
+                        if len(kmers) < self.min_shared_kmers:
+                            query_counts[1] += 1
+                            continue
+                        query_counts[0] += 1
+                        query_counts[2] += len(kmers)
+                        query_counts[3].update(kmers)
+                        query_id = self.queries[query_rank][0]
+                        if query_id not in outputs:
+                            outputs[query_id] = open(self._query_recruited_file(accession, query_id), "wb")
+                        outputs[query_id].write(b"%s\n%s\n" % (header, seq))
+        finally:
+            for out in outputs.values():
+                out.close()
+        targets = []
+        for query_rank, (query_id, query_file) in enumerate(self.queries):
+            if query_rank not in counts:
+                continue
+            nb_tigs, nb_dropped, nb_shared, query_kmers = counts[query_rank]
+            fraction = len(query_kmers) / index.nb_kmers[query_rank] if index.nb_kmers[query_rank] else 0.0
+            dropped = not nb_tigs or fraction < self.min_query_fraction
+            self._record_shared_kmers(accession, query_id, nb_tigs, nb_dropped, nb_shared, len(query_kmers), fraction, dropped)
+            if nb_dropped:
+                print(f"{YELLOW}[INFO] {nb_dropped} {self.type}s of {accession} sharing less than {self.min_shared_kmers} "
+                      f"k-mers with query {query_id} dropped.{NOCOLOR}")
+            if dropped:
+                print(f"{YELLOW}[INFO] {accession} shares {fraction:.2%} of the k-mers of query {query_id} "
+                      f"with {nb_tigs} {self.type}s: alignment skipped.{NOCOLOR}")
+                self._remove_intermediate_files(self._query_recruited_file(accession, query_id))
+                continue
+            print(f"{YELLOW}[INFO] Sequences of {accession} recruited for query {query_id} "
+                  f"({nb_tigs} {self.type}s, {fraction:.2%} of its k-mers).{NOCOLOR}")
+            targets.append((query_file, self._query_recruited_file(accession, query_id)))
+        return targets
+
+    def _record_shared_kmers(self, accession, query_id, nb_tigs, nb_dropped, nb_shared, nb_query_kmers, fraction, dropped):
+        """Appends the k-mers an accession shares with a query to SHARED_KMERS_FILE_NAME.
+        nb_query_kmers and fraction are None when the distinct k-mers of the query were not counted"""
+        record = {
+            "accession": accession,
+            "query": query_id,
+            "tigs": nb_tigs,
+            "dropped_tigs": nb_dropped,
+            "shared_kmers": nb_shared,
+            "query_kmers_hit": nb_query_kmers,
+            "query_fraction": round(fraction, 6) if fraction is not None else None,
+            "dropped": dropped,
+        }
+        with self._shared_kmers_lock:
+            with open(self._path(self.SHARED_KMERS_FILE_NAME), "a") as f:
+                f.write(json.dumps(record) + "\n")
+        result = self._result(accession)
+        if result is not None:
+            result.shared_kmers[query_id] = record
+
+    def _query_recruited_file(self, accession, query_id):
+        return self._path(self.LOGAN_DIR_NAME, f"{accession}.recruited_{self.type}s.{query_id}.fa")
+
+    def _blastn(self, query_fasta, target_fasta, output_file, outfmt, database=False, threads=None, max_targets=None):
+        """Runs blastn with the scoring parameters of logan_blaster, against a fasta file
+        or, if database is set, a blast database searched with threads (default: --blast-threads)
+        threads. With max_targets, the hits of up to max_targets subjects are reported instead of
+        the blastn defaults (500 subjects, 250 in pairwise reports). Returns True on success"""
+        cmd = [
+            "blastn",
+            "-query", query_fasta,
+            "-db" if database else "-subject", target_fasta,
+        ] + _blast_output_options(output_file, outfmt, max_targets)
+        if database:
+            # -num_threads is ignored by blastn with -subject
+            cmd += ["-num_threads", str(threads or self.blast_threads)]
+        cmd += BLAST_SCORING_PARAMETERS
+        return self._run_blast_tool(cmd)
+
+    def _blast_formatter(self, archive, output_file, outfmt, max_targets=None):
+        """Converts a blast archive (blastn -outfmt 11) to another output format. Returns True on success"""
+        return self._run_blast_tool(["blast_formatter", "-archive", archive]
+                                    + _blast_output_options(output_file, outfmt, max_targets))
+
+    def _blastn_outputs(self, query_fasta, target_fasta, outputs, **options):
+        """Runs blastn with the options of _blastn, writing each output file of outputs ({outfmt: output_file}).
+        Several formats are rendered by blast_formatter from a single blastn run, whose archive
+        is written next to the first output file. Returns True on success"""
+        if len(outputs) == 1:
+            [(outfmt, output_file)] = outputs.items()
+            return self._blastn(query_fasta, target_fasta, output_file, outfmt, **options)
+        archive = f"{next(iter(outputs.values()))}.asn"
+        try:
+            return (self._blastn(query_fasta, target_fasta, archive, BLAST_ARCHIVE_OUTFMT, **options)
+                    and all(self._blast_formatter(archive, output_file, outfmt, options.get("max_targets"))
+                            for outfmt, output_file in outputs.items()))
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(archive)
+
+    def _run_blast_tool(self, cmd):
+        """Runs blastn or blast_formatter, accounting for its resource usage. Returns True on success"""
+        print(f"{GREEN}Running command: {' '.join(cmd)}{NOCOLOR}")
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode, rusage = wait_rusage(process)
+        self._subprocess_metrics(rusage)
+        if returncode != 0:
+            print(f"{RED}Error: {cmd[0]} failed{NOCOLOR}")
+            print(stderr)
+            return False
+        return True
+
+    def _make_blast_db(self, fasta_file, database):
+        """Builds a blast database from a fasta file. Returns False on failure"""
+        cmd = ["makeblastdb", "-in", fasta_file, "-dbtype", "nucl", "-parse_seqids", "-out", database]
+        print(f"{GREEN}Running command: {' '.join(cmd)}{NOCOLOR}")
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            print(f"{YELLOW}[WARNING] makeblastdb failed, aligning against the fasta file: {e}{NOCOLOR}")
+            return False
+        if result.returncode != 0:
+            print(f"{YELLOW}[WARNING] makeblastdb failed, aligning against the fasta file: {result.stderr.strip()}{NOCOLOR}")
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def _blast_target(self, target_fasta, directory=None):
+        """Prepares the alignment of sequences against target_fasta. Yields the blastn target and
+        the options of _blastn: a temporary blast database (in directory) with --makeblastdb, else
+        the fasta file itself. The target does not depend on the threads granted by the scheduler,
+        as e-values differ between a database and -subject: without a database, blastn ignores
+        -num_threads and the alignment gets a single core. The cores and memory of the alignment
+        are reserved until the end of the context"""
+        threads = None
+        with contextlib.ExitStack() as stack:
+            if self.scheduler is not None:
+                size = os.path.getsize(target_fasta)
+                wanted = self.scheduler.threads_for(size, BLAST_BYTES_PER_THREAD) if self.makeblastdb else 1
+                threads = stack.enter_context(self.scheduler.reserve(wanted, blast_memory(size)))
+                self._metric(threads=threads)
+            if not self.makeblastdb:
+                yield target_fasta, {}
+                return
+            if directory is None:
+                directory = tempfile.mkdtemp(prefix="blast_db_", dir=self._path(self.LOGAN_DIR_NAME))
+                stack.callback(shutil.rmtree, directory, ignore_errors=True)
+            database = os.path.join(directory, "db")
+            if not self._make_blast_db(target_fasta, database):
+                yield target_fasta, {}
+                return
+            options = {"database": True}
+            if threads is not None:
+                options["threads"] = threads
+            yield database, options
+
+    @staticmethod
+    def _query_id(query_fasta):
+        with open(query_fasta, "r") as f:
+            return f.readline().strip().lstrip(">").split()[0]
+
+    def _alignment_prefix(self, query_fasta, target_basename):
+        return self._path(self.ALIGNEMENT_DIR_NAME, f"{self._query_id(query_fasta)}_vs_{target_basename}")
+
+    def _stage(self, accession, stage):
+        """Context measuring a stage of an accession when --metrics is set. Yields a dict of metric values"""
+        if self.metrics is None:
+            return contextlib.nullcontext({})
+        return self.metrics.stage(accession, stage)
+
+    def _metric(self, **values):
+        if self.metrics is not None:
+            self.metrics.add(**values)
+
+    def _subprocess_metrics(self, rusage):
+        if self.metrics is not None and rusage is not None:
+            self.metrics.add_rusage(rusage)
+
+    def _journal(self, accession, state, **details):
+        if self.journal is not None:
+            self.journal.record(accession, state, **details)
+
+    def _alignment_done(self, accession, query_fasta, output_prefix, hsps=None):
+        """Records a successful alignment and synthesizes it"""
+        query_id = self._query_id(query_fasta)
+        self._journal(accession, "aligned", query=query_id)
+        with self._stage(accession, "synth") as values:
+            values["query"] = query_id
+            coverage = self._synthesize(query_fasta, output_prefix, hsps)
+            self._add_to_coverage_matrix(accession, query_id, coverage)
+            if self.stop_after_hits and any(coverage):
+                self._record_hit(accession)
+            if self.metrics is not None:
+                values["hsps"] = len(hsps) if hsps is not None else count_report_hsps(f"{output_prefix}.txt")
+        if self.compress:
+            self._compress_outputs(output_prefix)
+        self._journal(accession, "synthesized", query=query_id)
+        self._alignment_finished(accession, query_id, output_prefix, coverage, hsps)
+
+    def _record_hit(self, accession):
+        """Counts an accession aligned to a query, and stops the run after --stop-after-hits of them"""
+        with self._hits_lock:
+            if accession in self._hits:
+                return
+            self._hits.add(accession)
+            if len(self._hits) == self.stop_after_hits:
+                print(f"{YELLOW}[INFO] {self.stop_after_hits} accessions aligned to the query: stopping the run.{NOCOLOR}")
+                self._stop.set()
+
+    def _alignment_failed(self, accession, query_fasta):
+        query_id = self._query_id(query_fasta)
+        self._journal(accession, "failed", stage="alignment", query=query_id)
+        self._alignment_finished(accession, query_id, failed=True)
+
+    def _result(self, accession):
+        """AccessionResult collected for accession, None unless results() is running"""
+        if self._results is None:
+            return None
+        with self._results_lock:
+            result = self._pending_results.get(accession)
+            if result is None:
+                result = self._pending_results[accession] = AccessionResult(accession)
+            return result
+
+    def _expect_alignments(self, accession, nb_alignments):
+        """The result of accession is complete once nb_alignments alignments are finished"""
+        if self._results is None:
+            return
+        if not nb_alignments:
+            self._emit_result(accession)
+            return
+        with self._results_lock:
+            self._pending_alignments[accession] = nb_alignments
+
+    def _alignment_finished(self, accession, query_id, output_prefix=None, coverage=None, hsps=None, failed=False):
+        """Adds an alignment to the result of accession"""
+        result = self._result(accession)
+        if result is None:
+            return
+        with self._results_lock:
+            if failed:
+                result.failed_queries.append(query_id)
+            else:
+                result.coverage[query_id] = coverage
+                result.hsps[query_id] = hsps
+                result.files[query_id] = self._output_files(output_prefix)
+            nb_alignments = self._pending_alignments.get(accession)
+            if nb_alignments is None:
+                return
+            self._pending_alignments[accession] = nb_alignments - 1
+        if nb_alignments == 1:
+            self._emit_result(accession)
+
+    def _emit_result(self, accession, failed=False):
+        if self._results is None:
+            return
+        with self._results_lock:
+            if accession in self._emitted_results:
+                return
+            self._emitted_results.add(accession)
+            result = self._pending_results.pop(accession, None) or AccessionResult(accession)
+            self._pending_alignments.pop(accession, None)
+        if failed or (result.failed_queries and not result.coverage):
+            result.status = "failed"
+        elif result.coverage:
+            result.status = "aligned"
+        self._results.put(result)
+
+    def _synthesize(self, query_fasta, output_prefix, hsps=None):
+        """Writes the synth file of an alignment, from its HSPs or else from its pairwise report.
+        Returns the coverage of the query positions"""
+        synth_file = self._synth_file(output_prefix)
+        if hsps is None:
+            print(f"{YELLOW}[INFO] Synthesize blast results{NOCOLOR}")
+            with open(synth_file, "w") as f:
+                return run_blast_parser(query_fasta, f"{output_prefix}.txt", abundance=True, out=f, rle=self.rle_synth)
+        print(f"{YELLOW}[INFO] Synthesize blast results ({len(hsps)} HSPs){NOCOLOR}")
+        with open(synth_file, "w") as f:
+            return run_hsp_parser(query_fasta, hsps, abundance=True, out=f, rle=self.rle_synth)
+
+    def _synth_file(self, output_prefix):
+        """Synth file of an alignment: rendered text, or with --rle-synth its run-length encoded coverage"""
+        extension = "cov" if self.rle_synth else "txt"
+        return os.path.join(os.path.dirname(output_prefix), f"synth_{os.path.basename(output_prefix)}.{extension}")
+
+    def _output_files(self, output_prefix):
+        """Alignment and synth files of an alignment, as left in the alignment directory"""
+        files = [*self._alignment_outputs(output_prefix).values(), self._synth_file(output_prefix)]
+        if self.compress:
+            # Text files are compressed, binary HSPs and run-length encoded coverages are compact already
+            return [f"{file}.zst" if file.endswith(".txt") else file for file in files]
+        return files
+
+    def _compress_outputs(self, output_prefix):
+        """Replaces the pairwise report and the text synth file of an alignment by their compressed version"""
+        for file in (*self._alignment_outputs(output_prefix).values(), self._synth_file(output_prefix)):
+            if not file.endswith(".txt") or not os.path.exists(file):
+                continue
+            try:
+                compress_file(file)
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"{RED}Error: Could not compress {file}, it is kept uncompressed: {e}{NOCOLOR}")
+
+    def _add_to_coverage_matrix(self, accession, query_id, coverage):
+        """Stores the coverage of the query by an accession in the coverage matrix of the query"""
+        if not len(coverage):
+            return
+        with self._coverage_matrices_lock:
+            matrix = self._coverage_matrices.get(query_id)
+            if matrix is None:
+                matrix = CoverageMatrix.create(self._path(self.COVERAGE_MATRIX_FILE_NAME.format(query=query_id)), len(coverage))
+                self._coverage_matrices[query_id] = matrix
+        matrix.add(accession, coverage)
+
+    def _close_coverage_matrices(self):
+        with self._coverage_matrices_lock:
+            for query_id, matrix in self._coverage_matrices.items():
+                print(f"{YELLOW}[INFO] Coverage of query {query_id} by {len(matrix)} accessions "
+                      f"stored in {matrix.file_path}.{NOCOLOR}")
+                matrix.close()
+            self._coverage_matrices = {}
+
+    def _run_blast(self, query_fasta, target_fasta):
+        query_basename = os.path.basename(query_fasta).split(".")[0]
+        target_basename = os.path.basename(target_fasta).split(".")[0]
+        output_prefix = self._alignment_prefix(query_fasta, target_basename)
+        print(f"{YELLOW}[INFO] Aligning {target_basename} vs {query_basename}...{NOCOLOR}")
+
+        if not self.tabular:
+            with self._stage(target_basename, "blast") as values, self._blast_target(target_fasta) as (target, options):
+                values["query"] = query_basename
+                aligned = self._blastn(query_fasta, target, f"{output_prefix}.txt", "0", **options)
+            if not aligned:
+                self._alignment_failed(target_basename, query_fasta)
+                return
+            self._store_alignment(query_fasta, target_fasta, output_prefix)
+            self._alignment_done(target_basename, query_fasta, output_prefix)
+            return
+
+        tabular_file = f"{output_prefix}.tsv"
+        with self._stage(target_basename, "blast") as values, self._blast_target(target_fasta) as (target, options):
+            values["query"] = query_basename
+            outputs = {BLAST_TABULAR_OUTFMT: tabular_file}
+            if self.pairwise:
+                outputs["0"] = f"{output_prefix}.txt"
+            if not self._blastn_outputs(query_fasta, target, outputs, **options):
+                self._alignment_failed(target_basename, query_fasta)
+                return
+            hsps = HSPTable.from_tabular(tabular_file)
+            hsps.save(f"{output_prefix}.hsp")
+            os.remove(tabular_file)
+        self._store_alignment(query_fasta, target_fasta, output_prefix)
+        self._alignment_done(target_basename, query_fasta, output_prefix, hsps)
+
+    def _recruitment_key(self, accession):
+        if self._query_kmers_digest is None:
+            self._query_kmers_digest = kmer_set_digest(self.query_file, self.kmer_size)
+        return StageCache.key(stage="recruitment", accession=accession, type=self.type,
+                              query_kmers=self._query_kmers_digest, kmer_size=self.kmer_size,
+                              recruiter=self.recruiter)
+
+    def _recruitment_is_cached(self, accession):
+        return self.stage_cache is not None and self._recruitment_key(accession) in self.stage_cache
+
+    def _alignment_key(self, query_file, recruited_file):
+        return StageCache.key(stage="alignment", query=file_digest(query_file), recruited=file_digest(recruited_file),
+                              blast=BLAST_SCORING_PARAMETERS, tabular=self.tabular, pairwise=self.pairwise,
+                              database=self.makeblastdb)
+
+    def _alignment_outputs(self, output_prefix):
+        outputs = {}
+        if self.tabular:
+            outputs["hsps.hsp"] = f"{output_prefix}.hsp"
+        if not self.tabular or self.pairwise:
+            outputs["report.txt"] = f"{output_prefix}.txt"
+        return outputs
+
+    def _fetch_cached_alignment(self, accession, query_file, recruited_file, output_prefix):
+        """Restores the alignment outputs from the stage cache and synthesizes them. Returns False if not cached"""
+        if self.stage_cache is None:
+            return False
+        if not self.stage_cache.fetch(self._alignment_key(query_file, recruited_file), self._alignment_outputs(output_prefix)):
+            return False
+        print(f"{YELLOW}[INFO] Alignment of {recruited_file} found in the stage cache. Skipping BLAST step.{NOCOLOR}")
+        self._alignment_done(accession, query_file, output_prefix,
+                             HSPTable.load(f"{output_prefix}.hsp") if self.tabular else None)
+        return True
+
+    def _resume_alignment(self, accession, query_file, output_prefix):
+        """When resuming, skips or only synthesizes the alignments done by the interrupted run.
+        Returns False if the alignment has to be computed"""
+        accession_progress = self._progress.get(accession)
+        if accession_progress is None:
+            return False
+        query_id = self._query_id(query_file)
+        if query_id in accession_progress["synthesized"]:
+            print(f"{YELLOW}[INFO] Alignment of {accession} with {query_id} already done. Skipping.{NOCOLOR}")
+            coverage, hsps = self._resumed_coverage(query_file, output_prefix)
+            self._alignment_finished(accession, query_id, output_prefix, coverage, hsps)
+            return True
+        outputs = self._alignment_outputs(output_prefix).values()
+        if query_id in accession_progress["aligned"] and all(os.path.exists(output) for output in outputs):
+            print(f"{YELLOW}[INFO] Alignment of {accession} with {query_id} already done. Synthesizing.{NOCOLOR}")
+            self._alignment_done(accession, query_file, output_prefix,
+                                 HSPTable.load(f"{output_prefix}.hsp") if self.tabular else None)
+            return True
+        return False
+
+    def _resumed_coverage(self, query_file, output_prefix):
+        """Coverage and HSPs (None unless tabular) of an alignment synthesized by the interrupted run,
+        rebuilt from its HSPs, its run-length encoded synth file or its (possibly compressed) report"""
+        if self.tabular:
+            hsps = HSPTable.load(f"{output_prefix}.hsp")
+            return hsps.coverage(len(get_query_ACGT(query_file))), hsps
+        if self.rle_synth:
+            return read_coverage_runs(self._synth_file(output_prefix))[1], None
+        report = f"{output_prefix}.txt"
+        if os.path.exists(report):
+            return parse_blastn(report)[2], None
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(output_prefix), suffix=".txt") as f:
+            subprocess.run(["zstd", "-dcq", f"{report}.zst"], check=True, stdout=f)
+            return parse_blastn(f.name)[2], None
+
+    def _store_alignment(self, query_file, recruited_file, output_prefix):
+        if self.stage_cache is not None:
+            self.stage_cache.store(self._alignment_key(query_file, recruited_file), self._alignment_outputs(output_prefix))
+
+    def _queue_blast(self, accession, query_file, recruited_file):
+        """Aligns the recruited sequences of an accession, or adds them to the current blast batch of the query"""
+        output_prefix = self._alignment_prefix(query_file, accession)
+        if self._resume_alignment(accession, query_file, output_prefix):
+            return
+        if self._fetch_cached_alignment(accession, query_file, recruited_file, output_prefix):
+            return
+        if self.blast_batch <= 1:
+            self._run_blast(query_file, recruited_file)
+            return
+        with self._blast_batches_lock:
+            batch = self._blast_batches.setdefault(query_file, [])
+            batch.append((accession, recruited_file))
+            self._batched[accession] = self._batched.get(accession, 0) + 1
+            if len(batch) < self.blast_batch:
+                print(f"{YELLOW}[INFO] {accession} added to the blast batch of {query_file} ({len(batch)}/{self.blast_batch}).{NOCOLOR}")
+                return
+            self._blast_batches[query_file] = []
+        self._run_blast_batch(query_file, batch)
+
+    def _flush_blast_batches(self):
+        with self._blast_batches_lock:
+            batches = [(query_file, batch) for query_file, batch in self._blast_batches.items() if batch]
+            self._blast_batches = {}
+        for query_file, batch in batches:
+            self._run_blast_batch(query_file, batch)
+
+    def _run_blast_batch(self, query_file, batch):
+        """Aligns the recruited sequences of several accessions with a single blastn run,
+        then splits the results into the usual per accession files. The hit limits of blastn
+        are raised to the number of subjects of the batch, so that the results of an accession
+        do not depend on the other accessions of its batch"""
+        accessions = [accession for accession, _ in batch]
+        print(f"{YELLOW}[INFO] Aligning a batch of {len(batch)} accessions ({', '.join(accessions)}) with {query_file}...{NOCOLOR}")
+        batch_dir = tempfile.mkdtemp(prefix="blast_batch_", dir=self._path(self.LOGAN_DIR_NAME))
+        try:
+            subjects = os.path.join(batch_dir, "subjects.fa")
+            nb_subjects = 0
+            with open(subjects, "wb") as out:
+                for accession, recruited_file in batch:
+                    with open(recruited_file, "rb") as f:
+                        for header, seq in iter_fasta_records(f):
+                            nb_subjects += 1
+                            out.write(b">%s%s%s\n%s\n" % (accession.encode(), BATCH_TAG_SEPARATOR.encode(), header[1:], seq))
+
+            prefixes = {accession: self._alignment_prefix(query_file, accession) for accession in accessions}
+            report = os.path.join(batch_dir, "report.txt")
+            with self._stage(",".join(accessions), "blast") as values:
+                values.update(query=self._query_id(query_file), accessions=len(accessions))
+                with self._blast_target(subjects, batch_dir) as (target, options):
+                    options = dict(options, max_targets=max(nb_subjects, 1))
+                    if self.tabular:
+                        tabular_file = os.path.join(batch_dir, "hsps.tsv")
+                        outputs = {BLAST_TABULAR_OUTFMT: tabular_file}
+                        if self.pairwise:
+                            outputs["0"] = report
+                        aligned = self._blastn_outputs(query_file, target, outputs, **options)
+                        if aligned:
+                            tables = demultiplex_tabular(tabular_file, accessions)
+                    else:
+                        aligned = self._blastn(query_file, target, report, "0", **options)
+                if aligned and (self.pairwise or not self.tabular):
+                    demultiplex_pairwise_report(report, {a: f"{prefix}.txt" for a, prefix in prefixes.items()})
+
+            if not aligned:
+                for accession in accessions:
+                    self._alignment_failed(accession, query_file)
+                return
+            for accession, recruited_file in batch:
+                hsps = None
+                if self.tabular:
+                    hsps = tables[accession]
+                    hsps.save(f"{prefixes[accession]}.hsp")
+                self._store_alignment(query_file, recruited_file, prefixes[accession])
+                self._alignment_done(accession, query_file, prefixes[accession], hsps)
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            if self.delete:
+                self._remove_intermediate_files(*(recruited_file for _, recruited_file in batch))
+            with self._blast_batches_lock:
+                for accession in accessions:
+                    self._batched[accession] -= 1
+                    if not self._batched[accession]:
+                        del self._batched[accession]
+                        if self.scratch is not None:
+                            self.scratch.release_parked(accession)
+
+    def _record_failed_accession(self, accession):
+        if not self.failed_accession_list:
+            return
+        with self._failed_lock:
+            with open(self.failed_accession_list, "a") as f:
+                f.write(f"{accession}\n")
+
+    def _remove_intermediate_files(self, *files):
+        for file in files:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    def _read_accessions(self):
+        accessions = []
+        with open(self.accession_file, "r") as f:
+            for line in f:
+                fields = line.strip().split()
+                if not fields:
+                    continue
+                if self.limit != 0 and len(accessions) >= self.limit and self.order_by is None:
+                    print(f"\n{YELLOW}[INFO] Reached limit of {self.limit} accessions. Stopping further processing.{NOCOLOR}")
+                    break
+                accessions.append(fields[0])
+        if self.order_by is not None:
+            accessions = self._order_accessions(accessions)
+            if self.limit != 0 and len(accessions) > self.limit:
+                print(f"\n{YELLOW}[INFO] Reached limit of {self.limit} accessions. Stopping further processing.{NOCOLOR}")
+                accessions = accessions[:self.limit]
+        if self.shard is not None:
+            accessions = self._shard_accessions(accessions)
+        return accessions
+
+    def _order_accessions(self, accessions):
+        """Accessions by decreasing value of the --order-by column of the session metadata or CSV accession file"""
+        if self.session is not None:
+            ids, columns = self.session.accessions, self.session.metadata
+        elif self.accession_table is not None:
+            id_column, columns = self.accession_table
+            ids = columns[id_column]
+        else:
+            raise LoganBlasterError("--order-by needs a session or a CSV accession file.")
+        if self.order_by not in columns:
+            raise LoganBlasterError(f"No column {self.order_by} to order the accessions by (columns: {', '.join(columns)}).")
+        print(f"{YELLOW}[INFO] Processing the accessions by decreasing {self.order_by}.{NOCOLOR}")
+        return order_accessions(accessions, ids, columns[self.order_by])
+
+    def _shard_accessions(self, accessions):
+        """Accessions of the shard of this run"""
+        index, count = self.shard
+        sizes = None
+        if self.shard_by_size:
+            print(f"{YELLOW}[INFO] Fetching the size of the {self.type}s of {len(accessions)} accessions to balance the shards...{NOCOLOR}")
+            sizes = self._tigs_sizes(accessions)
+        shard = shard_accessions(accessions, index, count, sizes)
+        print(f"{YELLOW}[INFO] Shard {index}/{count}: {len(shard)} of {len(accessions)} accessions.{NOCOLOR}")
+        return shard
+
+    def _tigs_sizes(self, accessions):
+        """Sizes of the tigs files of the accessions (0 for missing ones). Raises LoganBlasterError if a size
+        cannot be fetched, as every shard must compute the same partition"""
+        def size(accession):
+            try:
+                return self.downloader.size(self._tigs_url(accession))
+            except FileNotFoundError:
+                return 0
+
+        sizes = {}
+        todo = queue.Queue()
+        for accession in dict.fromkeys(accessions):
+            todo.put(accession)
+        errors = []
+
+        def worker():
+            while True:
+                try:
+                    accession = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    sizes[accession] = size(accession)
+                except OSError as e:
+                    errors.append(e)
+                    return
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(SHARD_SIZE_REQUESTS, todo.qsize()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise LoganBlasterError(f"Could not fetch the size of the {self.type}s, shards cannot be balanced: {errors[0]}")
+        return sizes
+
+    def _tigs_url(self, accession):
+        prefix = "u" if self.unitigs else "c"
+        return f"https://s3.amazonaws.com/logan-pub/{prefix}/{accession}/{accession}.{self.type}s.fa.zst"
+
+    def _download_accession(self, accession):
+        """Downloads the tigs of an accession in LOGAN_DIR_NAME. Returns the local file, or None on failure.
+        In stream mode nothing is downloaded and the URL of the tigs is returned instead"""
+        local_file = self._path(self.LOGAN_DIR_NAME, f"{accession}.{self.type}s.fa.zst")
+        print(f"{YELLOW}[INFO] Checking for local file {local_file}...{NOCOLOR}")
+        if os.path.exists(local_file):
+            print(f"{YELLOW}[INFO] Using existing local version of {local_file}...{NOCOLOR}")
+            return local_file
+
+        if self.cache is None:
+            return self._fetch_accession(accession, local_file)
+        # Runs sharing the cache wait for the download of the accession by another one
+        with self.cache.claim(accession, self.type):
+            if self.cache.fetch(accession, self.type, local_file):
+                print(f"{YELLOW}[INFO] Using cached version of {accession}.{self.type}s.fa.zst from {self.cache.directory}...{NOCOLOR}")
+                return local_file
+            return self._fetch_accession(accession, local_file)
+
+    def _fetch_accession(self, accession, local_file):
+        """Downloads the tigs of an accession missing from the cache (see _download_accession)"""
+        if self.stream:
+            return self._tigs_url(accession)
+
+        url = self._tigs_url(accession)
+        print(f"{YELLOW}[INFO] Downloading {accession}.{self.type}s.fa.zst...{NOCOLOR}")
+        print(f"{GREEN}Downloading {url}{NOCOLOR}")
+        try:
+            self.downloader.download(url, local_file)
+        except Exception as e:
+            print(f"{RED}Error: Failed to download {accession}.{self.type}s.fa.zst: {e}{NOCOLOR}")
+            if not self.unitigs:
+                if isinstance(e, FileNotFoundError):
+                    print(f"{YELLOW}[INFO] Contigs do not exist for accession {accession}. Adding {accession} to failed accession list.{NOCOLOR}")
+                self._record_failed_accession(accession)
+            return None
+        self._metric(bytes_downloaded=os.path.getsize(local_file))
+        if self.cache is not None:
+            self.cache.add(local_file, accession, self.type)
+        return local_file
+
+    def _get_query_index(self):
+        with self._query_index_lock:
+            if self._query_index is None:
+                print(f"{YELLOW}[INFO] Indexing the {self.kmer_size}-mers of {self.query_file}...{NOCOLOR}")
+                if self.query_indexes is not None:
+                    self._query_index = self.query_indexes.get(self.query_file, self.kmer_size)
+                else:
+                    self._query_index = QueryKmerIndex(self.query_file, self.kmer_size)
+            return self._query_index
+
+    def _recruit(self, source, recruited_file, stats=None):
+        """Recruits the tigs of source (a .zst file or, in stream mode, an URL) sharing
+        at least one k-mer with the query. Coverage statistics of the tigs are computed
+        in the same pass and added to stats (a CoverageStats) if given. Returns (success, error message)"""
+        if self.recruiter == "builtin":
+            return self._recruit_builtin(source, recruited_file, stats)
+        return self._recruit_back_to_sequences(source, recruited_file, stats)
+
+    def _recruit_back_to_sequences(self, source, recruited_file, stats=None):
+        if self.scheduler is None:
+            return self._run_back_to_sequences(source, recruited_file, stats)
+        # Streamed tigs are of unknown size
+        size = 0 if is_url(source) else os.path.getsize(source)
+        with self.scheduler.reserve(self.scheduler.threads_for(size, RECRUITMENT_BYTES_PER_THREAD),
+                                    RECRUITMENT_MEMORY) as threads:
+            self._metric(threads=threads)
+            return self._run_back_to_sequences(source, recruited_file, stats, threads)
+
+    def _run_back_to_sequences(self, source, recruited_file, stats=None, threads=None):
+        # back_to_sequences reads a local tigs file itself, and in stream mode the output of zstd. The tigs
+        # never go through python: their coverage statistics are computed in a thread, from a second
+        # decompression of the file or of the transfer
+        stream_mode = is_url(source)
+        cmd_recruit = [
+            "back_to_sequences",
+            "--kmer-size", str(self.kmer_size),
+            "--in-kmers", self.query_file,
+            "--in-sequences", "/dev/stdin" if stream_mode else source,
+            "--out-sequences", recruited_file
+        ]
+        if threads is not None:
+            cmd_recruit += ["--threads", str(threads)]
+        if stream_mode:
+            print(f"{GREEN}Running command: zstd -dcq < {source} | {' '.join(cmd_recruit)}{NOCOLOR}")
+        else:
+            print(f"{GREEN}Running command: {' '.join(cmd_recruit)}{NOCOLOR}")
+        readers = []
+        try:
+            if stream_mode:
+                readers.append(TigsStream(source, copy=stats is not None))
+                stats_stream = readers[0].copy
+            elif stats is not None:
+                readers.append(TigsStream(source))
+                stats_stream = readers[0].stream
+        except Exception as e:
+            return False, f"Could not open {source}: {e}"
+        with contextlib.ExitStack() as stack, tempfile.TemporaryFile() as recruit_stderr:
+            for reader in readers:
+                stack.enter_context(reader)
+            stats_thread = None
+            if stats is not None:
+                def read_stats():
+                    try:
+                        stats.feed_stream(stats_stream)
+                    finally:
+                        # The stream is read to its end, which the transfer of stream mode waits for
+                        while stats_stream.read(STREAM_BUFFER_SIZE):
+                            pass
+                stats_thread = threading.Thread(target=read_stats, daemon=True)
+                stats_thread.start()
+            recruit = subprocess.Popen(cmd_recruit, stdin=readers[0].stream if stream_mode else subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=recruit_stderr)
+            if stream_mode:
+                # back_to_sequences is the only reader of the tigs: zstd stops if it fails
+                readers[0].stream.close()
+            _, rusage = wait_rusage(recruit)
+            self._subprocess_metrics(rusage)
+            if stats_thread is not None:
+                stats_thread.join()
+            recruit_stderr.seek(0)
+            recruit_error = recruit_stderr.read().decode(errors="replace")
+        for reader in readers:
+            self._tigs_stream_metrics(reader)
+            if reader.error:
+                return False, reader.error
+        if recruit.returncode != 0:
+            return False, recruit_error
+        return True, ""
+
+    def _tigs_stream_metrics(self, tigs):
+        """Adds the transfer and the decompression of the tigs to the running stage metrics"""
+        self._subprocess_metrics(tigs.rusage)
+        self._subprocess_metrics(tigs.copy_rusage)
+        if tigs.bytes_transferred:
+            self._metric(bytes_downloaded=tigs.bytes_transferred)
+
+    def _recruit_builtin(self, source, recruited_file, stats=None):
+        if self.scheduler is None:
+            return self._run_builtin_recruiter(source, recruited_file, stats)
+        # The builtin recruiter runs in a single thread
+        with self.scheduler.reserve(1, RECRUITMENT_MEMORY):
+            return self._run_builtin_recruiter(source, recruited_file, stats)
+
+    def _run_builtin_recruiter(self, source, recruited_file, stats=None):
+        index = self._get_query_index()
+        print(f"{GREEN}Recruiting with the builtin recruiter from {source}{NOCOLOR}")
+        try:
+            tigs = TigsStream(source)
+        except Exception as e:
+            return False, f"Could not open {source}: {e}"
+        with tigs, open(recruited_file, "wb") as out:
+            nb_scanned, nb_recruited = recruit_sequences(tigs.stream, index, out, stats)
+        self._tigs_stream_metrics(tigs)
+        if tigs.error:
+            return False, tigs.error
+        print(f"{YELLOW}[INFO] {nb_recruited} {self.type}s recruited out of {nb_scanned}.{NOCOLOR}")
+        return True, ""
+
+    def _recruit_and_align(self, accession, local_file):
+        """Recruitment, coverage statistics and alignment of an accession.
+        local_file is either the downloaded tigs file, their URL in stream mode,
+        or None when the recruitment is found in the stage cache"""
+        print(f"\n{BLUE}=========================================={NOCOLOR}")
+        print(f"{CYAN}>>> Processing accession: {accession} <<<{NOCOLOR}")
+        print(f"{BLUE}=========================================={NOCOLOR}")
+
+        # True when there is no local tigs file
+        streamed = local_file is None or is_url(local_file)
+        recruited_file = self._path(self.LOGAN_DIR_NAME, f"{accession}.recruited_{self.type}s.fa")
+        resumed = local_file is None and self._recruitment_is_resumable(accession)
+        if resumed:
+            print(f"{YELLOW}[INFO] Recruitment of {accession} done by the interrupted run: {self.type}s are not downloaded.{NOCOLOR}")
+        elif local_file is None:
+            print(f"{YELLOW}[INFO] Recruitment of {accession} found in the stage cache: {self.type}s are not downloaded.{NOCOLOR}")
+
+        # Coverage statistics of the downloaded tigs are computed while recruiting
+        downloaded_stats = None
+        if resumed:
+            success, error = True, ""
+        elif local_file is None:
+            success = self.stage_cache.fetch(self._recruitment_key(accession), {"recruited.fa": recruited_file})
+            error = f"Recruitment of {accession} vanished from the stage cache."
+        else:
+            print(f"{YELLOW}[INFO] Recruiting sequences from {accession}.{self.type}s.fa.zst with a match with {self.query_file}...{NOCOLOR}")
+            downloaded_stats = CoverageStats()
+            with self._stage(accession, "recruitment") as values:
+                success, error = self._recruit(local_file, recruited_file, downloaded_stats)
+                if success:
+                    values.update(tigs_scanned=downloaded_stats.nb_tigs, recruited_bytes=os.path.getsize(recruited_file))
+            if success and self.stage_cache is not None:
+                self.stage_cache.store(self._recruitment_key(accession), {"recruited.fa": recruited_file})
+        if not success:
+            print(f"{RED}Error: recruitment failed for accession {accession}.{NOCOLOR}")
+            self._remove_intermediate_files(recruited_file)
+            if not streamed:
+                self._remove_intermediate_files(local_file)
+            print(error)
+            self._journal(accession, "failed", stage="recruitment")
+            self._record_failed_accession(accession)
+            self._emit_result(accession, failed=True)
+            return
+
+        if not resumed:
+            # Statistics of the downloaded tigs were computed while recruiting
+            with self._stage(accession, "coverage") as values:
+                recruited_stats = CoverageStats.from_fasta(recruited_file)
+                values["tigs_recruited"] = recruited_stats.nb_tigs
+                self._record_coverage_stats(accession, downloaded_stats, recruited_stats)
+
+        if os.path.getsize(recruited_file) == 0:
+            print(f"{YELLOW}[INFO]\tNo sequences were recruited from {accession}.{self.type}s.fa.zst. Skipping BLAST step.{NOCOLOR}")
+            self._journal(accession, "recruited", nb_queries=0)
+            if self.delete:
+                self._delete_intermediate_files(recruited_file, local_file, streamed)
+            if self.type == "contig":
+                self._record_failed_accession(accession)
+            self._emit_result(accession)
+            return
+
+        targets = self._attribute_recruited(accession, recruited_file)
+        if not resumed:
+            self._journal(accession, "recruited", nb_queries=len(targets))
+        if not targets and self.type == "contig":
+            self._record_failed_accession(accession)
+        self._expect_alignments(accession, len(targets))
+        for query_file, query_recruited_file in targets:
+            print(f"{YELLOW}[INFO] Aligning recruited sequences from {accession}.{self.type}s.fa.zst with {query_file}...{NOCOLOR}")
+            self._queue_blast(accession, query_file, query_recruited_file)
+
+        if self.delete:
+            if self.blast_batch > 1:
+                # Recruited sequences are deleted once their blast batch is aligned
+                batched = [query_recruited_file for _, query_recruited_file in targets]
+                self._remove_intermediate_files(*(file for file in (recruited_file,) if file not in batched))
+                if not streamed:
+                    self._remove_intermediate_files(local_file)
+            else:
+                self._delete_intermediate_files(recruited_file, local_file, streamed)
+                self._remove_intermediate_files(*(query_recruited_file for _, query_recruited_file in targets
+                                                  if query_recruited_file != recruited_file))
+
+    def _delete_intermediate_files(self, recruited_file, local_file, streamed):
+        if streamed:
+            print(f"{YELLOW}[INFO] Deleting {recruited_file}...{NOCOLOR}")
+            self._remove_intermediate_files(recruited_file)
+        else:
+            print(f"{YELLOW}[INFO] Deleting {recruited_file} and {local_file}...{NOCOLOR}")
+            self._remove_intermediate_files(recruited_file, local_file)
+
+    def _download_worker(self, todo, ready):
+        while not self._stop.is_set():
+            try:
+                accession = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if self._recruitment_is_resumable(accession) or self._recruitment_is_cached(accession):
+                    self._reserve_scratch(accession, download=False)
+                    ready.put((accession, None))
+                    continue
+                self._reserve_scratch(accession)
+                try:
+                    with self._stage(accession, "download"):
+                        local_file = self._download_accession(accession)
+                finally:
+                    if self.scratch is not None:
+                        self.scratch.downloaded(accession)
+            except Exception as e:
+                print(f"{RED}Error: Unexpected failure while downloading {accession}: {e}{NOCOLOR}")
+                self._journal(accession, "failed", stage="download")
+                self._record_failed_accession(accession)
+                self._release_scratch(accession)
+                self._emit_result(accession, failed=True)
+                continue
+            if local_file is None:
+                self._journal(accession, "failed", stage="download")
+                self._release_scratch(accession)
+                self._emit_result(accession, failed=True)
+                continue
+            if not is_url(local_file):
+                self._journal(accession, "downloaded")
+            # Blocks when enough downloads are waiting to be processed
+            ready.put((accession, local_file))
+
+    def _processing_worker(self, ready):
+        while True:
+            item = ready.get()
+            if item is None:
+                return
+            accession, local_file = item
+            if self._stop.is_set():
+                # Left for a --resume run
+                self._release_scratch(accession)
+                continue
+            try:
+                self._recruit_and_align(accession, local_file)
+            except Exception as e:
+                print(f"{RED}Error: Unexpected failure while processing {accession}: {e}{NOCOLOR}")
+                self._journal(accession, "failed", stage="processing")
+                self._record_failed_accession(accession)
+                self._emit_result(accession, failed=True)
+            self._release_scratch(accession)
+
+    def _reserve_scratch(self, accession, download=True):
+        """With --max-scratch, waits for room for the tigs of accession (known from a HEAD request
+        unless they are already there or streamed)"""
+        if self.scratch is None:
+            return
+        nbytes = 0
+        local_file = self._path(self.LOGAN_DIR_NAME, f"{accession}.{self.type}s.fa.zst")
+        if download and not self.stream and not os.path.exists(local_file):
+            try:
+                nbytes = self.downloader.size(self._tigs_url(accession))
+            except OSError:
+                pass  # Reported by the download
+        self.scratch.reserve(accession, nbytes)
+
+    def _release_scratch(self, accession):
+        """The intermediate files of a processed accession may be evicted, once its blast batches are done"""
+        if self.scratch is None:
+            return
+        with self._blast_batches_lock:
+            if self._batched.get(accession):
+                self.scratch.park(accession)
+            else:
+                self.scratch.release(accession)
+
+    def _recruitment_is_resumable(self, accession):
+        """True when the interrupted run recruited the accession and its recruited sequences are still there"""
+        accession_progress = self._progress.get(accession)
+        if accession_progress is None or accession_progress["state"] == "failed" or accession_progress["nb_queries"] is None:
+            return False
+        return os.path.exists(self._path(self.LOGAN_DIR_NAME, f"{accession}.recruited_{self.type}s.fa"))
+
+    def _resume_journal(self, accessions):
+        """Replays the journal of the interrupted run. Returns the accessions that still have to be processed"""
+        self._progress = RunJournal.replay(self._path(RunJournal.FILE_NAME))
+        complete = {accession for accession, accession_progress in self._progress.items()
+                    if RunJournal.is_complete(accession_progress)}
+        remaining = [accession for accession in accessions if accession not in complete]
+        print(f"{YELLOW}[INFO] Resuming: {len(accessions) - len(remaining)} accessions already processed, {len(remaining)} remaining.{NOCOLOR}")
+        if self.failed_accession_list:
+            # Accessions that are processed again are recorded again if they fail again
+            with open(self.failed_accession_list, "r") as f:
+                failed = [line for line in f if line.strip() in complete]
+            with open(self.failed_accession_list, "w") as f:
+                f.writelines(failed)
+        return remaining
+
+    def _process_accessions(self):
+        """Staged pipeline: download workers prefetch accessions into a bounded queue
+        consumed by the recruitment/alignment workers."""
+        if self.queries is None:
+            self._setup_queries()
+        accessions = self._read_accessions()
+        if self.resume:
+            accessions = self._resume_journal(accessions)
+        self.journal = RunJournal(self._path(RunJournal.FILE_NAME))
+        todo = queue.Queue()
+        for accession in accessions:
+            todo.put(accession)
+
+        ready = queue.Queue(maxsize=self.download_workers)
+        downloaders = [threading.Thread(target=self._download_worker, args=(todo, ready), daemon=True)
+                       for _ in range(self.download_workers)]
+        processors = [threading.Thread(target=self._processing_worker, args=(ready,), daemon=True)
+                      for _ in range(self.workers)]
+        for thread in downloaders + processors:
+            thread.start()
+        for thread in downloaders:
+            thread.join()
+        for _ in processors:
+            ready.put(None)
+        for thread in processors:
+            thread.join()
+        if self._stop.is_set():
+            reason = f" after {self.stop_after_hits} accessions with alignments" if self.stop_after_hits and len(self._hits) >= self.stop_after_hits else ""
+            print(f"{YELLOW}[INFO] Run stopped{reason}: the remaining accessions can be processed with --resume.{NOCOLOR}")
+        self._flush_blast_batches()
+        self._close_coverage_matrices()
+        if self.metrics is not None:
+            self._print_metrics_summary(self.metrics.summary())
+
+    def _print_metrics_summary(self, summary):
+        print(f"{YELLOW}[INFO] Run metrics ({summary['wall_time']:.1f}s), written to {self.metrics.file_path}:{NOCOLOR}")
+        for stage, totals in summary["stages"].items():
+            line = f"  {stage:<12} {totals['count']:>6} runs {totals['wall_time']:>10.1f}s"
+            if "cpu_per_wall" in totals:
+                line += f"   CPU/wall {totals['cpu_per_wall']:.2f}"
+            if "throughput_bytes_per_s" in totals:
+                line += f"   {totals['throughput_bytes_per_s'] / (1 << 20):.1f} MiB/s"
+            if "max_rss_bytes" in totals:
+                line += f"   peak RSS {totals['max_rss_bytes'] / (1 << 20):.0f} MiB"
+            print(line)
+
+    def _setup(self, abs_query_file=None, abs_accession_file=None, accessions=None):
+        """Sets up the output directory and the input files of the run: the session, the query and
+        accession files, or the query file and an accessions list"""
+        if self.session_id is None and abs_query_file is None:
+            raise LoganBlasterError("A query file or a session is required")
+        if self.session_id is None and not os.path.exists(abs_query_file):
+            raise LoganBlasterError(f"Query file '{abs_query_file}' does not exist.")
+        self._setup_directories()
+
+        if self.session_id:
+            self._setup_session()
+        elif accessions is not None:
+            input_data_dir = self._path(self.INPUT_DATA_DIR_NAME)
+            os.makedirs(input_data_dir, exist_ok=True)
+            shutil.copy(abs_query_file, input_data_dir)
+            self.query_file = os.path.join(input_data_dir, os.path.basename(abs_query_file))
+            self.accession_file = os.path.join(input_data_dir, "accessions.txt")
+            with open(self.accession_file, "w") as f:
+                f.writelines(f"{accession}\n" for accession in accessions)
+        else:
+            if abs_accession_file is None:
+                raise LoganBlasterError("An accessions file, a list of accessions or a session is required")
+            if not os.path.exists(abs_accession_file):
+                raise LoganBlasterError(f"Accessions file '{abs_accession_file}' does not exist.")
+            self._setup_local_files(abs_query_file, abs_accession_file)
+        # Invalid queries are reported before any accession is downloaded
+        self._setup_queries()
+
+    def run(self, abs_query_file=None, abs_accession_file=None):
+        self._setup(abs_query_file, abs_accession_file)
+        self._process_accessions()
+
+    def results(self, abs_query_file=None, abs_accession_file=None, accessions=None):
+        """Runs the search like run() (or on an iterable of accessions instead of an accession file)
+        and yields an AccessionResult per processed accession as soon as its alignments are done.
+        Closing the generator stops the run after the accessions being processed"""
+        self._setup(abs_query_file, abs_accession_file, accessions)
+        self._results = queue.Queue()
+        errors = []
+
+        def process():
+            try:
+                self._process_accessions()
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                self._results.put(None)
+
+        thread = threading.Thread(target=process, daemon=True)
+        thread.start()
+        try:
+            while (result := self._results.get()) is not None:
+                yield result
+        finally:
+            self._stop.set()
+            thread.join()
+            self._results = None
+        if errors:
+            raise errors[0]
+
+
+def search(query_file, accessions, output_dir, kmer_size=17, unitigs=False, delete=False, tabular=True, **options):
+    """Searches the queries of query_file in accessions (an iterable of accession IDs), with the
+    options of LoganBlaster, writing the files of the run in output_dir. Yields an AccessionResult
+    per processed accession. Neither the working directory nor sys.stdout are changed, so that
+    several searches can run concurrently in a process. With tabular (default), the HSPs of the
+    alignments are returned along with their coverage"""
+    blaster = LoganBlaster(None, None, query_file, delete, unitigs, kmer_size, 0, output_dir, tabular=tabular, **options)
+    yield from blaster.results(abs_query_file=os.path.abspath(query_file), accessions=accessions)
+
+
+# --- Search service ---
+class SearchJob:
+    """A search submitted to a SearchService: queries searched in a list of accessions, or the
+    query and accessions of a Logan-Search session, fetched when the job starts. `results` lists
+    the JSON records (see AccessionResult.record) of the accessions processed so far, with the
+    query ids of the job: coverages and HSPs are left in the files of the run."""
+
+    def __init__(self, job_id, records=None, accessions=None, session_id=None):
+        self.id = job_id
+        # (query id, sequence) of the queries
+        self.records = records
+        self.accessions = accessions
+        self.session_id = session_id
+        self.status = "queued"
+        self.error = None
+        self.results = []
+        self.run_dir = None
+        # Query ids of the job for each query id of its run
+        self.queries = {}
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "session": self.session_id,
+            "queries": [query_id for query_id, _ in self.records] if self.records is not None else None,
+            "nb_accessions": len(self.accessions) if self.accessions is not None else None,
+            "nb_processed": len(self.results),
+            "nb_failed": sum(result["status"] == "failed" for result in self.results),
+            "hits": [result["accession"] for result in self.results if result["hits"]],
+            "run": self.run_dir,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class SearchService:
+    """Runs the searches submitted as jobs, at most `runners` runs at a time. The jobs queued while
+    the runners are busy are coalesced into a single run (of at most batch_jobs jobs) over the union
+    of their accessions, each query being aligned with the accessions of its jobs only: an accession
+    shared by several jobs is downloaded and recruited once, and a query submitted by several jobs
+    is aligned once. The download cache,
+    stage cache, downloader, scheduler and query indexes given in `options` (keyword options of
+    LoganBlaster) are shared by the runs, and stay warm from one job to the next. Only the last
+    `keep_jobs` finished jobs are kept."""
+
+    ACCESSION_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+    SESSION_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9-]*")
+
+    def __init__(self, directory, runners=2, batch_jobs=16, kmer_size=17, unitigs=False, delete=False,
+                 keep_jobs=1000, **options):
+        self.directory = os.path.abspath(directory)
+        self.runners = runners
+        self.batch_jobs = batch_jobs
+        self.keep_jobs = keep_jobs
+        self.kmer_size = kmer_size
+        self.unitigs = unitigs
+        self.delete = delete
+        options.setdefault("downloader", HTTPDownloader())
+        options.setdefault("query_indexes", QueryIndexCache())
+        self.options = options
+        self._jobs = {}
+        self._queue = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = []
+        for name in ("runs", "queries", "sessions"):
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+
+    def start(self):
+        for _ in range(self.runners):
+            thread = threading.Thread(target=self._runner, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        """Cancels the queued jobs and stops the runs after the accessions being processed"""
+        with self._condition:
+            self._closed = True
+            for job in self._queue:
+                self._finish(job, "cancelled")
+            self._queue = []
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    @staticmethod
+    def _query_id(header):
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", fasta_id(header))
+
+    def _parse_query(self, query):
+        if not isinstance(query, str) or not query.strip():
+            raise LoganBlasterError("The query must be given as the text of a fasta file.")
+        records = []
+        for header, seq in iter_fasta_records(io.BytesIO(query.encode())):
+            query_id = self._query_id(header.decode())
+            if not seq:
+                raise LoganBlasterError(f"Query {query_id} has no sequence.")
+            if any(query_id == other_id for other_id, _ in records):
+                raise LoganBlasterError(f"Query identifier {query_id} is used by several sequences.")
+            records.append((query_id, seq))
+        if not records:
+            raise LoganBlasterError("No fasta record found in the query.")
+        return records
+
+    def _check_accessions(self, accessions):
+        if not isinstance(accessions, list) or not accessions:
+            raise LoganBlasterError("The accessions must be given as a non-empty list.")
+        for accession in accessions:
+            if not isinstance(accession, str) or not self.ACCESSION_PATTERN.fullmatch(accession):
+                raise LoganBlasterError(f"Invalid accession: {accession!r}")
+        return list(dict.fromkeys(accessions))
+
+    def submit(self, query=None, accessions=None, session=None):
+        """Queues a job searching query (the text of a fasta file) in accessions (a list of accession IDs),
+        or the query in the accessions of a Logan-Search session. Returns the SearchJob"""
+        job_id = uuid.uuid4().hex[:12]
+        if session is not None:
+            if query is not None or accessions is not None:
+                raise LoganBlasterError("A session cannot be combined with a query or accessions.")
+            if not isinstance(session, str) or not self.SESSION_PATTERN.fullmatch(session):
+                raise LoganBlasterError(f"Invalid session ID: {session!r}")
+            job = SearchJob(job_id, session_id=session)
+        else:
+            job = SearchJob(job_id, self._parse_query(query), self._check_accessions(accessions))
+        with self._condition:
+            if self._closed:
+                raise LoganBlasterError("The service is shutting down.")
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._condition.notify()
+        print(f"{YELLOW}[INFO] Job {job.id} queued.{NOCOLOR}")
+        return job
+
+    def job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def summaries(self):
+        with self._condition:
+            return [job.summary() for job in self._jobs.values()]
+
+    def summary(self, job):
+        with self._condition:
+            return job.summary()
+
+    def results(self, job):
+        """JSON records of the results of job"""
+        with self._condition:
+            return list(job.results)
+
+    def cancel(self, job_id):
+        """Cancels a job. Its run is stopped once none of its jobs is running. Returns the job, None if unknown"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status == "queued":
+                self._queue.remove(job)
+            if job is not None and job.status in ("queued", "running"):
+                self._finish(job, "cancelled")
+        return job
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        self._prune()
+
+    def _prune(self):
+        """Forgets the jobs finished first, beyond the keep_jobs last ones"""
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        if len(finished) <= self.keep_jobs:
+            return
+        finished.sort(key=lambda job: job.finished)
+        for job in finished[:len(finished) - self.keep_jobs]:
+            del self._jobs[job.id]
+
+    def _runner(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                jobs = self._queue[:self.batch_jobs]
+                del self._queue[:self.batch_jobs]
+                for job in jobs:
+                    job.status = "running"
+                    job.started = time.time()
+            try:
+                self._run(jobs)
+            except BaseException as e:
+                # Whatever happened to the run, the runner carries on with the next jobs
+                print(f"{RED}Error: Run of jobs {', '.join(job.id for job in jobs)} failed: {e}{NOCOLOR}")
+                with self._condition:
+                    for job in jobs:
+                        if job.status == "running":
+                            self._finish(job, "failed", str(e))
+
+    def _fetch_session(self, job):
+        """Sets the query and accessions of a session job. Returns False if the session could not be fetched"""
+        try:
+            session = LoganSession.fetch(job.session_id, os.path.join(self.directory, "sessions"))
+        except (LoganBlasterError, OSError) as e:
+            with self._condition:
+                self._finish(job, "failed", f"Could not fetch session {job.session_id}: {e}")
+            return False
+        with self._condition:
+            job.records = [(self._query_id(session.query_name), session.query_seq.strip().encode())]
+            job.accessions = list(dict.fromkeys(accession for accession in session.accessions
+                                                if isinstance(accession, str) and self.ACCESSION_PATTERN.fullmatch(accession)))
+        return True
+
+    def _write_queries(self, jobs, query_file):
+        """Writes the queries of jobs in query_file, once per distinct sequence, and maps the query ids
+        of the run to those of each job"""
+        run_queries = {}
+        with open(query_file, "wb") as out:
+            for job in jobs:
+                for query_id, seq in job.records:
+                    run_query_id = run_queries.get(seq)
+                    if run_query_id is None:
+                        # Queries of several jobs may have the same id
+                        run_query_id = query_id
+                        n = 1
+                        while run_query_id in run_queries.values():
+                            n += 1
+                            run_query_id = f"{query_id}_{n}"
+                        run_queries[seq] = run_query_id
+                        out.write(b">%s\n%s\n" % (run_query_id.encode(), seq))
+                    job.queries.setdefault(run_query_id, []).append(query_id)
+        return len(run_queries)
+
+    def _blaster(self, query_file, run_dir, query_accessions=None):
+        return LoganBlaster(None, None, query_file, self.delete, self.unitigs, self.kmer_size, 0, run_dir,
+                            query_accessions=query_accessions, **self.options)
+
+    def _run(self, jobs):
+        jobs = [job for job in jobs if job.session_id is None or self._fetch_session(job)]
+        if not jobs:
+            return
+        run_id = jobs[0].id
+        query_file = os.path.join(self.directory, "queries", f"{run_id}.fa")
+        nb_queries = self._write_queries(jobs, query_file)
+        accessions = list(dict.fromkeys(accession for job in jobs for accession in job.accessions))
+        job_accessions = {job.id: set(job.accessions) for job in jobs}
+        # Each query is aligned with the accessions of the jobs submitting it only
+        query_accessions = {}
+        for job in jobs:
+            for run_query_id in job.queries:
+                query_accessions.setdefault(run_query_id, set()).update(job.accessions)
+        run_dir = os.path.join(self.directory, "runs", run_id)
+        with self._condition:
+            for job in jobs:
+                job.run_dir = run_dir
+        print(f"{YELLOW}[INFO] Run {run_id}: {len(jobs)} job{'s' if len(jobs) > 1 else ''}, "
+              f"{nb_queries} queries, {len(accessions)} accessions.{NOCOLOR}")
+
+        try:
+            blaster = self._blaster(query_file, run_dir, query_accessions)
+            with contextlib.closing(blaster.results(query_file, accessions=accessions)) as results:
+                for result in results:
+                    with self._condition:
+                        for job in jobs:
+                            if job.status == "running" and result.accession in job_accessions[job.id]:
+                                job.results.append(self._job_result(job, result).record())
+                                if len(job.results) == len(job.accessions):
+                                    self._finish(job, "done")
+                        if self._closed or all(job.status != "running" for job in jobs):
+                            break
+        finally:
+            os.remove(query_file)
+        with self._condition:
+            for job in jobs:
+                if job.status == "running":
+                    self._finish(job, "done")
+
+    @staticmethod
+    def _job_result(job, result):
+        """The result of an accession of a run, restricted to the queries of job"""
+        job_result = AccessionResult(result.accession)
+        job_result.stats = result.stats
+        for run_query_id, query_ids in job.queries.items():
+            for query_id in query_ids:
+                if run_query_id in result.coverage:
+                    job_result.coverage[query_id] = result.coverage[run_query_id]
+                    job_result.hsps[query_id] = result.hsps[run_query_id]
+                    job_result.files[query_id] = result.files[run_query_id]
+                if run_query_id in result.shared_kmers:
+                    job_result.shared_kmers[query_id] = {**result.shared_kmers[run_query_id], "query": query_id}
+                if run_query_id in result.failed_queries:
+                    job_result.failed_queries.append(query_id)
+        # The whole accession failed, or all the alignments of the job
+        accession_failed = result.status == "failed" and not result.failed_queries
+        if not job_result.coverage and (accession_failed or job_result.failed_queries):
+            job_result.status = "failed"
+        elif job_result.coverage:
+            job_result.status = "aligned"
+        return job_result
+
+
+class _ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """JSON API of the SearchService of the server:
+    POST /jobs, GET /jobs, GET /jobs/<id>, GET /jobs/<id>/results and DELETE /jobs/<id>"""
+
+    JOB_FIELDS = {"query", "accessions", "session"}
+
+    def _send(self, status, document):
+        body = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        """The job of a /jobs/<id>[/results] path (None if unknown), and whether its results are requested"""
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs" or len(parts) == 3 and parts[0] == "jobs" and parts[2] == "results":
+            return self.server.service.job(parts[1]), len(parts) == 3
+        return None, False
+
+    def do_GET(self):
+        service = self.server.service
+        if urlsplit(self.path).path.strip("/") == "jobs":
+            return self._send(200, {"jobs": service.summaries()})
+        job, results = self._route()
+        if job is None:
+            return self._send(404, {"error": f"Unknown job: {self.path}"})
+        if results:
+            return self._send(200, {**service.summary(job), "results": service.results(job)})
+        self._send(200, service.summary(job))
+
+    def do_POST(self):
+        if urlsplit(self.path).path.strip("/") != "jobs":
+            return self._send(404, {"error": f"Unknown path: {self.path}"})
+        try:
+            document = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(document, dict):
+                raise ValueError("A JSON object is expected.")
+            if document.keys() - self.JOB_FIELDS:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(document.keys() - self.JOB_FIELDS))}")
+            job = self.server.service.submit(**document)
+        except (ValueError, LoganBlasterError) as e:
+            return self._send(400, {"error": str(e)})
+        self._send(201, self.server.service.summary(job))
+
+    def do_DELETE(self):
+        job, results = self._route()
+        if job is None or results:
+            return self._send(404, {"error": f"Unknown job: {self.path}"})
+        self._send(200, self.server.service.summary(self.server.service.cancel(job.id)))
+
+    def log_message(self, format, *args):
+        pass  # runs report their progress, requests are not logged
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_service_server(service, host="127.0.0.1", port=8765, socket_path=None):
+    """HTTP server of the JSON API of service, on a TCP port or else on a Unix socket"""
+    if socket_path is not None:
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.remove(socket_path)  # left by a previous server
+        server = _UnixHTTPServer(socket_path, _ServiceRequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), _ServiceRequestHandler)
+    server.service = service
+    return server
+
+
+# --- Merging shards ---
+MERGED_METRICS_FILE_NAME = "metrics.jsonl"
+
+
+def _link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def _merge_coverage_matrices(shard_dirs, output_dir):
+    """Merges the coverage matrices of each query. Returns the number of merged matrices"""
+    prefix, suffix = LoganBlaster.COVERAGE_MATRIX_FILE_NAME.split("{query}")
+    names = sorted({name for shard_dir in shard_dirs for name in os.listdir(shard_dir)
+                    if name.startswith(prefix) and name.endswith(suffix)})
+    for name in names:
+        destination = os.path.join(output_dir, name)
+        for file_path in (destination, CoverageMatrix.index_file(destination)):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        merged = None
+        try:
+            for shard_dir in shard_dirs:
+                if not os.path.exists(os.path.join(shard_dir, name)):
+                    continue
+                with CoverageMatrix.open(os.path.join(shard_dir, name)) as matrix:
+                    if merged is None:
+                        merged = CoverageMatrix.create(destination, matrix.query_length)
+                    elif matrix.query_length != merged.query_length:
+                        raise ValueError(f"{name} stores queries of different lengths in the shards")
+                    for accession in matrix.accessions:
+                        merged.add(accession, matrix.row(accession))
+        finally:
+            if merged is not None:
+                merged.close()
+    return len(names)
+
+
+def merge_shards(shard_dirs, output_dir, metrics_files=()):
+    """Gathers the output directories of the shards of a run into output_dir: alignments and synth
+    files, input data (from the first shard), failed accessions, coverage and shared k-mers statistics,
+    run journals, coverage matrices and, if given, the metrics files of the shards (into MERGED_METRICS_FILE_NAME).
+    Files are hard linked when possible. Returns the number of alignment files"""
+    for shard_dir in shard_dirs:
+        if not os.path.isdir(shard_dir):
+            raise FileNotFoundError(f"Shard directory {shard_dir} does not exist")
+    alignments_dir = os.path.join(output_dir, LoganBlaster.ALIGNEMENT_DIR_NAME)
+    os.makedirs(alignments_dir, exist_ok=True)
+    nb_alignment_files = 0
+    for shard_dir in shard_dirs:
+        shard_alignments_dir = os.path.join(shard_dir, LoganBlaster.ALIGNEMENT_DIR_NAME)
+        if not os.path.isdir(shard_alignments_dir):
+            continue
+        for name in sorted(os.listdir(shard_alignments_dir)):
+            _link_or_copy(os.path.join(shard_alignments_dir, name), os.path.join(alignments_dir, name))
+            nb_alignment_files += 1
+
+    input_data_dir = os.path.join(shard_dirs[0], LoganBlaster.INPUT_DATA_DIR_NAME)
+    if os.path.isdir(input_data_dir):
+        shutil.copytree(input_data_dir, os.path.join(output_dir, LoganBlaster.INPUT_DATA_DIR_NAME),
+                        copy_function=_link_or_copy, dirs_exist_ok=True)
+
+    for name in (LoganBlaster.FAILED_ACCESSIONS_FILE_NAME, LoganBlaster.COVERAGE_STATS_FILE_NAME,
+                 LoganBlaster.SHARED_KMERS_FILE_NAME, RunJournal.FILE_NAME):
+        parts = [os.path.join(shard_dir, name) for shard_dir in shard_dirs if os.path.exists(os.path.join(shard_dir, name))]
+        if not parts:
+            continue
+        with open(os.path.join(output_dir, name), "wb") as out:
+            for part in parts:
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, out)
+
+    _merge_coverage_matrices(shard_dirs, output_dir)
+
+    if metrics_files:
+        metrics_file = os.path.join(output_dir, MERGED_METRICS_FILE_NAME)
+        if os.path.exists(metrics_file):
+            os.remove(metrics_file)
+        RunMetrics.merge(metrics_files, metrics_file)
+    return nb_alignment_files
+
+
+def merge_main(argv):
+    """logan_blaster merge: gathers the output directories of the shards of a run"""
+    parser = argparse.ArgumentParser(prog="logan_blaster merge",
+                                     description="Merge the output directories of the shards of a run (--shard) into a single output directory.")
+    parser.add_argument("shards", nargs="+", help="Output directories of the shards")
+    parser.add_argument("-o", "--output", type=str, required=True, help="Merged output directory")
+    parser.add_argument("--metrics", nargs="+", default=[], help=f"Metrics files of the shards (--metrics), merged into OUTPUT/{MERGED_METRICS_FILE_NAME}")
+    args = parser.parse_args(argv)
+
+    for metrics_file in args.metrics:
+        if not os.path.exists(metrics_file):
+            print(f"{RED}Error: Metrics file '{metrics_file}' does not exist.{NOCOLOR}")
+            sys.exit(1)
+    try:
+        nb_alignment_files = merge_shards(args.shards, args.output, args.metrics)
+    except (OSError, ValueError, SyntaxError) as e:
+        print(f"{RED}Error: Could not merge the shards: {e}{NOCOLOR}")
+        sys.exit(1)
+    print(f"{YELLOW}[INFO] {len(args.shards)} shards merged into {CYAN}{args.output}{YELLOW} "
+          f"({nb_alignment_files} alignment files).{NOCOLOR}")
+
+
+def coverage_main(argv):
+    """logan_blaster coverage: queries the coverage matrix of a run"""
+    parser = argparse.ArgumentParser(prog="logan_blaster coverage",
+                                     description="Query the accession x position coverage matrix of a query (coverage_matrix_<query>.npy of a run).")
+    parser.add_argument("matrix", type=str, help="Coverage matrix (.npy), next to its accession index (.accessions.txt)")
+    parser.add_argument("report", choices=["region", "top", "breadth"], help="region: accessions covering the region, with the number of covered positions and the mean coverage; "
+                                                                            "top: the -n accessions covering most positions of the region; "
+                                                                            "breadth: number of accessions covering each position of the region")
+    parser.add_argument("--start", type=int, default=None, help="First position of the region, 1-based (default: 1)")
+    parser.add_argument("--end", type=int, default=None, help="Last position of the region, included (default: query length)")
+    parser.add_argument("--min-coverage", type=int, default=1, help="Minimal number of alignments for a position to be covered (default: 1)")
+    parser.add_argument("-n", type=int, default=10, help="Number of accessions reported by top (default: 10)")
+    args = parser.parse_args(argv)
+
+    if args.min_coverage <= 0 or args.n <= 0:
+        print(f"{RED}Error: --min-coverage and -n must be positive integers.{NOCOLOR}")
+        sys.exit(1)
+    try:
+        matrix = CoverageMatrix.open(args.matrix)
+    except (OSError, ValueError, SyntaxError) as e:
+        print(f"{RED}Error: Could not read coverage matrix {args.matrix}: {e}{NOCOLOR}")
+        sys.exit(1)
+    with matrix:
+        try:
+            if args.report == "breadth":
+                breadth = matrix.breadth(args.start, args.end, args.min_coverage)
+            else:
+                results = matrix.region(args.start, args.end, args.min_coverage)
+        except ValueError as e:
+            print(f"{RED}Error: {e}{NOCOLOR}")
+            sys.exit(1)
+        if args.report == "breadth":
+            print("position\tnb_accessions")
+            for position, nb_accessions in enumerate(breadth, max(args.start or 1, 1)):
+                print(f"{position}\t{nb_accessions}")
+            return
+        if args.report == "top":
+            results = results[:args.n]
+        print("accession\tcovered_positions\tmean_coverage")
+        for accession, covered, mean in results:
+            print(f"{accession}\t{covered}\t{mean:.3f}")
+
+
+def _view_query(query_name, synth_file, query_file=None):
+    """Sequence of the query of a run-length encoded synth file: read from query_file, else looked for
+    in the input data of the run of the synth file"""
+    query_id = fasta_id(query_name)
+    if query_file is not None:
+        candidates = [query_file]
+    else:
+        run_dir = os.path.dirname(os.path.dirname(os.path.abspath(synth_file)))
+        input_data_dir = os.path.join(run_dir, LoganBlaster.INPUT_DATA_DIR_NAME)
+        queries_dir = os.path.join(input_data_dir, "queries")
+        candidates = [os.path.join(queries_dir, f"{query_id}.fa")]
+        if os.path.isdir(input_data_dir):
+            candidates += sorted(entry.path for entry in os.scandir(input_data_dir) if entry.is_file())
+    for candidate in candidates:
+        if not os.path.isfile(candidate):
+            continue
+        with open(candidate, "rb") as f:
+            if f.read(1) != b">":
+                continue
+            f.seek(0)
+            for header, seq in iter_fasta_records(f):
+                if fasta_id(header.decode()) == query_id:
+                    return seq.decode()
+    return None
+
+
+def view_main(argv):
+    """logan_blaster view: prints a compressed output or renders a run-length encoded synth file"""
+    parser = argparse.ArgumentParser(prog="logan_blaster view",
+                                     description="Print an output of a run written with --compress (.zst) or --rle-synth (.cov): "
+                                                 "compressed files are decompressed, run-length encoded synth files are rendered "
+                                                 "as the text synth file.")
+    parser.add_argument("file", type=str, help="Compressed alignment or synth file (.zst), or run-length encoded synth file (.cov)")
+    parser.add_argument("-q", "--query", type=str, help="FASTA file of the query of a .cov file (default: looked for in the input_data directory of the run)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.file):
+        print(f"{RED}Error: {args.file} does not exist.{NOCOLOR}")
+        sys.exit(1)
+    if args.file.endswith(".zst"):
+        _check_tools(["zstd"])
+        sys.stdout.flush()
+        with subprocess.Popen(["zstd", "-dcq", args.file], stdout=subprocess.PIPE) as process:
+            shutil.copyfileobj(process.stdout, sys.stdout.buffer if hasattr(sys.stdout, "buffer") else sys.stdout)
+        if process.returncode != 0:
+            print(f"{RED}Error: Could not decompress {args.file}.{NOCOLOR}")
+            sys.exit(1)
+        return
+    if not args.file.endswith(".cov"):
+        print(f"{RED}Error: {args.file} is neither a compressed (.zst) nor a run-length encoded synth file (.cov).{NOCOLOR}")
+        sys.exit(1)
+    try:
+        query_name, coverage = read_coverage_runs(args.file)
+    except (OSError, ValueError) as e:
+        print(f"{RED}Error: Could not read {args.file}: {e}{NOCOLOR}")
+        sys.exit(1)
+    query_ACGT = _view_query(query_name, args.file, args.query)
+    if query_ACGT is None:
+        print(f"{RED}Error: Query {query_name} could not be found, give its FASTA file with --query.{NOCOLOR}")
+        sys.exit(1)
+    if len(query_ACGT) != len(coverage):
+        print(f"{RED}Error: Query {query_name} has {len(query_ACGT)} positions, {args.file} has {len(coverage)}.{NOCOLOR}")
+        sys.exit(1)
+    visualize_matches(query_ACGT, query_name, len(coverage), coverage, print_abundance=True)
+
+
+def serve_main(argv):
+    """logan_blaster serve: runs the searches submitted to an HTTP API"""
+    parser = argparse.ArgumentParser(prog="logan_blaster serve",
+                                     description="Run a search service: searches are submitted as jobs to a local HTTP API, queued and run "
+                                                 "with bounded concurrency, sharing their downloads, recruitments and caches.")
+    parser.add_argument("-o", "--output", type=str, default="logan_blaster_service", help="Directory of the runs of the service (default: logan_blaster_service)")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address listened to (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port listened to (default: 8765)")
+    parser.add_argument("--socket", type=str, help="Listen to this Unix socket instead of a TCP port")
+    parser.add_argument("--runners", type=int, default=2, help="Number of runs at a time (default: 2)")
+    parser.add_argument("--batch-jobs", type=int, default=16, help="Maximal number of queued jobs coalesced into a single run, 1 to run jobs separately (default: 16)")
+    parser.add_argument("--keep-jobs", type=int, default=1000, help="Number of finished jobs whose status and results are kept, older ones are forgotten (default: 1000)")
+    parser.add_argument("-u", "--unitigs", action="store_true", help="Use unitigs instead of contigs")
+    parser.add_argument("-k", "--kmer-size", type=int, default=17, help="K-mer size for sequence recruitment")
+    parser.add_argument("-d", "--delete", action="store_true", help="Delete intermediate files after processing")
+    parser.add_argument("--download-workers", type=int, default=2, help="Number of accessions downloaded concurrently by each run (default: 2)")
+    parser.add_argument("--download-parts", type=int, default=4, help="Number of byte ranges of each file downloaded in parallel (default: 4)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of accessions recruited and aligned concurrently by each run (default: 1, or --threads)")
+    parser.add_argument("--threads", type=int, default=None, help="Number of cores shared by the recruitments and alignments of all runs (0: all available cores)")
+    parser.add_argument("--memory", type=str, default=None, help="With --threads, memory budget of the recruitments and alignments, e.g. 64G (default: the physical memory)")
+    parser.add_argument("--recruiter", choices=["back_to_sequences", "builtin"], default="back_to_sequences", help="Recruitment engine: back_to_sequences, or the slower builtin python recruiter (default: back_to_sequences)")
+    parser.add_argument("--tabular", action="store_true", help="Run blastn with a tabular output (.hsp files), so that the number of HSPs is reported")
+    parser.add_argument("--compress", action="store_true", help="Compress the pairwise blast reports and text synth files with zstd (.zst)")
+    parser.add_argument("--rle-synth", action="store_true", help="Write the synth files as run-length encoded coverages (.cov) instead of text renderings")
+    parser.add_argument("--cache-dir", type=str, default=os.environ.get("LOGAN_BLASTER_CACHE"), help="Directory of downloaded tigs shared between runs (default: $LOGAN_BLASTER_CACHE, or the cache sub-directory of --output)")
+    parser.add_argument("--cache-size", type=str, default=os.environ.get("LOGAN_BLASTER_CACHE_SIZE", "0"), help="Maximal size of the download cache, e.g. 500G (default: $LOGAN_BLASTER_CACHE_SIZE, 0 for unbounded)")
+    parser.add_argument("--stage-cache", type=str, default=os.environ.get("LOGAN_BLASTER_STAGE_CACHE"), help="Directory caching recruitment and alignment results (default: $LOGAN_BLASTER_STAGE_CACHE, or the stages sub-directory of the download cache)")
+    parser.add_argument("--min-shared-kmers", type=int, default=1, help="Minimal number of k-mers a recruited tig shares with a query to be aligned with it (default: 1)")
+    parser.add_argument("--min-query-fraction", type=float, default=0.0, help="Minimal fraction of the k-mers of a query shared by the recruited tigs of an accession (default: 0)")
+    args = parser.parse_args(argv)
+
+    if args.kmer_size <= 0:
+        print(f"{RED}Error: K-mer size must be a positive integer.{NOCOLOR}")
+        sys.exit(1)
+    if args.runners <= 0 or args.batch_jobs <= 0 or args.keep_jobs <= 0:
+        print(f"{RED}Error: --runners, --batch-jobs and --keep-jobs must be positive integers.{NOCOLOR}")
+        sys.exit(1)
+    if args.min_shared_kmers < 1 or not 0 <= args.min_query_fraction <= 1:
+        print(f"{RED}Error: --min-shared-kmers must be a positive integer and --min-query-fraction between 0 and 1.{NOCOLOR}")
+        sys.exit(1)
+    try:
+        cache_size = parse_size(args.cache_size)
+    except ValueError as e:
+        print(f"{RED}Error: --cache-size: {e}{NOCOLOR}")
+        sys.exit(1)
+
+    # The cores and memory are shared by all the runs
+    scheduler = None
+    if args.threads is not None:
+        if args.threads < 0:
+            print(f"{RED}Error: --threads must be a non-negative integer.{NOCOLOR}")
+            sys.exit(1)
+        try:
+            memory = parse_size(args.memory) if args.memory else physical_memory()
+        except ValueError as e:
+            print(f"{RED}Error: --memory: {e}{NOCOLOR}")
+            sys.exit(1)
+        scheduler = ResourceScheduler(args.threads or available_cores(), memory)
+        if args.workers is None:
+            args.workers = scheduler.threads
+    elif args.memory:
+        print(f"{RED}Error: --memory can only be used with --threads.{NOCOLOR}")
+        sys.exit(1)
+    if args.workers is None:
+        args.workers = 1
+    if args.download_workers <= 0 or args.workers <= 0 or args.download_parts <= 0:
+        print(f"{RED}Error: --download-workers, --download-parts and --workers must be positive integers.{NOCOLOR}")
+        sys.exit(1)
+
+    # Tools are looked for once, when the service starts
+    required_tools = ["blastn", "zstd"]
+    if args.recruiter == "back_to_sequences":
+        required_tools.append("back_to_sequences")
+    _check_tools(required_tools)
+
+    cache_dir = args.cache_dir or os.path.join(args.output, "cache")
+    service = SearchService(
+        args.output,
+        runners=args.runners,
+        batch_jobs=args.batch_jobs,
+        keep_jobs=args.keep_jobs,
+        kmer_size=args.kmer_size,
+        unitigs=args.unitigs,
+        delete=args.delete,
+        download_workers=args.download_workers,
+        workers=args.workers,
+        recruiter=args.recruiter,
+        tabular=args.tabular,
+        compress=args.compress,
+        rle_synth=args.rle_synth,
+        cache=DownloadCache(cache_dir, cache_size),
+        stage_cache=StageCache(args.stage_cache or os.path.join(cache_dir, "stages")),
+        downloader=HTTPDownloader(parts=args.download_parts),
+        scheduler=scheduler,
+        min_shared_kmers=args.min_shared_kmers,
+        min_query_fraction=args.min_query_fraction,
+    )
+    try:
+        server = make_service_server(service, args.host, args.port, args.socket)
+    except OSError as e:
+        print(f"{RED}Error: Could not listen to {args.socket or f'{args.host}:{args.port}'}: {e}{NOCOLOR}")
+        sys.exit(1)
+    service.start()
+    address = args.socket or f"http://{args.host}:{server.server_address[1]}"
+    print(f"{YELLOW}[INFO] Search service listening to {CYAN}{address}{YELLOW}, runs in {CYAN}{service.directory}{NOCOLOR}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{YELLOW}[INFO] Stopping the search service after the accessions being processed...{NOCOLOR}")
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def _check_tools(tools):
+    for cmd in tools:
+        if shutil.which(cmd) is None:
+            print(f"{RED}Error: '{cmd}' could not be found. Please install it and ensure it's in your PATH.{NOCOLOR}")
+            sys.exit(1)
+
+
+# Subcommands, given as first argument of logan_blaster
+_SUBCOMMANDS = {
+    "coverage": coverage_main,
+    "merge": merge_main,
+    "serve": serve_main,
+    "view": view_main,
+}
+
+
+class _VersionAction(argparse.Action):
+    """--version, resolving the version only when it is asked for"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(f"{parser.prog} {_resolve_version()}")
+        parser.exit()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in _SUBCOMMANDS:
+        return _SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="Process Logan session or accession/query files.")
+    parser.add_argument("-s", "--session", type=str, help="Logan session ID")
+    parser.add_argument("-a", "--accessions", type=str, help="Path to accessions.txt file or .csv file (comma or tab separated, containing a first header line and storing accessions as the first column; other columns can be used by --order-by)")
+    parser.add_argument("-q", "--query", type=str, help="Path to query fasta file. With several sequences, each of them is a query, and accessions are downloaded and recruited once for all")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Output directory name (default: based on query name if using --accessions and --query or session ID if using --session)")
+    parser.add_argument("-u", "--unitigs", action="store_true", help="Use unitigs instead of contigs")
+    parser.add_argument("-k", "--kmer-size", type=int, default=17, help="K-mer size for sequence recruitment")
+    parser.add_argument("-l", "--limit", type=int, default=0, help="Limit number of accessions to process")
+    parser.add_argument("-d", "--delete", action="store_true", help="Delete intermediate files after processing")
+    parser.add_argument("--download-workers", type=int, default=2, help="Number of accessions downloaded concurrently, ahead of their processing (default: 2)")
+    parser.add_argument("--download-parts", type=int, default=4, help="Number of byte ranges of each file downloaded in parallel (default: 4)")
+    parser.add_argument("--recruiter", choices=["back_to_sequences", "builtin"], default="back_to_sequences", help="Recruitment engine: back_to_sequences, or the builtin in-process k-mer recruiter (requires zstd), a slower single-core python fallback for large accessions (default: back_to_sequences)")
+    parser.add_argument("--tabular", action="store_true", help="Run blastn with a tabular output, stored as compact binary HSP files (.hsp) instead of pairwise text reports")
+    parser.add_argument("--pairwise", action="store_true", help="With --tabular, also write the pairwise text blast reports, rendered by blast_formatter from the same blastn run")
+    parser.add_argument("--compress", action="store_true", help="Compress the pairwise blast reports and text synth files with zstd (.zst), printed by 'logan_blaster view'")
+    parser.add_argument("--rle-synth", action="store_true", help="Write the synth files as run-length encoded coverages of the query positions (.cov) instead of text renderings, rendered by 'logan_blaster view'")
+    parser.add_argument("--blast-batch", type=int, default=1, help="Number of accessions whose recruited sequences are aligned with a single blastn run (default: 1, one run per accession)")
+    parser.add_argument("--makeblastdb", action="store_true", help="Build a temporary blast database for each alignment or batch of --blast-batch (enables --blast-threads, and several threads per alignment with --threads)")
+    parser.add_argument("--blast-threads", type=int, default=1, help="Number of blastn threads, used with --makeblastdb (default: 1)")
+    parser.add_argument("--cache-dir", type=str, default=os.environ.get("LOGAN_BLASTER_CACHE"), help="Directory of downloaded tigs shared between runs (default: $LOGAN_BLASTER_CACHE, no cache if unset)")
+    parser.add_argument("--cache-size", type=str, default=os.environ.get("LOGAN_BLASTER_CACHE_SIZE", "0"), help="Maximal size of the download cache, e.g. 500G. Least recently used files are evicted (default: $LOGAN_BLASTER_CACHE_SIZE, 0 for unbounded)")
+    parser.add_argument("--stage-cache", type=str, default=os.environ.get("LOGAN_BLASTER_STAGE_CACHE"), help="Directory caching recruitment and alignment results, so that unchanged stages are skipped when re-running (default: $LOGAN_BLASTER_STAGE_CACHE, or the stages sub-directory of --cache-dir)")
+    parser.add_argument("--stream", action="store_true", help="Stream the Logan tigs from the network, decompress them on the fly and keep only recruited sequences on disk (requires zstd)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of accessions recruited and aligned concurrently (default: 1, or --threads)")
+    parser.add_argument("--threads", type=int, default=None, help="Number of cores shared by the concurrent recruitments and alignments (0: all available cores). back_to_sequences (and blastn, with --makeblastdb) get more threads for larger accessions, and small accessions are processed in parallel")
+    parser.add_argument("--memory", type=str, default=None, help="With --threads, memory budget of the recruitments and alignments, e.g. 64G (default: the physical memory)")
+    parser.add_argument("--max-scratch", type=str, default=None, help="Maximal disk space of the intermediate files (downloaded tigs and recruited sequences), e.g. 200G. Downloads pause when it is reached, and the files of processed accessions are evicted first (default: unbounded)")
+    parser.add_argument("--metrics", type=str, help="Write per-stage performance metrics of each accession (wall and CPU time, peak memory, downloaded bytes, recruited tigs, HSPs) and a final summary to this JSON lines file")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted run in the output directory (-o) or session directory: accessions completed according to its run_journal.jsonl are skipped")
+    parser.add_argument("--shard", type=str, help="Process only shard i/N of the accessions (1 <= i <= N), e.g. --shard $SLURM_ARRAY_TASK_ID/N. The partition is deterministic; shards are gathered with 'logan_blaster merge'")
+    parser.add_argument("--shard-by-size", action="store_true", help="With --shard, balance the shards by the size of the tigs of the accessions (one HEAD request per accession) instead of their number")
+    parser.add_argument("--order-by", type=str, help="Process the accessions by decreasing value of this column of the session metadata (e.g. kmer_coverage, the k-mer hit score of Logan-Search) or of the CSV accession file. With --limit, the accessions of highest values are processed")
+    parser.add_argument("--stop-after-hits", type=int, default=0, help="Stop the run once this number of accessions have non-empty alignments to the query (default: 0, process all accessions)")
+    parser.add_argument("--min-shared-kmers", type=int, default=1, help="Minimal number of k-mers a recruited tig shares with a query to be aligned with it (default: 1)")
+    parser.add_argument("--min-query-fraction", type=float, default=0.0, help="Minimal fraction of the k-mers of a query shared by the recruited tigs of an accession (after --min-shared-kmers) for the accession to be aligned with it, e.g. 0.05 (default: 0)")
+    parser.add_argument("--version", action=_VersionAction)
+    args = parser.parse_args()
+
+    # Argument checks
+    if not args.session and (not args.accessions or not args.query):
+        print(f"{RED}Error: You must provide either --session (-s) or both --accessions (-a) and --query (-q).{NOCOLOR}")
+        sys.exit(1)
+
+    if args.session and (args.accessions or args.query):
+        print(f"{RED}Error: --session (-s) cannot be combined with --accessions (-a) or --query (-q).{NOCOLOR}")
+        sys.exit(1)
+
+    if args.kmer_size <= 0:
+        print(f"{RED}Error: K-mer size must be a positive integer.{NOCOLOR}")
+        sys.exit(1)
+
+    if args.limit < 0:
+        print(f"{RED}Error: Limit must be a non-negative integer.{NOCOLOR}")
+        sys.exit(1)
+
+    if args.min_shared_kmers < 1:
+        print(f"{RED}Error: --min-shared-kmers must be a positive integer.{NOCOLOR}")
+        sys.exit(1)
+
+    if not 0 <= args.min_query_fraction <= 1:
+        print(f"{RED}Error: --min-query-fraction must be between 0 and 1.{NOCOLOR}")
+        sys.exit(1)
+
+    if args.stop_after_hits < 0:
+        print(f"{RED}Error: --stop-after-hits must be a non-negative integer.{NOCOLOR}")
+        sys.exit(1)
+
+    if args.resume and not (args.output or args.session):
+        print(f"{RED}Error: --resume needs the output directory (-o) of the interrupted run, or its session (-s).{NOCOLOR}")
+        sys.exit(1)
+
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            print(f"{RED}Error: --shard: {e}{NOCOLOR}")
+            sys.exit(1)
+    elif args.shard_by_size:
+        print(f"{RED}Error: --shard-by-size can only be used with --shard.{NOCOLOR}")
+        sys.exit(1)
+
+    if args.pairwise and not args.tabular:
+        print(f"{RED}Error: --pairwise can only be used with --tabular (pairwise reports are written by default).{NOCOLOR}")
+        sys.exit(1)
+
+    if args.blast_batch <= 0 or args.blast_threads <= 0:
+        print(f"{RED}Error: --blast-batch and --blast-threads must be positive integers.{NOCOLOR}")
+        sys.exit(1)
+
+    try:
+        cache_size = parse_size(args.cache_size)
+    except ValueError as e:
+        print(f"{RED}Error: --cache-size: {e}{NOCOLOR}")
+        sys.exit(1)
+
+    scratch = None
+    if args.max_scratch:
+        try:
+            scratch = ScratchSpace(None, parse_size(args.max_scratch))
+        except ValueError as e:
+            print(f"{RED}Error: --max-scratch: {e}{NOCOLOR}")
+            sys.exit(1)
+
+    stage_cache_dir = args.stage_cache
+    if not stage_cache_dir and args.cache_dir:
+        stage_cache_dir = os.path.join(args.cache_dir, "stages")
+
+    scheduler = None
+    if args.threads is not None:
+        if args.threads < 0:
+            print(f"{RED}Error: --threads must be a non-negative integer.{NOCOLOR}")
+            sys.exit(1)
+        if args.blast_threads != 1:
+            print(f"{RED}Error: --blast-threads cannot be combined with --threads, which sets the number of blastn threads.{NOCOLOR}")
+            sys.exit(1)
+        try:
+            memory = parse_size(args.memory) if args.memory else physical_memory()
+        except ValueError as e:
+            print(f"{RED}Error: --memory: {e}{NOCOLOR}")
+            sys.exit(1)
+        scheduler = ResourceScheduler(args.threads or available_cores(), memory)
+        if args.workers is None:
+            args.workers = scheduler.threads
+    elif args.memory:
+        print(f"{RED}Error: --memory can only be used with --threads.{NOCOLOR}")
+        sys.exit(1)
+    if args.workers is None:
+        args.workers = 1
+
+    if args.download_workers <= 0 or args.workers <= 0 or args.download_parts <= 0:
+        print(f"{RED}Error: --download-workers, --download-parts and --workers must be positive integers.{NOCOLOR}")
+        sys.exit(1)
+
+    required_tools = ["blastn", "zstd"]
+    if args.recruiter == "back_to_sequences":
+        required_tools.append("back_to_sequences")
+    if args.makeblastdb:
+        required_tools.append("makeblastdb")
+    if args.pairwise:
+        required_tools.append("blast_formatter")
+    _check_tools(required_tools)
+
+    # Resolve absolute paths of the inputs
+    abs_query_file = os.path.abspath(args.query) if args.query else None
+    abs_accession_file = os.path.abspath(args.accessions) if args.accessions else None
+
+    blaster = LoganBlaster(
+        session_id=args.session,
+        accession_file=args.accessions,
+        query_file=args.query,
         delete=args.delete,
         unitigs=args.unitigs,
         kmer_size=args.kmer_size,
         limit=args.limit,
         output_dir=args.output,
+        download_workers=args.download_workers,
+        workers=args.workers,
+        stream=args.stream,
+        recruiter=args.recruiter,
+        tabular=args.tabular,
+        pairwise=args.pairwise,
+        compress=args.compress,
+        rle_synth=args.rle_synth,
+        blast_batch=args.blast_batch,
+        makeblastdb=args.makeblastdb,
+        blast_threads=args.blast_threads,
+        cache=DownloadCache(args.cache_dir, cache_size) if args.cache_dir else None,
+        stage_cache=StageCache(stage_cache_dir) if stage_cache_dir else None,
+        resume=args.resume,
+        downloader=HTTPDownloader(parts=args.download_parts),
+        metrics=RunMetrics(os.path.abspath(args.metrics)) if args.metrics else None,
+        shard=shard,
+        shard_by_size=args.shard_by_size,
+        scheduler=scheduler,
+        scratch=scratch,
+        order_by=args.order_by,
+        stop_after_hits=args.stop_after_hits,
+        min_shared_kmers=args.min_shared_kmers,
+        min_query_fraction=args.min_query_fraction,
     )
-    blaster.run(abs_query_file=abs_query_file, abs_accession_file=abs_accession_file)
+    try:
+        blaster.run(abs_query_file=abs_query_file, abs_accession_file=abs_accession_file)
+    except LoganBlasterError as e:
+        print(f"{RED}Error: {e}{NOCOLOR}")
+        sys.exit(1)
 
     print(f"\n{BLUE}================")
     print(f"{CYAN}>>> All done <<<")
@@ -492,19 +4233,19 @@ def main():
     if not args.delete:
         print(f"{YELLOW}[INFO] You did not use --delete option. So you can manually remove all intermediate files "
               f"(recruited {blaster.type}s and {blaster.type}s files) by running:{NOCOLOR}")
-        print(f"rm -rf {blaster.main_dir_name}/{LoganBlaster.LOGAN_DIR_NAME}")
+        print(f"rm -rf {os.path.relpath(blaster._path(LoganBlaster.LOGAN_DIR_NAME))}")
 
-    os.chdir("..")
-    print(f"{YELLOW}[INFO] Results can be found in directory {CYAN}{blaster.main_dir_name}{NOCOLOR}")
+    print(f"{YELLOW}[INFO] Results can be found in directory {CYAN}{os.path.relpath(blaster.main_dir_name)}{NOCOLOR}")
 
-    if not args.unitigs and os.path.getsize(f"{blaster.main_dir_name}/{blaster.failed_accession_list}") > 0:
-        nb_failed = len(open(f"{blaster.main_dir_name}/{blaster.failed_accession_list}").readlines())
+    if not args.unitigs and os.path.getsize(blaster.failed_accession_list) > 0:
+        failed_accession_list = os.path.relpath(blaster.failed_accession_list)
+        nb_failed = len(open(failed_accession_list).readlines())
         print(f"{YELLOW}[INFO] {nb_failed} accession{'s' if nb_failed > 1 else ''} failed to download contigs or had no recruited sequences.{NOCOLOR}")
-        print(f"{YELLOW}[INFO] List of failed accessions: {CYAN}{blaster.main_dir_name}/{blaster.failed_accession_list}{NOCOLOR}")
+        print(f"{YELLOW}[INFO] List of failed accessions: {CYAN}{failed_accession_list}{NOCOLOR}")
         print(f"{YELLOW}[INFO] You can try to re-run the script with --unitigs option and this accession list.{NOCOLOR}")
         print(f"{YELLOW}[INFO] Command example:{NOCOLOR}")
         delete_flag = "-d" if args.delete else ""
-        print(f"logan_blaster -a {blaster.main_dir_name}/{blaster.failed_accession_list} -q {blaster.main_dir_name}/{blaster.query_file} --unitigs -k {args.kmer_size} {delete_flag} {NOCOLOR}")
+        print(f"logan_blaster -a {failed_accession_list} -q {os.path.relpath(blaster.query_file)} --unitigs -k {args.kmer_size} {delete_flag} {NOCOLOR}")
 
 
 if __name__ == "__main__":
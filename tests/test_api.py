@@ -0,0 +1,148 @@
+"""Tests of the library API: results of the accessions of a run, without changing the working
+directory (the stub blastn and back_to_sequences of benchmarks/stubs replace the real tools)."""
+import os
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+import logan_blaster
+from benchmarks import synthetic
+from logan_blaster import AccessionResult, LoganBlaster, LoganBlasterError, iter_fasta_records, search
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "stubs")
+
+
+@pytest.fixture
+def stubs_on_path(monkeypatch):
+    monkeypatch.setenv("PATH", f"{STUBS_DIR}{os.pathsep}{os.environ['PATH']}")
+
+
+def _inputs(tmp_path, accessions, query_length=600):
+    query_file = str(tmp_path / "query.fa")
+    query = synthetic.make_query(query_file, query_length)
+    contigs = {}
+    for seed, accession in enumerate(accessions):
+        contigs[accession] = str(tmp_path / f"{accession}.fa")
+        synthetic.make_contigs(contigs[accession], query, 200, matching_fraction=0.05 if seed else 0, seed=seed,
+                               accession=accession)
+    return query_file, contigs
+
+
+def _stub_stages(blaster, contigs):
+    """Downloads are replaced by the synthetic contigs, and recruitment keeps the tigs embedding the query,
+    appending a count of 1 shared k-mer to their headers"""
+    def recruit(source, recruited_file, stats=None):
+        with open(source, "rb") as f, open(recruited_file, "wb") as out:
+            for header, seq in iter_fasta_records(f):
+                if b"bench:q:" in header:
+                    out.write(b"%s 1\n%s\n" % (header, seq))
+        return True, ""
+
+    blaster._download_accession = lambda accession: contigs.get(accession)
+    blaster._recruit = recruit
+
+
+class TestResults:
+    def test_results_of_each_accession(self, tmp_path, stubs_on_path):
+        query_file, contigs = _inputs(tmp_path, ["SRR0", "SRR1", "SRR2"])
+        blaster = LoganBlaster(None, None, query_file, False, False, 17, 0, str(tmp_path / "run"), tabular=True)
+        _stub_stages(blaster, contigs)
+        cwd = os.getcwd()
+        results = {result.accession: result for result in blaster.results(query_file, accessions=["SRR0", "SRR1", "SRR2", "SRR3"])}
+        assert os.getcwd() == cwd
+
+        assert {accession: result.status for accession, result in results.items()} == {
+            "SRR0": "not_aligned", "SRR1": "aligned", "SRR2": "aligned", "SRR3": "failed"}
+        result = results["SRR1"]
+        assert result.hits == ["bench_query"]
+        hsps = result.hsps["bench_query"]
+        assert len(hsps) > 0
+        assert len(result.coverage["bench_query"]) == 600
+        assert sum(result.coverage["bench_query"]) == sum(end - start + 1 for start, end in zip(hsps["qstart"], hsps["qend"]))
+        assert all(os.path.isabs(file) and os.path.exists(file) for file in result.files["bench_query"])
+        assert result.stats["recruited"]["nb_tigs"] == len(hsps)
+        assert result.shared_kmers["bench_query"]["tigs"] == result.shared_kmers["bench_query"]["shared_kmers"] == len(hsps)
+        assert (tmp_path / "run" / "input_data" / "accessions.txt").read_text() == "SRR0\nSRR1\nSRR2\nSRR3\n"
+
+    def test_batched_alignments(self, tmp_path, stubs_on_path):
+        query_file, contigs = _inputs(tmp_path, ["SRR0", "SRR1", "SRR2", "SRR3"])
+        blaster = LoganBlaster(None, None, query_file, False, False, 17, 0, str(tmp_path / "run"), tabular=True,
+                               blast_batch=2)
+        _stub_stages(blaster, contigs)
+        results = list(blaster.results(query_file, accessions=list(contigs)))
+        assert sorted((result.accession, result.status) for result in results) == [
+            ("SRR0", "not_aligned"), ("SRR1", "aligned"), ("SRR2", "aligned"), ("SRR3", "aligned")]
+
+    def test_concurrent_searches(self, tmp_path, stubs_on_path):
+        query_file, contigs = _inputs(tmp_path, ["SRR0", "SRR1", "SRR2"])
+        hits = {}
+
+        def run(name):
+            blaster = LoganBlaster(None, None, query_file, False, False, 17, 0, str(tmp_path / name), tabular=True)
+            _stub_stages(blaster, contigs)
+            hits[name] = sorted(result.accession for result in blaster.results(query_file, accessions=list(contigs))
+                                if result.hits)
+
+        threads = [threading.Thread(target=run, args=(f"run_{i}",)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert hits == {f"run_{i}": ["SRR1", "SRR2"] for i in range(3)}
+        for i in range(3):
+            assert sorted(os.listdir(tmp_path / f"run_{i}" / LoganBlaster.ALIGNEMENT_DIR_NAME)) == [
+                "bench_query_vs_SRR1.hsp", "bench_query_vs_SRR2.hsp",
+                "synth_bench_query_vs_SRR1.txt", "synth_bench_query_vs_SRR2.txt"]
+
+    def test_closing_stops_the_run(self, tmp_path, stubs_on_path):
+        accessions = [f"SRR{i}" for i in range(1, 10)]
+        query_file, contigs = _inputs(tmp_path, ["SRR0"] + accessions)
+        blaster = LoganBlaster(None, None, query_file, False, False, 17, 0, str(tmp_path / "run"), tabular=True,
+                               download_workers=1)
+        _stub_stages(blaster, contigs)
+        results = blaster.results(query_file, accessions=accessions)
+        assert isinstance(next(results), AccessionResult)
+        results.close()
+        assert len(os.listdir(tmp_path / "run" / LoganBlaster.ALIGNEMENT_DIR_NAME)) < 2 * len(accessions)
+
+    def test_failed_session_download(self, tmp_path, monkeypatch):
+        def download(self, url, destination):
+            raise OSError(f"{url}: 404 Not Found")
+        monkeypatch.setattr(logan_blaster.HTTPDownloader, "download", download)
+        blaster = LoganBlaster("kmviz-missing", None, None, False, False, 17, 0, str(tmp_path / "run"))
+        with pytest.raises(LoganBlasterError, match="kmviz-missing"):
+            next(blaster.results())
+
+    def test_duplicated_query_ids(self, tmp_path):
+        query_file = tmp_path / "queries.fa"
+        query_file.write_text(">q\nACGTACGT\n>q\nGGGGCCCC\n")
+        blaster = LoganBlaster(None, None, str(query_file), False, False, 17, 0, str(tmp_path / "run"))
+        blaster._download_accession = lambda accession: pytest.fail("no accession is downloaded")
+        with pytest.raises(LoganBlasterError, match="several sequences"):
+            next(blaster.results(str(query_file), accessions=["SRR1"]))
+
+    def test_missing_query(self, tmp_path):
+        blaster = LoganBlaster(None, None, "missing.fa", False, False, 17, 0, str(tmp_path / "run"))
+        with pytest.raises(LoganBlasterError):
+            next(blaster.results(str(tmp_path / "missing.fa"), accessions=["SRR1"]))
+
+    def test_no_query_nor_session(self, tmp_path):
+        blaster = LoganBlaster(None, None, None, False, False, 17, 0, str(tmp_path / "run"))
+        with pytest.raises(LoganBlasterError, match="A query file or a session is required"):
+            next(blaster.results(None, None, accessions=["SRR1"]))
+
+
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd is required")
+class TestSearch:
+    def test_search(self, tmp_path, stubs_on_path):
+        query_file, contigs = _inputs(tmp_path, ["SRR0", "SRR1"])
+        output_dir = tmp_path / "run"
+        (output_dir / LoganBlaster.LOGAN_DIR_NAME).mkdir(parents=True)
+        for accession, fasta in contigs.items():
+            subprocess.run(["zstd", "-q", fasta, "-o", str(output_dir / LoganBlaster.LOGAN_DIR_NAME / f"{accession}.contigs.fa.zst")],
+                           check=True)
+        results = {result.accession: result for result in search(query_file, ["SRR0", "SRR1"], str(output_dir))}
+        assert results["SRR0"].status == "not_aligned"
+        assert results["SRR1"].hits == ["bench_query"] and len(results["SRR1"].hsps["bench_query"]) > 0
@@ -0,0 +1,57 @@
+"""Checks of the synthetic benchmark data and stub executables (no external tools or network required)."""
+import os
+import subprocess
+import sys
+
+from benchmarks import synthetic
+from logan_blaster import CoverageStats, coverage_from_intervals, get_query_ACGT, iter_fasta_records, parse_blastn
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "stubs")
+
+
+class TestSynthetic:
+    def test_blast_report_is_parsed(self, tmp_path):
+        query = synthetic.make_query(str(tmp_path / "query.fa"), 1000)
+        intervals = synthetic.make_blast_report(str(tmp_path / "report.txt"), "bench_query", query, 50)
+        name, length, coverage = parse_blastn(str(tmp_path / "report.txt"))
+        assert (name, length) == ("bench_query", 1000)
+        assert list(coverage) == list(coverage_from_intervals(intervals, 1000))
+
+    def test_contigs(self, tmp_path):
+        query = synthetic.make_query(str(tmp_path / "query.fa"), 1000)
+        nb_matching = synthetic.make_contigs(str(tmp_path / "contigs.fa"), query, 500, matching_fraction=0.1)
+        assert 20 < nb_matching < 100
+        stats = CoverageStats()
+        with open(tmp_path / "contigs.fa", "rb") as f:
+            for header, seq in iter_fasta_records(f):
+                stats.add(header, len(seq))
+                if b"bench:q:" in header:
+                    start, end = map(int, header.split(b"bench:q:")[1].split(b"-"))
+                    assert query[start - 1: end].encode() in seq
+        assert (stats.nb_tigs, stats.nb_with_abundance) == (500, 500)
+
+    def test_deterministic(self, tmp_path):
+        query = synthetic.random_sequence(synthetic.random.Random(0), 500)
+        assert list(synthetic.iter_contigs(query, 20, seed=3)) == list(synthetic.iter_contigs(query, 20, seed=3))
+
+
+class TestStubs:
+    def test_stubs_recruit_and_align_tagged_contigs(self, tmp_path):
+        query_file = str(tmp_path / "query.fa")
+        query = synthetic.make_query(query_file, 1000)
+        synthetic.make_contigs(str(tmp_path / "contigs.fa"), query, 200, matching_fraction=0.1)
+        recruited = str(tmp_path / "recruited.fa")
+        with open(tmp_path / "contigs.fa", "rb") as contigs:
+            subprocess.run([sys.executable, os.path.join(STUBS_DIR, "back_to_sequences"), "--kmer-size", "17",
+                            "--in-kmers", query_file, "--in-sequences", "/dev/stdin", "--out-sequences", recruited],
+                           stdin=contigs, check=True)
+        with open(recruited, "rb") as f:
+            headers = [header for header, _ in iter_fasta_records(f)]
+        assert headers and all(b"bench:q:" in header for header in headers)
+
+        report = str(tmp_path / "report.txt")
+        subprocess.run([sys.executable, os.path.join(STUBS_DIR, "blastn"), "-query", query_file, "-subject", recruited,
+                        "-out", report, "-outfmt", "0"], check=True)
+        name, length, coverage = parse_blastn(report)
+        assert (name, length) == ("bench_query", len(get_query_ACGT(query_file)))
+        assert sum(1 for v in coverage if v) > 0
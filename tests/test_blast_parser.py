@@ -1,14 +1,24 @@
 """Unit tests for blast parser functions (no external tools or network required)."""
 import io
 import contextlib
+from array import array
+
 import pytest
 
 from logan_blaster import (
+    HSPTable,
+    demultiplex_pairwise_report,
+    demultiplex_tabular,
     get_query_ACGT,
     get_query_name,
     get_query_length,
     parse_blastn,
+    read_coverage_runs,
     run_blast_parser,
+    run_hsp_parser,
+    synth_symbols,
+    visualize_matches,
+    write_coverage_runs,
 )
 
 QUERY_LENGTH = 963
@@ -106,7 +116,7 @@ class TestParseBLASTN:
         name, length, positions = parse_blastn(str(f))
         assert name == "test"
         assert length == 5
-        assert positions == [0, 0, 0, 0, 0]
+        assert list(positions) == [0, 0, 0, 0, 0]
 
     def test_minimal_blast_positions(self, tmp_path):
         blast = tmp_path / "minimal.txt"
@@ -116,16 +126,46 @@ class TestParseBLASTN:
         )
         _, length, positions = parse_blastn(str(blast))
         assert length == 15
-        assert positions[0:2] == [0, 0]           # positions 1-2: not covered
-        assert positions[2:12] == [1] * 10        # positions 3-12: covered once
-        assert positions[12:15] == [0, 0, 0]      # positions 13-15: not covered
+        assert list(positions[0:2]) == [0, 0]           # positions 1-2: not covered
+        assert list(positions[2:12]) == [1] * 10        # positions 3-12: covered once
+        assert list(positions[12:15]) == [0, 0, 0]      # positions 13-15: not covered
+
+    def test_positions_is_a_compact_integer_array(self, self_blast_txt):
+        _, _, positions = parse_blastn(self_blast_txt)
+        assert isinstance(positions, array)
+        assert positions.typecode == "I"
+
+    def test_overlapping_and_adjacent_intervals(self, tmp_path):
+        blast = tmp_path / "overlaps.txt"
+        blast.write_text(
+            "Query= overlaps\n\nLength=10\n\n"
+            "Query  1  ATGA  4\n"
+            "Query  3  GATA  6\n"
+            "Query  7  TTTT  10\n"
+            "Query  4  AT  5\n"
+        )
+        _, _, positions = parse_blastn(str(blast))
+        assert list(positions) == [1, 1, 2, 3, 2, 1, 1, 1, 1, 1]
+
+    def test_only_first_length_is_used(self, tmp_path):
+        blast = tmp_path / "subject_length.txt"
+        blast.write_text("Query= q\n\nLength=4\n\n> subject\nLength=1000\n\nQuery  1  ATGA  4\n")
+        _, length, positions = parse_blastn(str(blast))
+        assert length == 4
+        assert list(positions) == [1, 1, 1, 1]
+
+    def test_empty_file(self, tmp_path):
+        blast = tmp_path / "empty.txt"
+        blast.write_text("")
+        name, length, positions = parse_blastn(str(blast))
+        assert (name, length, list(positions)) == (None, None, [])
 
     def test_returns_empty_positions_on_missing_length(self, tmp_path):
         blast = tmp_path / "nolength.txt"
         blast.write_text("Query= test\n\nQuery  1  ATGAT  5\n")
         name, length, positions = parse_blastn(str(blast))
         assert length is None
-        assert positions == []
+        assert list(positions) == []
 
 
 class TestRunBlastParser:
@@ -152,3 +192,249 @@ class TestRunBlastParser:
         with contextlib.redirect_stdout(buf):
             run_blast_parser(query_fa, self_blast_txt, abundance=True)
         assert QUERY_PREFIX in buf.getvalue()
+
+    def test_writes_to_given_stream_only(self, query_fa, self_blast_txt, expected_self_synth, capsys):
+        out = io.StringIO()
+        run_blast_parser(query_fa, self_blast_txt, abundance=True, out=out)
+        assert out.getvalue() == expected_self_synth
+        assert capsys.readouterr().out == ""
+
+    def test_output_written_by_blocks(self, query_fa, self_blast_txt, expected_self_synth, monkeypatch):
+        monkeypatch.setattr("logan_blaster.SYNTH_BLOCK_LINES", 2)
+        writes = []
+        out = io.StringIO()
+        out.write = lambda text: writes.append(text)
+        run_blast_parser(query_fa, self_blast_txt, abundance=True, out=out)
+        assert "".join(writes) == expected_self_synth
+        assert len(writes) == 7, "13 query lines and the name line, 2 at a time"
+
+
+class TestSynthSymbols:
+    def test_abundance(self):
+        assert synth_symbols(array('I', [0, 1, 2, 26, 27, 300, 70000]), True) == "-abzZZZ"
+
+    def test_presence(self):
+        assert synth_symbols(array('I', [0, 1, 27, 70000, 0]), False) == "-|||-"
+
+    def test_line_boundaries(self):
+        out = io.StringIO()
+        visualize_matches("A" * 161, "q", 161, array('I', [1]) * 161, out=out)
+        lines = out.getvalue().split("\n")
+        assert lines[1] == "query    1  " + "A" * 80
+        assert lines[2] == " " * 12 + "|" * 80
+        assert lines[7] == "query  161  A"
+        assert lines[8] == " " * 12 + "|"
+
+
+def _self_blast_as_tabular(self_blast_txt, tsv):
+    """Tabular version of self_blast.txt, one HSP per 'Query' line (same coverage)"""
+    rows = []
+    with open(self_blast_txt) as f:
+        for line in f:
+            if line.startswith("Query "):
+                parts = line.split()
+                rows.append(f"my_query\t{parts[1]}\t{parts[3]}\t1\t60\t100.000\t1e-30\t111\n")
+    tsv.write_text("".join(rows))
+
+
+class TestHSPTable:
+    TABULAR = (
+        "tig_1\t1\t60\t10\t69\t100.000\t2.5e-25\t111\n"
+        "tig_1\t50\t80\t300\t270\t96.774\t1e-180\t52.8\n"
+        "tig_2\t5\t20\t1\t16\t93.750\t0.003\t23.3\n"
+    )
+
+    def _table(self, tmp_path):
+        tsv = tmp_path / "hsps.tsv"
+        tsv.write_text("# BLASTN 2.x\n" + self.TABULAR)
+        return HSPTable.from_tabular(str(tsv))
+
+    def test_columns(self, tmp_path):
+        table = self._table(tmp_path)
+        assert len(table) == 3
+        assert list(table["qstart"]) == [1, 50, 5]
+        assert list(table["send"]) == [69, 270, 16]
+        assert table["evalue"][1] == 1e-180
+        assert [table.subjects[i] for i in table["subject"]] == ["tig_1", "tig_1", "tig_2"]
+
+    def test_save_and_load(self, tmp_path):
+        table = self._table(tmp_path)
+        table.save(str(tmp_path / "hsps.hsp"))
+        loaded = HSPTable.load(str(tmp_path / "hsps.hsp"))
+        assert loaded.subjects == table.subjects
+        for name, _ in HSPTable.COLUMNS:
+            assert loaded[name] == table[name]
+
+    def test_each_hsp_takes_36_bytes(self, tmp_path):
+        table = self._table(tmp_path)
+        table.save(str(tmp_path / "hsps.hsp"))
+        with open(tmp_path / "hsps.hsp", "rb") as f:
+            f.readline()
+            f.readline()
+            assert len(f.read()) == 3 * 36
+
+    def test_load_rejects_other_files(self, tmp_path):
+        other = tmp_path / "other.hsp"
+        other.write_text("not an hsp file\n")
+        with pytest.raises(ValueError):
+            HSPTable.load(str(other))
+
+    def test_coverage(self, tmp_path):
+        coverage = self._table(tmp_path).coverage(100)
+        assert coverage[0] == 1
+        assert coverage[4] == 2
+        assert coverage[54] == 2
+        assert coverage[79] == 1
+        assert coverage[80] == 0
+
+
+class TestRunHSPParser:
+    def test_output_matches_expected_reference(self, tmp_path, query_fa, self_blast_txt, expected_self_synth):
+        tsv = tmp_path / "self.tsv"
+        _self_blast_as_tabular(self_blast_txt, tsv)
+        buf = io.StringIO()
+        run_hsp_parser(query_fa, HSPTable.from_tabular(str(tsv)), abundance=True, out=buf)
+        assert buf.getvalue() == expected_self_synth
+
+    def test_run_length_encoded_output(self, tmp_path, query_fa, self_blast_txt):
+        tsv = tmp_path / "self.tsv"
+        _self_blast_as_tabular(self_blast_txt, tsv)
+        cov_file = tmp_path / "synth.cov"
+        with open(cov_file, "w") as f:
+            coverage = run_hsp_parser(query_fa, HSPTable.from_tabular(str(tsv)), abundance=True, out=f, rle=True)
+        assert read_coverage_runs(str(cov_file)) == (QUERY_NAME, coverage)
+
+
+class TestCoverageRuns:
+    def test_runs(self):
+        out = io.StringIO()
+        write_coverage_runs("q", array("I", [0, 0, 1, 1, 1, 3, 0]), out)
+        assert out.getvalue() == "#query=q\n#length=7\n0\t2\n1\t3\n3\t1\n0\t1\n"
+
+    def test_round_trip(self, tmp_path, query_fa, self_blast_txt):
+        cov_file = tmp_path / "synth.cov"
+        with open(cov_file, "w") as f:
+            coverage = run_blast_parser(query_fa, self_blast_txt, abundance=True, out=f, rle=True)
+        assert read_coverage_runs(str(cov_file)) == (QUERY_NAME, coverage)
+        # A few runs for the 963 positions of the query
+        assert len(cov_file.read_text().splitlines()) < 20
+
+    def test_empty_coverage(self, tmp_path):
+        cov_file = tmp_path / "synth.cov"
+        with open(cov_file, "w") as f:
+            write_coverage_runs("q", array("I"), f)
+        assert read_coverage_runs(str(cov_file)) == ("q", array("I"))
+
+    def test_truncated_file(self, tmp_path):
+        cov_file = tmp_path / "synth.cov"
+        cov_file.write_text("#query=q\n#length=10\n1\t4\n")
+        with pytest.raises(ValueError):
+            read_coverage_runs(str(cov_file))
+
+
+BATCH_REPORT = """BLASTN 2.17.0+
+
+
+Database: User specified sequence set (Input: subjects.fa).
+           3 sequences; 300 total letters
+
+
+
+Query= q
+
+Length=20
+                                                                      Score   Total
+Sequences producing significant alignments:                          (Bits)   Score
+
+ACC1__tig_1 ka:f:3.0                                                  30.0     30.0
+ACC2__tig_7                                                           20.0     20.0
+ACC1__tig_2                                                           10.0     10.0
+
+
+> ACC1__tig_1 ka:f:3.0
+Length=100
+
+ Score = 30.0 bits (32),  Expect = 1e-05
+ Strand=Plus/Plus
+
+Query  1   ATGATATTTTCAACTTTAGA  20
+           ||||||||||||||||||||
+Sbjct  11  ATGATATTTTCAACTTTAGA  30
+
+
+> ACC2__tig_7
+Length=100
+
+ Score = 20.0 bits (20),  Expect = 0.001
+ Strand=Plus/Plus
+
+Query  5   ATTTTCAACTTT  16
+           ||||||||||||
+Sbjct  1   ATTTTCAACTTT  12
+
+
+> ACC1__tig_2
+Length=100
+
+ Score = 10.0 bits (10),  Expect = 0.1
+ Strand=Plus/Minus
+
+Query  1   ATGATATT  8
+           ||||||||
+Sbjct  80  ATGATATT  73
+
+
+
+Lambda      K        H
+    0.634    0.408    0.912
+
+Effective search space used: 5000
+
+"""
+
+
+class TestDemultiplexing:
+    def _split(self, tmp_path, accessions):
+        report = tmp_path / "batch.txt"
+        report.write_text(BATCH_REPORT)
+        outputs = {accession: str(tmp_path / f"{accession}.txt") for accession in accessions}
+        demultiplex_pairwise_report(str(report), outputs)
+        return {accession: open(path).read() for accession, path in outputs.items()}
+
+    def test_pairwise_blocks_go_to_their_accession(self, tmp_path):
+        reports = self._split(tmp_path, ["ACC1", "ACC2"])
+        assert "> tig_1 ka:f:3.0\n" in reports["ACC1"]
+        assert "> tig_2\n" in reports["ACC1"]
+        assert "tig_7" not in reports["ACC1"]
+        assert "> tig_7\n" in reports["ACC2"]
+        assert "__" not in reports["ACC1"] + reports["ACC2"]
+        assert reports["ACC2"].rstrip().endswith("Effective search space used: 5000")
+
+    def test_pairwise_coverage_per_accession(self, tmp_path):
+        self._split(tmp_path, ["ACC1", "ACC2"])
+        name, length, positions = parse_blastn(str(tmp_path / "ACC1.txt"))
+        assert (name, length) == ("q", 20)
+        assert list(positions) == [2] * 8 + [1] * 12
+        _, _, positions = parse_blastn(str(tmp_path / "ACC2.txt"))
+        assert list(positions) == [0] * 4 + [1] * 12 + [0] * 4
+
+    def test_pairwise_accession_without_hits(self, tmp_path):
+        reports = self._split(tmp_path, ["ACC1", "ACC3"])
+        assert "No hits found" in reports["ACC3"]
+        name, length, positions = parse_blastn(str(tmp_path / "ACC3.txt"))
+        assert (name, length) == ("q", 20)
+        assert max(positions) == 0
+
+    def test_tabular(self, tmp_path):
+        tsv = tmp_path / "batch.tsv"
+        tsv.write_text(
+            "ACC1__tig_1\t1\t20\t11\t30\t100.000\t1e-05\t30.0\n"
+            "lcl|ACC2__tig_7\t5\t16\t1\t12\t100.000\t0.001\t20.0\n"
+            "ACC1__tig_2\t1\t8\t80\t73\t100.000\t0.1\t10.0\n"
+        )
+        tables = demultiplex_tabular(str(tsv), ["ACC1", "ACC2", "ACC3"])
+        assert tables["ACC1"].subjects == ["tig_1", "tig_2"]
+        assert list(tables["ACC1"]["qend"]) == [20, 8]
+        assert list(tables["ACC1"]["subject"]) == [0, 1]
+        assert tables["ACC2"].subjects == ["tig_7"]
+        assert len(tables["ACC3"]) == 0
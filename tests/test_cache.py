@@ -0,0 +1,238 @@
+"""Unit tests for the caches shared between runs (no external tools or network required)."""
+import os
+import threading
+import time
+
+import pytest
+
+from logan_blaster import DownloadCache, LoganBlaster, StageCache, kmer_set_digest, parse_size
+
+
+class TestParseSize:
+    @pytest.mark.parametrize("size, expected", [
+        ("0", 0),
+        ("1048576", 1 << 20),
+        ("500M", 500 << 20),
+        ("1.5G", 3 << 29),
+        ("2TB", 2 << 40),
+        ("10k", 10 << 10),
+        ("4GiB", 4 << 30),
+    ])
+    def test_sizes(self, size, expected):
+        assert parse_size(size) == expected
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            parse_size("lots")
+
+
+def _download(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+class TestDownloadCache:
+    def test_fetch_missing(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"))
+        assert not cache.fetch("SRR1", "contig", str(tmp_path / "SRR1.contigs.fa.zst"))
+
+    def test_add_then_fetch(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"))
+        run1 = tmp_path / "run1"
+        run1.mkdir()
+        downloaded = _download(run1, "SRR1.contigs.fa.zst", 10)
+        cache.add(downloaded, "SRR1", "contig")
+        assert os.path.exists(cache.path("SRR1", "contig"))
+        assert open(downloaded, "rb").read() == b"x" * 10, "the run keeps a link to the cached file"
+
+        run2 = tmp_path / "run2"
+        run2.mkdir()
+        assert cache.fetch("SRR1", "contig", str(run2 / "SRR1.contigs.fa.zst"))
+        assert (run2 / "SRR1.contigs.fa.zst").read_bytes() == b"x" * 10
+
+    def test_types_are_distinct(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"))
+        cache.add(_download(tmp_path, "SRR1.contigs.fa.zst", 10), "SRR1", "contig")
+        assert not cache.fetch("SRR1", "unitig", str(tmp_path / "SRR1.unitigs.fa.zst"))
+
+    def test_least_recently_used_files_are_evicted(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"), max_bytes=25)
+        for i, accession in enumerate(["SRR1", "SRR2"]):
+            cache.add(_download(tmp_path, f"{accession}.contigs.fa.zst", 10), accession, "contig")
+            os.utime(cache.path(accession, "contig"), (1000 + i, 1000 + i))
+        # SRR1 is used again: SRR2 becomes the least recently used file
+        assert cache.fetch("SRR1", "contig", str(tmp_path / "again.fa.zst"))
+        cache.add(_download(tmp_path, "SRR3.contigs.fa.zst", 10), "SRR3", "contig")
+
+        assert os.path.exists(cache.path("SRR1", "contig"))
+        assert not os.path.exists(cache.path("SRR2", "contig"))
+        assert os.path.exists(cache.path("SRR3", "contig"))
+        assert (tmp_path / "SRR2.contigs.fa.zst").exists(), "evicted files remain available to the runs"
+
+    def test_concurrent_adds(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"), max_bytes=50)
+        files = [_download(tmp_path, f"SRR{i}.contigs.fa.zst", 10) for i in range(20)]
+        threads = [threading.Thread(target=cache.add, args=(f, f"SRR{i}", "contig")) for i, f in enumerate(files)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cached = [f for f in os.listdir(os.path.dirname(cache.path("SRR0", "contig")))]
+        assert 0 < len(cached) <= 5
+        assert all(name.endswith(".contigs.fa.zst") for name in cached), "no temporary file is left"
+
+    def test_claims_serialize_downloads(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"))
+        downloads = []
+
+        def download(i):
+            with cache.claim("SRR1", "contig"):
+                destination = str(tmp_path / f"run{i}.contigs.fa.zst")
+                if not cache.fetch("SRR1", "contig", destination):
+                    downloads.append(i)
+                    cache.add(_download(tmp_path, f"run{i}.contigs.fa.zst", 10), "SRR1", "contig")
+        threads = [threading.Thread(target=download, args=(i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(downloads) == 1
+        assert all((tmp_path / f"run{i}.contigs.fa.zst").read_bytes() == b"x" * 10 for i in range(5))
+
+
+class TestBlasterUsesCache:
+    def test_cached_accession_is_not_downloaded(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"))
+        cache.add(_download(tmp_path, "SRR1.contigs.fa.zst", 10), "SRR1", "contig")
+        run = tmp_path / "run"
+        (run / LoganBlaster.LOGAN_DIR_NAME).mkdir(parents=True)
+        blaster = LoganBlaster(None, None, "query.fa", False, False, 17, 0, str(run), cache=cache)
+
+        orig = os.getcwd()
+        os.chdir(str(run))
+        try:
+            local_file = blaster._download_accession("SRR1")
+        finally:
+            os.chdir(orig)
+
+        assert local_file == str(run / LoganBlaster.LOGAN_DIR_NAME / "SRR1.contigs.fa.zst")
+        assert (run / local_file).read_bytes() == b"x" * 10
+
+    def test_concurrent_runs_download_once(self, tmp_path):
+        cache = DownloadCache(str(tmp_path / "cache"))
+        urls = []
+
+        class Downloader:
+            def download(self, url, destination):
+                urls.append(url)
+                time.sleep(0.05)
+                _download(tmp_path, destination, 10)
+
+        blasters = []
+        for i in range(3):
+            (tmp_path / f"run{i}" / LoganBlaster.LOGAN_DIR_NAME).mkdir(parents=True)
+            blasters.append(LoganBlaster(None, None, "query.fa", False, False, 17, 0, str(tmp_path / f"run{i}"),
+                                         cache=cache, downloader=Downloader()))
+        threads = [threading.Thread(target=blaster._download_accession, args=("SRR1",)) for blaster in blasters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(urls) == 1
+        assert all((tmp_path / f"run{i}" / LoganBlaster.LOGAN_DIR_NAME / "SRR1.contigs.fa.zst").exists() for i in range(3))
+
+
+class TestKmerSetDigest:
+    def _digest(self, tmp_path, fasta, kmer_size=5):
+        fa = tmp_path / "q.fa"
+        fa.write_text(fasta)
+        return kmer_set_digest(str(fa), kmer_size)
+
+    def test_independent_of_layout_and_orientation(self, tmp_path):
+        reference = self._digest(tmp_path, ">q\nAAAAACCGT\n")
+        assert self._digest(tmp_path, ">other name\nAAAAA\nCCGT\n") == reference
+        assert self._digest(tmp_path, ">rc\nACGGTTTTT\n") == reference
+
+    def test_depends_on_kmer_size(self, tmp_path):
+        assert self._digest(tmp_path, ">q\nAAAAACCGT\n", 5) != self._digest(tmp_path, ">q\nAAAAACCGT\n", 4)
+
+    def test_depends_on_sequence(self, tmp_path):
+        assert self._digest(tmp_path, ">q\nAAAAACCGT\n") != self._digest(tmp_path, ">q\nAAAAACCGA\n")
+
+
+class TestStageCache:
+    def test_key_depends_on_every_input(self):
+        key = StageCache.key(stage="recruitment", accession="SRR1", kmer_size=17)
+        assert key == StageCache.key(kmer_size=17, accession="SRR1", stage="recruitment")
+        assert key != StageCache.key(stage="recruitment", accession="SRR1", kmer_size=21)
+
+    def test_store_and_fetch(self, tmp_path):
+        cache = StageCache(str(tmp_path / "stages"))
+        output = tmp_path / "recruited.fa"
+        output.write_text(">tig\nACGT\n")
+        key = StageCache.key(stage="test")
+        assert key not in cache
+        assert not cache.fetch(key, {"recruited.fa": str(tmp_path / "restored.fa")})
+
+        cache.store(key, {"recruited.fa": str(output)})
+        output.write_text("modified afterwards")
+
+        assert key in cache
+        assert cache.fetch(key, {"recruited.fa": str(tmp_path / "restored.fa")})
+        assert (tmp_path / "restored.fa").read_text() == ">tig\nACGT\n"
+
+    def test_fetch_requires_every_output(self, tmp_path):
+        cache = StageCache(str(tmp_path / "stages"))
+        output = tmp_path / "report.txt"
+        output.write_text("report")
+        key = StageCache.key(stage="test")
+        cache.store(key, {"report.txt": str(output)})
+        assert not cache.fetch(key, {"report.txt": str(tmp_path / "a"), "hsps.hsp": str(tmp_path / "b")})
+
+
+class TestBlasterUsesStageCache:
+    """Second run of an accession with stubbed recruitment and blastn: both stages are skipped."""
+
+    def _run(self, tmp_path, query_fa, stage_cache, calls):
+        run = tmp_path / f"run{len(calls)}"
+        for d in (LoganBlaster.LOGAN_DIR_NAME, LoganBlaster.ALIGNEMENT_DIR_NAME):
+            (run / d).mkdir(parents=True)
+        blaster = LoganBlaster(None, None, query_fa, False, False, 17, 0, str(run), stage_cache=stage_cache)
+        blaster.queries = [("my_query", query_fa)]
+
+        def recruit(source, recruited_file, stats=None):
+            calls.append("recruit")
+            with open(query_fa) as src, open(recruited_file, "w") as dst:
+                dst.write(src.read())
+            return True, ""
+
+        def blastn(query_fasta, target_fasta, output_file, outfmt, database=False):
+            calls.append("blastn")
+            with open(output_file, "w") as f:
+                f.write("Query= my_query\n\nLength=963\n\nQuery  1  ATGATATTTT  10\n")
+            return True
+
+        blaster._recruit = recruit
+        blaster._blastn = blastn
+        orig = os.getcwd()
+        os.chdir(str(run))
+        try:
+            local_file = None if blaster._recruitment_is_cached("SRR1") else "SRR1.contigs.fa.zst"
+            blaster._recruit_and_align("SRR1", local_file)
+        finally:
+            os.chdir(orig)
+        return run
+
+    def test_second_run_skips_recruitment_and_alignment(self, tmp_path, query_fa):
+        stage_cache = StageCache(str(tmp_path / "stages"))
+        calls = []
+        first = self._run(tmp_path, query_fa, stage_cache, calls)
+        assert calls == ["recruit", "blastn"]
+        second = self._run(tmp_path, query_fa, stage_cache, calls)
+        assert calls == ["recruit", "blastn"], "no stage is run again"
+
+        aln = os.path.join(LoganBlaster.ALIGNEMENT_DIR_NAME, "synth_my_query_vs_SRR1.txt")
+        assert (second / aln).read_text() == (first / aln).read_text()
+        recruited = os.path.join(LoganBlaster.LOGAN_DIR_NAME, "SRR1.recruited_contigs.fa")
+        assert (second / recruited).read_text() == (first / recruited).read_text()
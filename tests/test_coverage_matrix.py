@@ -0,0 +1,132 @@
+"""Unit tests for the cross-accession coverage matrix (no external tools or network required)."""
+import ast
+import os
+import shutil
+import sys
+from array import array
+
+import pytest
+
+import logan_blaster
+from logan_blaster import CoverageMatrix, LoganBlaster, coverage_main, parse_blastn
+
+ROWS = {
+    "SRR1": [0, 1, 2, 3, 0, 0, 70000, 1, 1, 1],
+    "SRR2": [1] * 10,
+    "SRR3": [0] * 10,
+}
+
+
+def _matrix(tmp_path, rows=ROWS):
+    file_path = str(tmp_path / "coverage_matrix_q.npy")
+    with CoverageMatrix.create(file_path, 10) as matrix:
+        for accession, coverage in rows.items():
+            matrix.add(accession, array("I", coverage))
+    return file_path
+
+
+class TestCoverageMatrix:
+    def test_npy_layout(self, tmp_path):
+        file_path = _matrix(tmp_path)
+        data = open(file_path, "rb").read()
+        assert data[:8] == b"\x93NUMPY\x01\x00"
+        header_length = int.from_bytes(data[8:10], "little")
+        assert 10 + header_length == CoverageMatrix.HEADER_SIZE and data[CoverageMatrix.HEADER_SIZE - 1:CoverageMatrix.HEADER_SIZE] == b"\n"
+        header = ast.literal_eval(data[10:CoverageMatrix.HEADER_SIZE].decode())
+        assert header == {"descr": "<u2", "fortran_order": False, "shape": (3, 10)}
+        assert len(data) == CoverageMatrix.HEADER_SIZE + 3 * 10 * 2
+        assert data[CoverageMatrix.HEADER_SIZE + 2: CoverageMatrix.HEADER_SIZE + 4] == b"\x01\x00"
+        assert (tmp_path / "coverage_matrix_q.accessions.txt").read_text() == "SRR1\nSRR2\nSRR3\n"
+
+    def test_rows(self, tmp_path):
+        with CoverageMatrix.open(_matrix(tmp_path)) as matrix:
+            assert matrix.accessions == ["SRR1", "SRR2", "SRR3"]
+            assert list(matrix.row("SRR1")) == [0, 1, 2, 3, 0, 0, CoverageMatrix.MAX_COVERAGE, 1, 1, 1]
+            assert list(matrix.row("SRR1", 3, 5)) == [2, 3, 0]
+
+    def test_rows_are_appended_and_replaced(self, tmp_path):
+        file_path = _matrix(tmp_path)
+        with CoverageMatrix.create(file_path, 10) as matrix:
+            matrix.add("SRR4", [4] * 10)
+            matrix.add("SRR1", [5] * 3)
+        with CoverageMatrix.open(file_path) as matrix:
+            assert matrix.accessions == ["SRR1", "SRR2", "SRR3", "SRR4"]
+            assert list(matrix.row("SRR1")) == [5, 5, 5] + [0] * 7
+            assert list(matrix.row("SRR4")) == [4] * 10
+
+    def test_interrupted_row_is_dropped(self, tmp_path):
+        file_path = _matrix(tmp_path)
+        with open(file_path, "ab") as f:
+            f.write(b"\x01\x00" * 4)
+        with CoverageMatrix.create(file_path, 10) as matrix:
+            assert len(matrix) == 3
+        assert os.path.getsize(file_path) == CoverageMatrix.HEADER_SIZE + 3 * 10 * 2
+
+    def test_query_length_mismatch(self, tmp_path):
+        with pytest.raises(ValueError):
+            CoverageMatrix.create(_matrix(tmp_path), 11)
+
+    def test_region_and_top(self, tmp_path):
+        with CoverageMatrix.open(_matrix(tmp_path)) as matrix:
+            assert matrix.region(3, 6) == [("SRR2", 4, 1.0), ("SRR1", 2, 1.25)]
+            assert matrix.region(3, 6, min_coverage=3) == [("SRR1", 1, 1.25)]
+            assert [accession for accession, _, _ in matrix.top(1)] == ["SRR2"]
+            with pytest.raises(ValueError):
+                matrix.region(8, 3)
+
+    def test_breadth(self, tmp_path):
+        with CoverageMatrix.open(_matrix(tmp_path)) as matrix:
+            assert list(matrix.breadth()) == [1, 2, 2, 2, 1, 1, 2, 2, 2, 2]
+            assert list(matrix.breadth(3, 7, min_coverage=2)) == [1, 1, 0, 0, 1]
+
+    def test_breadth_beyond_field_capacity(self, tmp_path, monkeypatch):
+        rows = {f"SRR{i}": [i % 2, 2 if i < 5 else 1, 0] + [1] * 7 for i in range(7)}
+        file_path = _matrix(tmp_path, rows)
+        # Partial sums are flushed every MAX_COVERAGE rows
+        monkeypatch.setattr(CoverageMatrix, "MAX_COVERAGE", 3)
+        with CoverageMatrix.open(file_path) as matrix:
+            assert list(matrix.breadth(1, 3)) == [3, 7, 0]
+            assert list(matrix.breadth(1, 3, min_coverage=2)) == [0, 5, 0]
+
+
+class TestCoverageCommand:
+    def test_region(self, tmp_path, capsys):
+        coverage_main([_matrix(tmp_path), "region", "--start", "3", "--end", "6"])
+        assert capsys.readouterr().out == "accession\tcovered_positions\tmean_coverage\nSRR2\t4\t1.000\nSRR1\t2\t1.250\n"
+
+    def test_top(self, tmp_path, capsys):
+        coverage_main([_matrix(tmp_path), "top", "-n", "1"])
+        assert capsys.readouterr().out.splitlines()[1:] == ["SRR2\t10\t1.000"]
+
+    def test_breadth(self, tmp_path, capsys):
+        coverage_main([_matrix(tmp_path), "breadth", "--start", "4", "--end", "5"])
+        assert capsys.readouterr().out == "position\tnb_accessions\n4\t2\n5\t1\n"
+
+    def test_dispatched_by_main(self, tmp_path, capsys, monkeypatch):
+        monkeypatch.setattr(sys, "argv", ["logan_blaster", "coverage", _matrix(tmp_path), "top"])
+        logan_blaster.main()
+        assert capsys.readouterr().out.startswith("accession\t")
+
+    def test_invalid_matrix(self, tmp_path):
+        (tmp_path / "other.npy").write_bytes(b"not a matrix")
+        with pytest.raises(SystemExit):
+            coverage_main([str(tmp_path / "other.npy"), "top"])
+
+
+class TestBlasterCoverageMatrix:
+    def test_synthesized_alignments_are_stored(self, tmp_path, query_fa, self_blast_txt, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.makedirs(LoganBlaster.ALIGNEMENT_DIR_NAME)
+        blaster = LoganBlaster(None, None, query_fa, False, False, 17, 0, str(tmp_path))
+        for accession in ("SRR1", "SRR2"):
+            output_prefix = blaster._alignment_prefix(query_fa, accession)
+            shutil.copy(self_blast_txt, f"{output_prefix}.txt")
+            blaster._alignment_done(accession, query_fa, output_prefix)
+        blaster._close_coverage_matrices()
+
+        _, query_length, coverage = parse_blastn(self_blast_txt)
+        with CoverageMatrix.open(LoganBlaster.COVERAGE_MATRIX_FILE_NAME.format(query="my_query")) as matrix:
+            assert matrix.accessions == ["SRR1", "SRR2"]
+            assert matrix.query_length == query_length
+            assert list(matrix.row("SRR2")) == list(coverage)
+            assert list(matrix.breadth(1, 3)) == [2, 2, 2]
@@ -0,0 +1,221 @@
+"""Tests of the in-process HTTP downloader against a local server supporting byte ranges
+(no external tools or network required)."""
+import os
+import re
+import functools
+import threading
+import http.server
+
+import pytest
+
+from logan_blaster import HTTPDownloader, LoganBlaster
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of `directory` with keep-alive connections and byte ranges.
+    Faults are injected by the server attributes `failures` (statuses returned by the
+    next requests) and `truncations` (number of next responses cut in the middle)."""
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, directory=None, **kwargs):
+        self.directory = directory
+        super().__init__(*args, **kwargs)
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _fault(self):
+        with self.server.lock:
+            self.server.requests.append(self.headers.get("Range"))
+            if self.server.failures:
+                return self.server.failures.pop(0), False
+            if self.server.truncations:
+                self.server.truncations -= 1
+                return None, True
+        return None, False
+
+    def do_HEAD(self):
+        path = os.path.join(self.directory, self.path.lstrip("/"))
+        with self.server.lock:
+            self.server.requests.append("HEAD")
+        self.send_response(200 if os.path.isfile(path) else 404)
+        self.send_header("Content-Length", str(os.path.getsize(path)) if os.path.isfile(path) else "0")
+        self.end_headers()
+
+    def do_GET(self):
+        status, truncate = self._fault()
+        path = os.path.join(self.directory, self.path.lstrip("/"))
+        if status is None and not os.path.isfile(path):
+            status = 404
+        if status is not None:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", "")) if self.server.ranges else None
+        if match is None:
+            self.send_response(200)
+            first, last = 0, len(data) - 1
+        elif int(match.group(1)) >= len(data):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(data)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        else:
+            first, last = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {first}-{last}/{len(data)}")
+        body = data[first: last + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if truncate:
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    handler = functools.partial(RangeHandler, directory=str(served))
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.lock = threading.Lock()
+    httpd.connections = 0
+    httpd.requests = []
+    httpd.failures = []
+    httpd.truncations = 0
+    httpd.ranges = True
+    httpd.directory = served
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _serve(server, name, size):
+    data = os.urandom(size)
+    (server.directory / name).write_bytes(data)
+    return data
+
+
+def _downloader(**kwargs):
+    kwargs.setdefault("part_size", 1000)
+    kwargs.setdefault("backoff", 0)
+    return HTTPDownloader(**kwargs)
+
+
+class TestHTTPDownloader:
+    def test_parallel_ranges(self, server, tmp_path):
+        data = _serve(server, "SRR1.contigs.fa.zst", 10500)
+        destination = tmp_path / "SRR1.contigs.fa.zst"
+        _downloader(parts=4).download(f"{server.url}/SRR1.contigs.fa.zst", str(destination))
+        assert destination.read_bytes() == data
+        assert len(server.requests) == 11, "one request per part"
+        assert server.connections <= 4
+        assert not list(tmp_path.glob("*.part*"))
+
+    def test_connections_are_reused(self, server, tmp_path):
+        for i in range(5):
+            _serve(server, f"SRR{i}.contigs.fa.zst", 500)
+        downloader = _downloader(parts=1)
+        for i in range(5):
+            downloader.download(f"{server.url}/SRR{i}.contigs.fa.zst", str(tmp_path / f"SRR{i}.contigs.fa.zst"))
+        assert server.connections == 1
+
+    def test_server_without_ranges(self, server, tmp_path):
+        server.ranges = False
+        data = _serve(server, "SRR1.contigs.fa.zst", 5000)
+        destination = tmp_path / "SRR1.contigs.fa.zst"
+        _downloader().download(f"{server.url}/SRR1.contigs.fa.zst", str(destination))
+        assert destination.read_bytes() == data
+        assert len(server.requests) == 1
+
+    def test_empty_file(self, server, tmp_path):
+        _serve(server, "empty.fa.zst", 0)
+        destination = tmp_path / "empty.fa.zst"
+        _downloader().download(f"{server.url}/empty.fa.zst", str(destination))
+        assert destination.read_bytes() == b""
+
+    def test_missing_file_is_not_retried(self, server, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            _downloader().download(f"{server.url}/SRR0.contigs.fa.zst", str(tmp_path / "SRR0.contigs.fa.zst"))
+        assert len(server.requests) == 1
+
+    def test_failures_are_retried(self, server, tmp_path):
+        data = _serve(server, "SRR1.contigs.fa.zst", 3000)
+        server.failures = [503, 500]
+        server.truncations = 1
+        destination = tmp_path / "SRR1.contigs.fa.zst"
+        _downloader(parts=1).download(f"{server.url}/SRR1.contigs.fa.zst", str(destination))
+        assert destination.read_bytes() == data
+
+    def test_size(self, server):
+        _serve(server, "SRR1.contigs.fa.zst", 1234)
+        downloader = _downloader()
+        assert downloader.size(f"{server.url}/SRR1.contigs.fa.zst") == 1234
+        with pytest.raises(FileNotFoundError):
+            downloader.size(f"{server.url}/SRR0.contigs.fa.zst")
+        assert server.connections == 1
+
+    def test_interrupted_download_is_resumed(self, server, tmp_path):
+        data = _serve(server, "SRR1.contigs.fa.zst", 5000)
+        url = f"{server.url}/SRR1.contigs.fa.zst"
+        destination = tmp_path / "SRR1.contigs.fa.zst"
+        # The first two parts are downloaded, then the connection keeps failing
+        downloader = _downloader(parts=1, retries=1)
+        fetched = []
+
+        def fetch_range(url, fd, first, last):
+            if fetched:
+                raise OSError("connection lost")
+            fetched.append(first)
+            return HTTPDownloader._fetch_range(downloader, url, fd, first, last)
+
+        downloader._fetch_range = fetch_range
+        with pytest.raises(OSError):
+            downloader.download(url, str(destination))
+        assert not destination.exists()
+        assert (tmp_path / "SRR1.contigs.fa.zst.part").exists()
+
+        nb_requests = len(server.requests)
+        _downloader(parts=2).download(url, str(destination))
+        assert destination.read_bytes() == data
+        assert len(server.requests) - nb_requests == 3, "parts 0 and 1 are not downloaded again"
+        assert not list(tmp_path.glob("*.part*"))
+
+
+class TestBlasterDownloads:
+    def _blaster(self, tmp_path, server, unitigs=False):
+        (tmp_path / LoganBlaster.LOGAN_DIR_NAME).mkdir()
+        blaster = LoganBlaster(None, None, "query.fa", False, unitigs, 17, 0, str(tmp_path),
+                               downloader=_downloader(retries=0))
+        blaster.failed_accession_list = str(tmp_path / "failed_accessions.txt")
+        blaster._tigs_url = lambda accession: f"{server.url}/{accession}.{blaster.type}s.fa.zst"
+        return blaster
+
+    def test_accession_is_downloaded(self, server, tmp_path, monkeypatch):
+        data = _serve(server, "SRR1.contigs.fa.zst", 2500)
+        blaster = self._blaster(tmp_path, server)
+        monkeypatch.chdir(tmp_path)
+        local_file = blaster._download_accession("SRR1")
+        assert local_file == str(tmp_path / LoganBlaster.LOGAN_DIR_NAME / "SRR1.contigs.fa.zst")
+        assert open(local_file, "rb").read() == data
+
+    def test_missing_contigs_are_recorded(self, server, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, server)
+        monkeypatch.chdir(tmp_path)
+        assert blaster._download_accession("SRR0") is None
+        assert (tmp_path / "failed_accessions.txt").read_text() == "SRR0\n"
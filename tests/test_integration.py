@@ -3,19 +3,42 @@
 - TestRunBlast: tests _run_blast() with local files only (blastn required)
 - TestFullPipelineLocal: tests _process_accessions() with a pre-placed .fa.zst
   (blastn + back_to_sequences required, no network)
+- TestPipelineStages: tests the download / processing pipeline of
+  _process_accessions() with stubbed stages (no external tool required)
+- TestTabularBlast: tests _run_blast() in tabular mode with a stubbed blastn,
+  and its compressed (zstd required) and run-length encoded outputs
+- TestViewCommand: tests logan_blaster view on the outputs written with
+  --rle-synth and --compress (zstd required for the latter)
+- TestBlastBatch: tests the alignment of several accessions with a single
+  blastn run, with a stubbed blastn (no external tool required)
+- TestMultiQuery: tests the attribution of recruited sequences to the queries
+  of a multi-fasta query file (no external tool required)
+- TestResume: tests the run journal and the resumption of an interrupted run
+  with stubbed stages (no external tool required)
+- TestStreamRecruitment: tests stream-through recruitment from a local HTTP
+  server with the builtin recruiter, and the coverage statistics computed
+  while recruiting (zstd required)
 - TestFullPipelineNetwork: full end-to-end pipeline with download from Logan
   (all tools + network required — only runs with pytest --network)
 """
 import io
 import os
+import json
+import sys
 import shutil
 import subprocess
 import contextlib
+import functools
+import threading
+import http.server
+import queue
 import pytest
 
-from logan_blaster import LoganBlaster, run_blast_parser
+from logan_blaster import (BLAST_ARCHIVE_OUTFMT, BLAST_TABULAR_OUTFMT, CoverageStats, HSPTable, LoganBlaster, RunJournal,
+                           get_query_ACGT, parse_blastn, run_blast_parser, view_main)
 
 REQUIRED_TOOLS = ["blastn", "back_to_sequences", "zstd"]
+STUBS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "stubs")
 
 requires_tools = pytest.mark.skipif(
     not all(shutil.which(t) for t in REQUIRED_TOOLS),
@@ -183,6 +206,631 @@ class TestFullPipelineLocal:
         assert not failed_file.exists() or failed_file.read_text().strip() == ""
 
 
+class TestPipelineStages:
+    """_process_accessions() with stubbed download and processing stages."""
+
+    @pytest.fixture(autouse=True)
+    def _in_tmp_path(self, tmp_path, monkeypatch):
+        # The run journal is written in the output directory (tmp_path), the stubbed stages use relative paths
+        monkeypatch.chdir(tmp_path)
+
+    def _blaster(self, tmp_path, accessions, **kwargs):
+        acc_file = tmp_path / "accessions.txt"
+        acc_file.write_text("".join(f"{a}\n" for a in accessions))
+        query = tmp_path / "query.fa"
+        query.write_text(">q\nACGT\n")
+        blaster = _make_blaster(tmp_path, str(query), accession_file=acc_file)
+        for key, value in kwargs.items():
+            setattr(blaster, key, value)
+        return blaster
+
+    def test_every_downloaded_accession_is_processed(self, tmp_path):
+        accessions = [f"SRR{i}" for i in range(20)]
+        blaster = self._blaster(tmp_path, accessions, download_workers=3, workers=2)
+        processed = []
+        blaster._download_accession = lambda acc: f"{acc}.contigs.fa.zst"
+        blaster._recruit_and_align = lambda acc, local_file: processed.append((acc, local_file))
+        blaster._process_accessions()
+        assert sorted(processed) == sorted((a, f"{a}.contigs.fa.zst") for a in accessions)
+
+    def test_failed_downloads_are_not_processed(self, tmp_path):
+        blaster = self._blaster(tmp_path, ["SRR1", "SRR2", "SRR3"])
+        processed = []
+        blaster._download_accession = lambda acc: None if acc == "SRR2" else acc
+        blaster._recruit_and_align = lambda acc, local_file: processed.append(acc)
+        blaster._process_accessions()
+        assert sorted(processed) == ["SRR1", "SRR3"]
+
+    def test_limit_is_respected(self, tmp_path):
+        blaster = self._blaster(tmp_path, ["SRR1", "SRR2", "SRR3"], limit=2)
+        processed = []
+        blaster._download_accession = lambda acc: acc
+        blaster._recruit_and_align = lambda acc, local_file: processed.append(acc)
+        blaster._process_accessions()
+        assert sorted(processed) == ["SRR1", "SRR2"]
+
+    def test_downloads_overlap_processing(self, tmp_path):
+        blaster = self._blaster(tmp_path, ["SRR1", "SRR2"], download_workers=1, workers=1)
+        second_downloaded = threading.Event()
+
+        def download(acc):
+            if acc == "SRR2":
+                second_downloaded.set()
+            return acc
+
+        def process(acc, local_file):
+            if acc == "SRR1":
+                # SRR2 must be prefetched while SRR1 is still being processed
+                assert second_downloaded.wait(timeout=5)
+
+        blaster._download_accession = download
+        blaster._recruit_and_align = process
+        blaster._process_accessions()
+        assert second_downloaded.is_set()
+
+    def test_processing_error_records_failed_accession(self, tmp_path):
+        blaster = self._blaster(tmp_path, ["SRR1", "SRR2"])
+
+        def process(acc, local_file):
+            if acc == "SRR1":
+                raise RuntimeError("boom")
+
+        blaster._download_accession = lambda acc: acc
+        blaster._recruit_and_align = process
+        blaster._process_accessions()
+        assert (tmp_path / "failed_accessions.txt").read_text() == "SRR1\n"
+
+    def test_run_stops_after_hits(self, tmp_path):
+        accessions = [f"SRR{i}" for i in range(20)]
+        blaster = self._blaster(tmp_path, accessions, download_workers=1, workers=1, stop_after_hits=2)
+        processed = []
+        blaster._download_accession = lambda acc: acc
+
+        def process(acc, local_file):
+            processed.append(acc)
+            if acc in ("SRR3", "SRR5", "SRR6"):
+                blaster._record_hit(acc)
+
+        blaster._recruit_and_align = process
+        blaster._process_accessions()
+        # Accessions downloaded ahead of the stop are left unprocessed
+        assert processed == [f"SRR{i}" for i in range(6)]
+
+
+class TestTabularBlast:
+    """_run_blast() with tabular output; blastn and blast_formatter are replaced by a stub writing a tabular report."""
+
+    TABULAR = "tig_1\t1\t963\t1\t963\t100.000\t0.0\t1737\n"
+
+    def _run(self, tmp_path, query_fa, pairwise=False, compress=False, rle_synth=False):
+        aln_dir = tmp_path / LoganBlaster.ALIGNEMENT_DIR_NAME
+        aln_dir.mkdir()
+        blaster = _make_blaster(tmp_path, query_fa)
+        blaster.tabular = True
+        blaster.pairwise = pairwise
+        blaster.compress = compress
+        blaster.rle_synth = rle_synth
+        calls = []
+
+        def blastn(query_fasta, target_fasta, output_file, outfmt):
+            calls.append(outfmt)
+            with open(output_file, "w") as f:
+                f.write(self.TABULAR if outfmt.startswith("6") else "pairwise report\n")
+            return True
+
+        blaster._blastn = blastn
+        blaster._blast_formatter = lambda archive, output_file, outfmt, max_targets=None: blastn(None, None, output_file, outfmt)
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            blaster._run_blast(str(query_fa), str(tmp_path / "ACC.recruited_contigs.fa"))
+        finally:
+            os.chdir(orig)
+        return aln_dir, calls
+
+    def test_hsp_and_synth_files(self, tmp_path, query_fa):
+        aln_dir, calls = self._run(tmp_path, query_fa)
+        assert sorted(p.name for p in aln_dir.iterdir()) == ["my_query_vs_ACC.hsp", "synth_my_query_vs_ACC.txt"]
+        assert len(calls) == 1
+        hsps = HSPTable.load(str(aln_dir / "my_query_vs_ACC.hsp"))
+        assert list(hsps["qend"]) == [963]
+        synth = (aln_dir / "synth_my_query_vs_ACC.txt").read_text()
+        assert synth.startswith("Query: my_query\n")
+        assert "-" not in synth.splitlines()[2]
+
+    def test_pairwise_on_request(self, tmp_path, query_fa):
+        aln_dir, calls = self._run(tmp_path, query_fa, pairwise=True)
+        # A single blastn run, formatted twice
+        assert calls == [BLAST_ARCHIVE_OUTFMT, BLAST_TABULAR_OUTFMT, "0"]
+        assert (aln_dir / "my_query_vs_ACC.txt").read_text() == "pairwise report\n"
+
+    def test_run_length_encoded_synth(self, tmp_path, query_fa):
+        aln_dir, _ = self._run(tmp_path, query_fa, rle_synth=True)
+        assert sorted(p.name for p in aln_dir.iterdir()) == ["my_query_vs_ACC.hsp", "synth_my_query_vs_ACC.cov"]
+        assert (aln_dir / "synth_my_query_vs_ACC.cov").read_text() == "#query=my_query\n#length=963\n1\t963\n"
+
+    @pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd is required")
+    def test_compressed_outputs(self, tmp_path, query_fa):
+        aln_dir, _ = self._run(tmp_path, query_fa, pairwise=True, compress=True)
+        assert sorted(p.name for p in aln_dir.iterdir()) == [
+            "my_query_vs_ACC.hsp", "my_query_vs_ACC.txt.zst", "synth_my_query_vs_ACC.txt.zst"]
+        report = subprocess.run(["zstd", "-dc", str(aln_dir / "my_query_vs_ACC.txt.zst")], capture_output=True, check=True)
+        assert report.stdout == b"pairwise report\n"
+
+    def test_compression_failure_keeps_outputs(self, tmp_path, query_fa, monkeypatch):
+        monkeypatch.setenv("PATH", str(tmp_path / "no_tools"))
+        aln_dir, _ = self._run(tmp_path, query_fa, compress=True)
+        assert sorted(p.name for p in aln_dir.iterdir()) == ["my_query_vs_ACC.hsp", "synth_my_query_vs_ACC.txt"]
+
+
+class TestViewCommand:
+    """logan_blaster view on the compact outputs of an alignment of the query with itself."""
+
+    def _cov_file(self, tmp_path, query_fa, self_blast_txt):
+        aln_dir = tmp_path / LoganBlaster.ALIGNEMENT_DIR_NAME
+        aln_dir.mkdir()
+        cov_file = aln_dir / "synth_my_query_vs_ACC.cov"
+        with open(cov_file, "w") as f:
+            run_blast_parser(str(query_fa), self_blast_txt, abundance=True, out=f, rle=True)
+        return str(cov_file)
+
+    def test_rendered_synth(self, tmp_path, query_fa, self_blast_txt, expected_self_synth, capsys):
+        view_main([self._cov_file(tmp_path, query_fa, self_blast_txt), "--query", str(query_fa)])
+        assert capsys.readouterr().out == expected_self_synth
+
+    def test_query_of_the_run(self, tmp_path, query_fa, self_blast_txt, expected_self_synth, capsys):
+        cov_file = self._cov_file(tmp_path, query_fa, self_blast_txt)
+        (tmp_path / LoganBlaster.INPUT_DATA_DIR_NAME).mkdir()
+        (tmp_path / LoganBlaster.INPUT_DATA_DIR_NAME / "accessions.txt").write_text("ACC\n")
+        shutil.copy(query_fa, tmp_path / LoganBlaster.INPUT_DATA_DIR_NAME / "query.fa")
+        view_main([cov_file])
+        assert capsys.readouterr().out == expected_self_synth
+
+    def test_missing_query(self, tmp_path, query_fa, self_blast_txt):
+        with pytest.raises(SystemExit):
+            view_main([self._cov_file(tmp_path, query_fa, self_blast_txt)])
+
+    def test_query_length_mismatch(self, tmp_path, query_fa, self_blast_txt):
+        (tmp_path / "other.fa").write_text(">my_query\nACGT\n")
+        with pytest.raises(SystemExit):
+            view_main([self._cov_file(tmp_path, query_fa, self_blast_txt), "--query", str(tmp_path / "other.fa")])
+
+    @pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd is required")
+    def test_compressed_file(self, tmp_path, expected_self_synth, capfd):
+        synth = tmp_path / "synth_my_query_vs_ACC.txt"
+        synth.write_text(expected_self_synth)
+        subprocess.run(["zstd", "-q", "--rm", str(synth)], check=True)
+        view_main([f"{synth}.zst"])
+        assert capfd.readouterr().out == expected_self_synth
+
+    def test_other_files(self, tmp_path):
+        (tmp_path / "synth.txt").write_text("Query: q\n")
+        with pytest.raises(SystemExit):
+            view_main([str(tmp_path / "synth.txt")])
+
+
+class TestBlastBatch:
+    """Blast batches: one stubbed blastn run for several accessions, results split per accession."""
+
+    def _blaster(self, tmp_path, query_fa, blast_batch):
+        for d in (LoganBlaster.LOGAN_DIR_NAME, LoganBlaster.ALIGNEMENT_DIR_NAME):
+            (tmp_path / d).mkdir()
+        blaster = _make_blaster(tmp_path, query_fa)
+        blaster.tabular = True
+        blaster.blast_batch = blast_batch
+        blaster.delete = True
+        runs = []
+
+        def blastn(query_fasta, target_fasta, output_file, outfmt, database=False, max_targets=None):
+            # Each subject matches the query on as many positions as its recruited count
+            rows = []
+            with open(target_fasta) as f:
+                for line in f:
+                    if line.startswith(">"):
+                        subject, count = line[1:].split()
+                        rows.append(f"{subject}\t1\t{count}\t1\t{count}\t100.0\t0.0\t50.0\n")
+            runs.append(len(rows))
+            with open(output_file, "w") as f:
+                f.writelines(rows)
+            return True
+
+        blaster._blastn = blastn
+        return blaster, runs
+
+    def _recruited(self, tmp_path, accession, counts):
+        recruited = tmp_path / LoganBlaster.LOGAN_DIR_NAME / f"{accession}.recruited_contigs.fa"
+        recruited.write_text("".join(f">tig_{i} {count}\nACGT\n" for i, count in enumerate(counts)))
+        return str(recruited)
+
+    def test_one_blastn_run_per_batch(self, tmp_path, query_fa):
+        blaster, runs = self._blaster(tmp_path, query_fa, blast_batch=2)
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            for accession, counts in (("ACC1", [10]), ("ACC2", [20, 30]), ("ACC3", [40])):
+                blaster._queue_blast(accession, str(query_fa), self._recruited(tmp_path, accession, counts))
+            assert runs == [3], "the first two accessions are aligned together"
+            blaster._flush_blast_batches()
+        finally:
+            os.chdir(orig)
+
+        assert runs == [3, 1]
+        aln_dir = tmp_path / LoganBlaster.ALIGNEMENT_DIR_NAME
+        acc2 = HSPTable.load(str(aln_dir / "my_query_vs_ACC2.hsp"))
+        assert acc2.subjects == ["tig_0", "tig_1"]
+        assert list(acc2["qend"]) == [20, 30]
+        synth = (aln_dir / "synth_my_query_vs_ACC3.txt").read_text()
+        assert synth.splitlines()[2].strip() == "a" * 40 + "-" * 40
+        assert not list((tmp_path / LoganBlaster.LOGAN_DIR_NAME).iterdir()), "batch files are removed"
+
+    @pytest.mark.parametrize("tabular, pairwise", [(True, False), (False, True), (True, True)])
+    def test_batches_beyond_the_blastn_hit_limits(self, tmp_path, query_fa, monkeypatch, tabular, pairwise):
+        # The stub blastn reports the hits of 500 subjects (250 in pairwise reports) by default, as blastn does
+        monkeypatch.setenv("PATH", f"{STUBS_DIR}{os.pathsep}{os.environ['PATH']}")
+        blaster, _ = self._blaster(tmp_path, query_fa, blast_batch=2)
+        del blaster._blastn
+        blaster.tabular, blaster.pairwise = tabular, tabular and pairwise
+        monkeypatch.chdir(tmp_path)
+        for accession in ("ACC1", "ACC2"):
+            recruited = tmp_path / LoganBlaster.LOGAN_DIR_NAME / f"{accession}.recruited_contigs.fa"
+            recruited.write_text("".join(f">tig_{i} bench:q:1-{i + 1}\nACGT\n" for i in range(300)))
+            blaster._queue_blast(accession, str(query_fa), str(recruited))
+
+        aln_dir = tmp_path / LoganBlaster.ALIGNEMENT_DIR_NAME
+        for accession in ("ACC1", "ACC2"):
+            coverages = []
+            if pairwise:
+                coverages.append(parse_blastn(str(aln_dir / f"my_query_vs_{accession}.txt"))[2])
+            if tabular:
+                coverages.append(HSPTable.load(str(aln_dir / f"my_query_vs_{accession}.hsp")).coverage(963))
+            for coverage in coverages:
+                assert list(coverage[:300]) == list(range(300, 0, -1)), f"all the subjects of {accession} are reported"
+
+
+class TestMultiQuery:
+    """Recruited sequences of an accession are split by query."""
+
+    def _blaster(self, tmp_path, queries):
+        for d in (LoganBlaster.INPUT_DATA_DIR_NAME, LoganBlaster.LOGAN_DIR_NAME):
+            (tmp_path / d).mkdir()
+        query = tmp_path / LoganBlaster.INPUT_DATA_DIR_NAME / "queries.fa"
+        query.write_text(queries)
+        blaster = _make_blaster(tmp_path, str(query))
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            blaster._setup_queries()
+        finally:
+            os.chdir(orig)
+        return blaster
+
+    def test_recruited_sequences_are_attributed(self, tmp_path):
+        q1 = "ATGATATTTTCAACTTTAGAGCATATATTAC"
+        q2 = "GGCTCACATTCCCGAAGGGGCTTCCCTGGGC"
+        blaster = self._blaster(tmp_path, f">q1\n{q1}\n>q2\n{q2}\n")
+        assert [query_id for query_id, _ in blaster.queries] == ["q1", "q2"]
+
+        recruited = tmp_path / LoganBlaster.LOGAN_DIR_NAME / "ACC.recruited_contigs.fa"
+        recruited.write_text(f">tig_1 3\n{q1[:20]}\n>tig_2 4\n{q2[5:]}\n>tig_3 2\n{q1[-18:]}{q2[:18]}\n")
+
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            targets = blaster._attribute_recruited("ACC", str(recruited))
+        finally:
+            os.chdir(orig)
+
+        assert [os.path.basename(query_file) for query_file, _ in targets] == ["q1.fa", "q2.fa"]
+        q1_recruited = (tmp_path / targets[0][1]).read_text()
+        q2_recruited = (tmp_path / targets[1][1]).read_text()
+        assert q1_recruited == f">tig_1 3\n{q1[:20]}\n>tig_3 2\n{q1[-18:]}{q2[:18]}\n"
+        assert q2_recruited == f">tig_2 4\n{q2[5:]}\n>tig_3 2\n{q1[-18:]}{q2[:18]}\n"
+
+    def test_weak_recruitments_are_dropped(self, tmp_path):
+        q1 = "ATGATATTTTCAACTTTAGAGCATATATTAC"
+        q2 = "GGCTCACATTCCCGAAGGGGCTTCCCTGGGC"
+        blaster = self._blaster(tmp_path, f">q1\n{q1}\n>q2\n{q2}\n")
+        blaster.min_shared_kmers = 3
+        blaster.min_query_fraction = 0.5
+        recruited = tmp_path / LoganBlaster.LOGAN_DIR_NAME / "ACC.recruited_contigs.fa"
+        # tig_1 shares 4 k-mers (of 15) with q1, tig_2 2 k-mers with q1 and 10 with q2, tig_3 a single one with q1
+        recruited.write_text(f">tig_1\n{q1[:20]}\n>tig_2\n{q1[-18:]}{q2[:26]}\n>tig_3\n{q1[5:22]}\n")
+
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            targets = blaster._attribute_recruited("ACC", str(recruited))
+        finally:
+            os.chdir(orig)
+
+        assert [os.path.basename(query_file) for query_file, _ in targets] == ["q2.fa"]
+        assert (tmp_path / targets[0][1]).read_text() == f">tig_2\n{q1[-18:]}{q2[:26]}\n"
+        assert not os.path.exists(tmp_path / blaster._query_recruited_file("ACC", "q1"))
+        records = [json.loads(line) for line in (tmp_path / LoganBlaster.SHARED_KMERS_FILE_NAME).read_text().splitlines()]
+        assert [(r["query"], r["tigs"], r["dropped_tigs"], r["shared_kmers"], r["query_kmers_hit"], r["dropped"])
+                for r in records] == [("q1", 1, 2, 4, 4, True), ("q2", 1, 0, 10, 10, False)]
+        assert records[0]["query_fraction"] == round(4 / 15, 6)
+
+    def test_single_query_is_filtered(self, tmp_path):
+        query = "ATGATATTTTCAACTTTAGAGCATATATTAC"
+        blaster = self._blaster(tmp_path, f">my_query\n{query}\n")
+        blaster.min_shared_kmers = 2
+        recruited = tmp_path / LoganBlaster.LOGAN_DIR_NAME / "ACC.recruited_contigs.fa"
+        recruited.write_text(f">tig_1 4\n{query[:20]}\n>tig_2 1\n{query[3:20]}\n")
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            targets = blaster._attribute_recruited("ACC", str(recruited))
+        finally:
+            os.chdir(orig)
+        assert targets == [(blaster.query_file, blaster._query_recruited_file("ACC", "my_query"))]
+        assert (tmp_path / targets[0][1]).read_text() == f">tig_1 4\n{query[:20]}\n"
+
+    def test_single_query_is_not_split(self, tmp_path):
+        # Its shared k-mers are still recorded, from the counts of the recruiter
+        query = "ATGATATTTTCAACTTTAGAGCATATATTAC"
+        blaster = self._blaster(tmp_path, f">my_query\n{query}\n")
+        assert blaster.queries == [("my_query", blaster.query_file)]
+        recruited = tmp_path / LoganBlaster.LOGAN_DIR_NAME / "ACC.recruited_contigs.fa"
+        recruited.write_text(f">tig_1 ka:f:2.0 4\n{query[:20]}\n>tig_2 1\n{query[3:20]}\n")
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            targets = blaster._attribute_recruited("ACC", str(recruited))
+        finally:
+            os.chdir(orig)
+        assert targets == [(blaster.query_file, str(recruited))]
+        [record] = [json.loads(line) for line in (tmp_path / LoganBlaster.SHARED_KMERS_FILE_NAME).read_text().splitlines()]
+        assert record == {"accession": "ACC", "query": "my_query", "tigs": 2, "dropped_tigs": 0, "shared_kmers": 5,
+                          "query_kmers_hit": None, "query_fraction": None, "dropped": False}
+
+
+class TestResume:
+    """Interrupted runs are resumed from their journal; recruitment and blastn are stubbed."""
+
+    def _blaster(self, tmp_path, query_fa, accessions, calls):
+        for d in (LoganBlaster.LOGAN_DIR_NAME, LoganBlaster.ALIGNEMENT_DIR_NAME):
+            (tmp_path / d).mkdir(exist_ok=True)
+        acc_file = tmp_path / "accessions.txt"
+        acc_file.write_text("".join(f"{a}\n" for a in accessions))
+        blaster = _make_blaster(tmp_path, query_fa, accession_file=acc_file)
+        blaster.queries = [("my_query", query_fa)]
+        blaster.resume = True
+
+        def download(accession):
+            calls.append(("download", accession))
+            return os.path.join(LoganBlaster.LOGAN_DIR_NAME, f"{accession}.contigs.fa.zst")
+
+        def recruit(source, recruited_file, stats=None):
+            calls.append(("recruit", os.path.basename(recruited_file).split(".")[0]))
+            with open(query_fa) as src, open(recruited_file, "w") as dst:
+                dst.write(src.read())
+            return True, ""
+
+        def blastn(query_fasta, target_fasta, output_file, outfmt, database=False):
+            calls.append(("blastn", os.path.basename(target_fasta).split(".")[0]))
+            with open(output_file, "w") as f:
+                f.write("Query= my_query\n\nLength=963\n\nQuery  1  ATGATATTTT  10\n")
+            return True
+
+        blaster._download_accession = download
+        blaster._recruit = recruit
+        blaster._blastn = blastn
+        return blaster
+
+    def _journal(self, tmp_path, *entries):
+        journal = RunJournal(str(tmp_path / RunJournal.FILE_NAME))
+        for accession, state, details in entries:
+            journal.record(accession, state, **details)
+
+    def _process(self, tmp_path, blaster):
+        orig = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            blaster._process_accessions()
+        finally:
+            os.chdir(orig)
+
+    def test_replay(self, tmp_path):
+        self._journal(tmp_path,
+                      ("SRR1", "downloaded", {}),
+                      ("SRR1", "recruited", {"nb_queries": 2}),
+                      ("SRR1", "synthesized", {"query": "q1"}),
+                      ("SRR2", "recruited", {"nb_queries": 0}),
+                      ("SRR3", "recruited", {"nb_queries": 1}),
+                      ("SRR3", "failed", {"stage": "alignment", "query": "q1"}))
+        with open(tmp_path / RunJournal.FILE_NAME, "a") as f:
+            f.write('{"accession": "SRR1", "state": "synthesi')  # interrupted while writing
+        progress = RunJournal.replay(str(tmp_path / RunJournal.FILE_NAME))
+        assert progress["SRR1"]["nb_queries"] == 2 and progress["SRR1"]["synthesized"] == {"q1"}
+        assert not RunJournal.is_complete(progress["SRR1"])
+        assert RunJournal.is_complete(progress["SRR2"]), "nothing to align"
+        assert progress["SRR3"]["state"] == "failed" and progress["SRR3"]["nb_queries"] is None
+
+    def test_full_run_is_journaled(self, tmp_path, query_fa):
+        calls = []
+        blaster = self._blaster(tmp_path, query_fa, ["SRR1"], calls)
+        blaster.resume = False
+        self._process(tmp_path, blaster)
+        states = [json.loads(line)["state"] for line in (tmp_path / RunJournal.FILE_NAME).read_text().splitlines()]
+        assert states == ["downloaded", "recruited", "aligned", "synthesized"]
+        records = [json.loads(line) for line in (tmp_path / LoganBlaster.COVERAGE_STATS_FILE_NAME).read_text().splitlines()]
+        assert [(r["accession"], r["recruited"]["nb_tigs"]) for r in records] == [("SRR1", 1)]
+
+    def test_only_unfinished_stages_are_run(self, tmp_path, query_fa):
+        calls = []
+        accessions = ["SRR1", "SRR2", "SRR3", "SRR4", "SRR5"]
+        blaster = self._blaster(tmp_path, query_fa, accessions, calls)
+        logan_dir = tmp_path / LoganBlaster.LOGAN_DIR_NAME
+        aln_dir = tmp_path / LoganBlaster.ALIGNEMENT_DIR_NAME
+        for accession in ("SRR2", "SRR3"):
+            (logan_dir / f"{accession}.recruited_contigs.fa").write_text(open(query_fa).read())
+        (aln_dir / "my_query_vs_SRR3.txt").write_text("Query= my_query\n\nLength=963\n\nQuery  1  ATGATATTTT  10\n")
+        (tmp_path / "failed_accessions.txt").write_text("SRR0\nSRR5\n")
+        self._journal(tmp_path,
+                      ("SRR0", "recruited", {"nb_queries": 0}),
+                      ("SRR1", "recruited", {"nb_queries": 1}),
+                      ("SRR1", "aligned", {"query": "my_query"}),
+                      ("SRR1", "synthesized", {"query": "my_query"}),
+                      ("SRR2", "recruited", {"nb_queries": 1}),
+                      ("SRR3", "recruited", {"nb_queries": 1}),
+                      ("SRR3", "aligned", {"query": "my_query"}),
+                      ("SRR4", "downloaded", {}),
+                      ("SRR5", "failed", {"stage": "download"}))
+        self._process(tmp_path, blaster)
+
+        assert sorted(c for c in calls if c[0] == "download") == [("download", "SRR4"), ("download", "SRR5")]
+        assert sorted(c for c in calls if c[0] == "recruit") == [("recruit", "SRR4"), ("recruit", "SRR5")]
+        assert sorted(c for c in calls if c[0] == "blastn") == [("blastn", "SRR2"), ("blastn", "SRR4"), ("blastn", "SRR5")]
+        assert (aln_dir / "synth_my_query_vs_SRR3.txt").exists(), "aligned accessions are only synthesized"
+        assert (tmp_path / "failed_accessions.txt").read_text() == "SRR0\n", "retried accessions are forgotten"
+
+        # Everything is done: resuming again runs nothing
+        calls.clear()
+        self._process(tmp_path, self._blaster(tmp_path, query_fa, accessions, calls))
+        assert calls == []
+
+    def test_coverage_of_synthesized_alignments_is_rebuilt(self, tmp_path, query_fa):
+        # SRR1 was recruited for two queries and only the alignment of my_query was synthesized
+        calls = []
+        blaster = self._blaster(tmp_path, query_fa, ["SRR1"], calls)
+        (tmp_path / LoganBlaster.LOGAN_DIR_NAME / "SRR1.recruited_contigs.fa").write_text(open(query_fa).read())
+        (tmp_path / LoganBlaster.ALIGNEMENT_DIR_NAME / "my_query_vs_SRR1.txt").write_text(
+            "Query= my_query\n\nLength=963\n\nQuery  1  ATGATATTTT  10\n")
+        (tmp_path / "failed_accessions.txt").write_text("")
+        self._journal(tmp_path,
+                      ("SRR1", "recruited", {"nb_queries": 2}),
+                      ("SRR1", "aligned", {"query": "my_query"}),
+                      ("SRR1", "synthesized", {"query": "my_query"}))
+        blaster._results = queue.Queue()
+        self._process(tmp_path, blaster)
+
+        assert calls == []
+        result = blaster._results.get_nowait()
+        assert result.status == "aligned" and result.hits == ["my_query"]
+        assert list(result.coverage["my_query"]) == [1] * 10 + [0] * 953
+
+
+@pytest.fixture
+def http_dir(tmp_path):
+    """Serves tmp_path/www over HTTP. Yields (directory, base url)"""
+    www = tmp_path / "www"
+    www.mkdir()
+    handler = functools.partial(QuietHandler, directory=str(www))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield www, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="requires zstd")
+class TestStreamRecruitment:
+    """Stream-through recruitment from a local HTTP server, with the builtin recruiter."""
+
+    def _blaster(self, tmp_path, query_fa):
+        blaster = _make_blaster(tmp_path, query_fa)
+        blaster.stream = True
+        blaster.recruiter = "builtin"
+        return blaster
+
+    def test_streamed_tigs_are_recruited(self, tmp_path, query_fa, http_dir):
+        www, url = http_dir
+        subprocess.run(["zstd", "-q", query_fa, "-o", str(www / "ACC.contigs.fa.zst")], check=True)
+        blaster = self._blaster(tmp_path, query_fa)
+        recruited = tmp_path / "recruited.fa"
+
+        success, error = blaster._recruit(f"{url}/ACC.contigs.fa.zst", str(recruited))
+
+        assert success, error
+        header, seq = recruited.read_text().splitlines()
+        assert header.startswith(">my_query ")
+        assert seq == get_query_ACGT(query_fa)
+        assert not list(tmp_path.glob("*.zst")), "the compressed tigs must not reach the disk"
+
+    def test_local_zst_is_recruited(self, tmp_path, query_fa):
+        zst = tmp_path / "ACC.contigs.fa.zst"
+        subprocess.run(["zstd", "-q", query_fa, "-o", str(zst)], check=True)
+        blaster = self._blaster(tmp_path, query_fa)
+        recruited = tmp_path / "recruited.fa"
+        success, error = blaster._recruit(str(zst), str(recruited))
+        assert success, error
+        assert recruited.read_text().startswith(">my_query ")
+
+    def test_coverage_stats_are_computed_while_recruiting(self, tmp_path, query_fa):
+        tigs = tmp_path / "tigs.fa"
+        tigs.write_text(f">tig_1 ka:f:3.0\n{get_query_ACGT(query_fa)}\n>tig_2 ka:f:5.0\n{'C' * 40}\n")
+        zst = tmp_path / "ACC.contigs.fa.zst"
+        subprocess.run(["zstd", "-q", str(tigs), "-o", str(zst)], check=True)
+        blaster = self._blaster(tmp_path, query_fa)
+        stats = CoverageStats()
+        success, error = blaster._recruit(str(zst), str(tmp_path / "recruited.fa"), stats)
+        assert success, error
+        assert (stats.nb_tigs, stats.record()["mean_coverage"]) == (2, 4.0)
+
+    def _stub_back_to_sequences(self, tmp_path, monkeypatch):
+        # Stub back_to_sequences copying its input sequences to its output, and recording their path
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        stub = bin_dir / "back_to_sequences"
+        stub.write_text("#!/bin/sh\n"
+                        "while [ $# -gt 0 ]; do\n"
+                        "  case $1 in --in-sequences) in=$2;; --out-sequences) out=$2;; esac; shift\n"
+                        "done\n"
+                        f"echo \"$in\" > {tmp_path}/in_sequences\n"
+                        "cat \"$in\" > \"$out\"\n")
+        stub.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    def test_back_to_sequences_reads_the_local_file(self, tmp_path, query_fa, monkeypatch):
+        self._stub_back_to_sequences(tmp_path, monkeypatch)
+        zst = tmp_path / "ACC.contigs.fa.zst"
+        subprocess.run(["zstd", "-q", query_fa, "-o", str(zst)], check=True)
+        blaster = self._blaster(tmp_path, query_fa)
+        blaster.recruiter = "back_to_sequences"
+        recruited = tmp_path / "recruited.fa"
+        stats = CoverageStats()
+        success, error = blaster._recruit(str(zst), str(recruited), stats)
+        assert success, error
+        assert (tmp_path / "in_sequences").read_text() == f"{zst}\n"
+        assert recruited.read_bytes() == zst.read_bytes()
+        assert (stats.nb_tigs, stats.total_length) == (1, len(get_query_ACGT(query_fa)))
+
+    def test_back_to_sequences_reads_the_decompressed_stream(self, tmp_path, query_fa, monkeypatch, http_dir):
+        self._stub_back_to_sequences(tmp_path, monkeypatch)
+        www, url = http_dir
+        subprocess.run(["zstd", "-q", query_fa, "-o", str(www / "ACC.contigs.fa.zst")], check=True)
+        blaster = self._blaster(tmp_path, query_fa)
+        blaster.recruiter = "back_to_sequences"
+        recruited = tmp_path / "recruited.fa"
+        stats = CoverageStats()
+        success, error = blaster._recruit(f"{url}/ACC.contigs.fa.zst", str(recruited), stats)
+        assert success, error
+        assert recruited.read_text() == open(query_fa).read()
+        assert (stats.nb_tigs, stats.total_length) == (1, len(get_query_ACGT(query_fa)))
+
+    def test_missing_accession_fails(self, tmp_path, query_fa, http_dir):
+        _, url = http_dir
+        blaster = self._blaster(tmp_path, query_fa)
+        success, error = blaster._recruit(f"{url}/MISSING.contigs.fa.zst", str(tmp_path / "recruited.fa"))
+        assert not success
+        assert "MISSING" in error
+
+    def test_corrupted_stream_fails(self, tmp_path, query_fa, http_dir):
+        www, url = http_dir
+        (www / "BAD.contigs.fa.zst").write_bytes(b"not a zstd stream")
+        blaster = self._blaster(tmp_path, query_fa)
+        success, error = blaster._recruit(f"{url}/BAD.contigs.fa.zst", str(tmp_path / "recruited.fa"))
+        assert not success
+        assert "zstd" in error
+
+
 @pytest.mark.network
 class TestFullPipelineNetwork:
     """End-to-end pipeline tests downloading from Logan.
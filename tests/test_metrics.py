@@ -0,0 +1,124 @@
+"""Unit tests for the run metrics (no external tools or network required)."""
+import json
+import os
+import subprocess
+import sys
+
+from logan_blaster import LoganBlaster, RunMetrics, count_report_hsps, wait_rusage
+
+
+def _lines(path):
+    return [json.loads(line) for line in open(path)]
+
+
+class TestWaitRusage:
+    def test_cpu_time_and_memory(self):
+        process = subprocess.Popen([sys.executable, "-c", "sum(range(3_000_000)); exit(3)"])
+        returncode, rusage = wait_rusage(process)
+        assert returncode == 3 and process.returncode == 3
+        assert rusage.ru_utime + rusage.ru_stime > 0
+        assert rusage.ru_maxrss > 0
+
+
+class TestRunMetrics:
+    def test_stage_records(self, tmp_path):
+        metrics = RunMetrics(str(tmp_path / "metrics.jsonl"))
+        with metrics.stage("SRR1", "download") as values:
+            metrics.add(bytes_downloaded=1000)
+            metrics.add(bytes_downloaded=500)
+            values["source"] = "network"
+        metrics.add(bytes_downloaded=1)  # outside of any stage: ignored
+        (record,) = _lines(tmp_path / "metrics.jsonl")
+        assert (record["accession"], record["stage"], record["bytes_downloaded"], record["source"]) == ("SRR1", "download", 1500, "network")
+        assert record["wall_time"] >= 0 and "thread_cpu_time" in record
+
+    def test_nested_stages(self, tmp_path):
+        metrics = RunMetrics(str(tmp_path / "metrics.jsonl"))
+        with metrics.stage("SRR1", "blast"):
+            metrics.add(hsps=1)
+            with metrics.stage("SRR1", "synth"):
+                metrics.add(hsps=10)
+            metrics.add(hsps=2)
+        synth, blast = _lines(tmp_path / "metrics.jsonl")
+        assert (synth["stage"], synth["hsps"]) == ("synth", 10)
+        assert (blast["stage"], blast["hsps"]) == ("blast", 3)
+
+    def test_subprocess_resources(self, tmp_path):
+        metrics = RunMetrics(str(tmp_path / "metrics.jsonl"))
+        with metrics.stage("SRR1", "recruitment"):
+            for _ in range(2):
+                _, rusage = wait_rusage(subprocess.Popen([sys.executable, "-c", "pass"]))
+                metrics.add_rusage(rusage)
+        (record,) = _lines(tmp_path / "metrics.jsonl")
+        assert record["subprocesses"] == 2
+        assert record["max_rss_bytes"] > 1 << 20
+        assert record["cpu_user_time"] + record["cpu_system_time"] > 0
+
+    def test_summary(self, tmp_path):
+        metrics = RunMetrics(str(tmp_path / "metrics.jsonl"))
+        for accession, size, rss in (("SRR1", 100, 10), ("SRR2", 300, 30), ("SRR3", 200, 20)):
+            metrics.record(accession, "download", 1.0, {"bytes_downloaded": size, "max_rss_bytes": rss})
+        summary = metrics.summary()
+        assert _lines(tmp_path / "metrics.jsonl")[-1] == summary
+        download = summary["stages"]["download"]
+        assert (download["count"], download["bytes_downloaded"], download["max_rss_bytes"]) == (3, 600, 30)
+        assert download["throughput_bytes_per_s"] == 200
+
+    def test_merge(self, tmp_path):
+        for shard, (wall_time, rss) in enumerate(((5.0, 10), (8.0, 30))):
+            metrics = RunMetrics(str(tmp_path / f"shard{shard}.jsonl"))
+            metrics.record(f"SRR{shard}", "download", 1.0, {"bytes_downloaded": 100, "max_rss_bytes": rss})
+            metrics.summary(wall_time)
+        summary = RunMetrics.merge([str(tmp_path / "shard0.jsonl"), str(tmp_path / "shard1.jsonl")],
+                                   str(tmp_path / "merged.jsonl"))
+        records = _lines(tmp_path / "merged.jsonl")
+        assert [record.get("accession") for record in records] == ["SRR0", "SRR1", None]
+        assert records[0]["throughput_bytes_per_s"] == 100
+        assert summary["wall_time"] == 8.0
+        download = summary["stages"]["download"]
+        assert (download["count"], download["bytes_downloaded"], download["max_rss_bytes"]) == (2, 200, 30)
+
+
+class TestCountReportHsps:
+    def test_self_blast(self, self_blast_txt):
+        assert count_report_hsps(self_blast_txt) == 5
+
+
+class TestBlasterMetrics:
+    def test_every_stage_is_measured(self, tmp_path, query_fa, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        for d in (LoganBlaster.LOGAN_DIR_NAME, LoganBlaster.ALIGNEMENT_DIR_NAME):
+            os.makedirs(d)
+        (tmp_path / "accessions.txt").write_text("SRR1\n")
+        blaster = LoganBlaster(None, str(tmp_path / "accessions.txt"), query_fa, False, False, 17, 0, str(tmp_path),
+                               metrics=RunMetrics(str(tmp_path / "metrics.jsonl")))
+        blaster.queries = [("my_query", query_fa)]
+
+        def download(accession):
+            local_file = os.path.join(LoganBlaster.LOGAN_DIR_NAME, f"{accession}.contigs.fa.zst")
+            blaster._metric(bytes_downloaded=1234)
+            return local_file
+
+        def recruit(source, recruited_file, stats=None):
+            with open(query_fa) as src, open(recruited_file, "w") as dst:
+                dst.write(src.read())
+            stats.add(b">my_query ka:f:2.0", 963)
+            return True, ""
+
+        def blastn(query_fasta, target_fasta, output_file, outfmt, database=False):
+            with open(output_file, "w") as f:
+                f.write("Query= my_query\n\nLength=963\n\n Score = 10 bits\nQuery  1  ATGATATTTT  10\n")
+            return True
+
+        blaster._download_accession = download
+        blaster._recruit = recruit
+        blaster._blastn = blastn
+        blaster._process_accessions()
+
+        records = _lines(tmp_path / "metrics.jsonl")
+        stages = {record["stage"]: record for record in records[:-1]}
+        assert sorted(stages) == ["blast", "coverage", "download", "recruitment", "synth"]
+        assert stages["download"]["bytes_downloaded"] == 1234
+        assert (stages["recruitment"]["tigs_scanned"], stages["coverage"]["tigs_recruited"]) == (1, 1)
+        assert stages["synth"]["hsps"] == 1
+        assert records[-1]["summary"] and sorted(records[-1]["stages"]) == sorted(stages)
@@ -0,0 +1,230 @@
+"""Unit tests for the builtin k-mer recruiter (no external tools or network required)."""
+import io
+import random
+
+import pytest
+
+from logan_blaster import (
+    CoverageStats,
+    LoganBlasterError,
+    QueryIndexCache,
+    QueryKmerIndex,
+    iter_fasta_records,
+    recruit_sequences,
+    split_query_file,
+)
+
+
+def _index(tmp_path, fasta, kmer_size=5):
+    fa = tmp_path / "query.fa"
+    fa.write_text(fasta)
+    return QueryKmerIndex(str(fa), kmer_size)
+
+
+def _revcomp(seq):
+    return seq[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+
+class TestIterFastaRecords:
+    def test_multiline_records(self):
+        stream = io.BytesIO(b">a first\nACGT\nAC\n>b\nTTTT\n")
+        assert list(iter_fasta_records(stream)) == [(b">a first", b"ACGTAC"), (b">b", b"TTTT")]
+
+    def test_empty_stream(self):
+        assert list(iter_fasta_records(io.BytesIO(b""))) == []
+
+
+class TestQueryKmerIndex:
+    def test_number_of_kmers(self, tmp_path):
+        # 3 distinct 5-mers, stored in both orientations
+        index = _index(tmp_path, ">q\nAAAAACC\n")
+        assert set(index.kmers) == {b"AAAAA", b"AAAAC", b"AAACC", b"TTTTT", b"GTTTT", b"GGTTT"}
+
+    def test_kmers_with_n_are_ignored(self, tmp_path):
+        index = _index(tmp_path, ">q\nACGNTACCA\n")
+        assert set(index.kmers) == {b"TACCA", b"TGGTA"}
+
+    def test_counts_both_orientations(self, tmp_path):
+        query = "ATGATATTTTCAACTTTAGA"
+        index = _index(tmp_path, f">q\n{query}\n", kmer_size=17)
+        assert index.count_shared_kmers(query.encode()) == 4
+        assert index.count_shared_kmers(_revcomp(query).encode()) == 4
+
+    def test_lowercase_query(self, tmp_path):
+        index = _index(tmp_path, ">q\nacggtacc\n")
+        assert index.count_shared_kmers(b"ACGGT") == 1
+
+    def test_all_records_are_indexed(self, tmp_path):
+        index = _index(tmp_path, ">q1\nAAAAAC\n>q2\nGGGGGT\n")
+        assert index.count_shared_kmers(b"AAAAA") == 1
+        assert index.count_shared_kmers(b"GGGGT") == 1
+
+    def test_sharing_queries_mask(self, tmp_path):
+        index = _index(tmp_path, ">q1 first\nAAAAAC\n>q2\nGGGGGT\n>q3\nAAAAAGGGGG\n")
+        assert index.query_ids == ["q1", "q2", "q3"]
+        assert index.sharing_queries(b"AAAAA") == 0b101
+        assert index.sharing_queries(b"ACCCC") == 0b010  # reverse complement of GGGGGT
+        assert index.sharing_queries(b"CACAC") == 0
+
+    def test_shared_kmers_by_query(self, tmp_path):
+        index = _index(tmp_path, ">q1\nAAAAAAC\n>q2\nGGGGGT\n")
+        assert index.nb_kmers == [2, 2]
+        # AAAAA twice for q1, ACCCC (reverse complement of GGGGT) for q2, stored in canonical form
+        assert index.shared_kmers(b"AAAAAACCCC") == {0: [b"AAAAA", b"AAAAA", b"AAAAC"], 1: [b"ACCCC"]}
+        assert index.shared_kmers(b"CACAC") == {}
+
+    def test_seed_prefilter(self, tmp_path):
+        rng = random.Random(3)
+        query = "".join(rng.choice("ACGT") for _ in range(500))
+        index = _index(tmp_path, f">q\n{query}\n", kmer_size=31)
+        assert 0 < index.seed_size < 31
+        # any sequence sharing a k-mer with the query, wherever it lies, passes the prefilter
+        for start in range(0, 470, 7):
+            for offset in range(0, 40, 3):
+                noise = "".join(rng.choice("ACGT") for _ in range(offset))
+                seq = (noise + query[start: start + 31] + noise).encode()
+                assert index.may_share_kmers(seq)
+                assert index.count_shared_kmers(seq) >= 1
+                assert index.may_share_kmers(_revcomp(seq.decode()).encode())
+        assert not index.may_share_kmers(b"ACAC" * 100)
+        assert not index.may_share_kmers(b"ACGT")
+
+
+class TestQueryIndexCache:
+    def test_indexes_are_shared_by_content(self, tmp_path):
+        cache = QueryIndexCache(max_size=2)
+        for name in ("a.fa", "b.fa"):
+            (tmp_path / name).write_text(">q\nAAAAAC\n")
+        (tmp_path / "c.fa").write_text(">q\nGGGGGT\n")
+        index = cache.get(str(tmp_path / "a.fa"), 5)
+        assert cache.get(str(tmp_path / "b.fa"), 5) is index
+        assert cache.get(str(tmp_path / "a.fa"), 4) is not index
+
+    def test_least_recently_used_indexes_are_dropped(self, tmp_path):
+        cache = QueryIndexCache(max_size=2)
+        files = []
+        for i, seq in enumerate(("AAAAAC", "GGGGGT", "CACACA")):
+            files.append(str(tmp_path / f"{i}.fa"))
+            (tmp_path / f"{i}.fa").write_text(f">q\n{seq}\n")
+        first = cache.get(files[0], 5)
+        second = cache.get(files[1], 5)
+        assert cache.get(files[0], 5) is first
+        cache.get(files[2], 5)
+        assert cache.get(files[0], 5) is first
+        assert cache.get(files[1], 5) is not second
+
+
+class TestSplitQueryFile:
+    def test_one_file_per_query(self, tmp_path):
+        fa = tmp_path / "queries.fa"
+        fa.write_text(">q1 first\nAAAA\nCC\n>q2\nGGGG\n")
+        queries = split_query_file(str(fa), str(tmp_path / "queries"))
+        assert [query_id for query_id, _ in queries] == ["q1", "q2"]
+        assert open(queries[0][1]).read() == ">q1 first\nAAAACC\n"
+        assert open(queries[1][1]).read() == ">q2\nGGGG\n"
+
+    def test_duplicated_ids_are_rejected(self, tmp_path):
+        fa = tmp_path / "queries.fa"
+        fa.write_text(">q1\nAAAA\n>q1 again\nGGGG\n")
+        with pytest.raises(LoganBlasterError, match="q1"):
+            split_query_file(str(fa), str(tmp_path / "queries"))
+        assert not (tmp_path / "queries").exists()
+
+
+class TestRecruitSequences:
+    def test_recruits_sharing_sequences_only(self, tmp_path, query_fa):
+        index = QueryKmerIndex(query_fa, 17)
+        tigs = io.BytesIO(
+            b">tig_1 ka:f:3.0\nATGATATTTTCAACTTTAGAGCA\n"
+            b">tig_2 ka:f:5.0\nCCCCCCCCCCCCCCCCCCCCCCCC\n"
+            b">tig_3\nTGCTCTAAAGTTGAAAATATCAT\n"
+        )
+        out = io.BytesIO()
+        assert recruit_sequences(tigs, index, out) == (3, 2)
+        assert out.getvalue() == (
+            b">tig_1 ka:f:3.0 7\nATGATATTTTCAACTTTAGAGCA\n"
+            b">tig_3 7\nTGCTCTAAAGTTGAAAATATCAT\n"
+        )
+
+    def test_coverage_stats_of_scanned_sequences(self, tmp_path, query_fa):
+        index = QueryKmerIndex(query_fa, 17)
+        stats = CoverageStats()
+        tigs = io.BytesIO(b">tig_1 ka:f:3.0\nATGATATTTTCAACTTTAGAGCA\n>tig_2 ka:f:5.0\nCCCCCCCCCCCC\n")
+        recruit_sequences(tigs, index, io.BytesIO(), stats)
+        assert (stats.nb_tigs, stats.total_length, stats.record()["mean_coverage"]) == (2, 35, 4.0)
+
+    def test_nothing_recruited(self, tmp_path, query_fa):
+        index = QueryKmerIndex(query_fa, 17)
+        out = io.BytesIO()
+        assert recruit_sequences(io.BytesIO(b">t\nCCCCCCCCCCCCCCCCCCCCCCCC\n"), index, out) == (1, 0)
+        assert out.getvalue() == b""
+
+
+class TestCoverageStats:
+    TIGS = (
+        b">SRR1_1 ka:f:2.0   L:+:2:+\nACGTACGTAC\n"
+        b">SRR1_2 ka:f:4.5\nACGTACGTACGTACGTACGT\n"
+        b">SRR1_3 ka:f:120.25\nACGTACGTACGTACGTACGTACGTACGTAC\n"
+        b">SRR1_4\nACGTACGTAC\n"
+    )
+
+    def test_statistics(self):
+        stats = CoverageStats()
+        for header, seq in iter_fasta_records(io.BytesIO(self.TIGS)):
+            stats.add(header, len(seq))
+        record = stats.record()
+        assert record["nb_tigs"] == 4
+        assert record["total_length"] == 70
+        assert record["mean_coverage"] == pytest.approx((2.0 + 4.5 + 120.25) / 3)
+        assert record["weighted_mean_coverage"] == pytest.approx((20 + 90 + 3607.5) / 60)
+        assert record["median_coverage"] == pytest.approx(4.5, rel=CoverageStats.MEDIAN_RELATIVE_ERROR)
+        assert (record["min_coverage"], record["max_coverage"]) == (2.0, 120.25)
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+    def test_stream_split_anywhere(self, chunk_size):
+        expected = CoverageStats()
+        for header, seq in iter_fasta_records(io.BytesIO(self.TIGS)):
+            expected.add(header, len(seq))
+        stats = CoverageStats()
+        for i in range(0, len(self.TIGS), chunk_size):
+            stats.feed(self.TIGS[i: i + chunk_size])
+        stats.close()
+        assert stats.record() == expected.record()
+
+    @pytest.mark.parametrize("tigs", [
+        TIGS.replace(b">SRR1_4\n", b">SRR1_4 ka:f:0.0\n") * 50,
+        TIGS.replace(b"\n", b"\r\n"),
+        TIGS.replace(b"ka:f:4.5", b"L:+:2:+ ka:f:4.5").replace(b"SRR1_3", b"SRR1:3"),
+        TIGS.replace(b"ka:f:2.0", b"ka:f:2.0e").replace(b"ka:f:120.25", b"xka:f:7 ka:f:120.25"),
+        TIGS.replace(b"ACGT\n>", b"ACGT\nAC\n>").replace(b"L:+:2:+\nACGTACGTAC\n", b"L:+:2:+\n"),
+    ])
+    def test_stream_of_other_layouts(self, tigs):
+        expected = CoverageStats()
+        for header, seq in iter_fasta_records(io.BytesIO(tigs)):
+            expected.add(header, len(seq.rstrip(b"\r")))
+        for chunk_size in (5, 1 << 20):
+            stats = CoverageStats()
+            for i in range(0, len(tigs), chunk_size):
+                stats.feed(tigs[i: i + chunk_size])
+            stats.close()
+            assert stats.record() == expected.record()
+
+    def test_multiline_records_without_final_newline(self):
+        stats = CoverageStats()
+        stats.feed(b">t1 ka:f:3.0\nACGT\nACGT\n>t2 ka:f:1.0\nAC")
+        stats.close()
+        assert (stats.nb_tigs, stats.total_length) == (2, 10)
+
+    def test_approximate_median(self):
+        stats = CoverageStats()
+        values = [1.0 + i * 0.37 for i in range(1001)]
+        for value in values:
+            stats.add(b">t ka:f:%f" % value, 31)
+        assert stats.median() == pytest.approx(values[500], rel=CoverageStats.MEDIAN_RELATIVE_ERROR)
+
+    def test_no_abundance(self):
+        stats = CoverageStats()
+        stats.add(b">t", 10)
+        assert stats.record()["mean_coverage"] is None
+        assert stats.median() is None
+        assert "no coverage" in stats.summary()
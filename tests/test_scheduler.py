@@ -0,0 +1,110 @@
+"""Unit tests for the core and memory scheduler (no external tools or network required)."""
+import os
+import threading
+import time
+
+import pytest
+
+from logan_blaster import LoganBlaster, ResourceScheduler, BLAST_BYTES_PER_THREAD, RECRUITMENT_BYTES_PER_THREAD
+
+
+class TestResourceScheduler:
+    def test_threads_for(self):
+        scheduler = ResourceScheduler(8)
+        assert scheduler.threads_for(0, 100) == 1
+        assert scheduler.threads_for(250, 100) == 3
+        assert scheduler.threads_for(10_000, 100) == 8
+
+    def test_free_cores_are_granted(self):
+        scheduler = ResourceScheduler(8)
+        with scheduler.reserve(6) as first:
+            with scheduler.reserve(4) as second:
+                assert (first, second) == (6, 2)
+
+    def test_budget_is_never_exceeded(self):
+        scheduler = ResourceScheduler(4, memory=1000)
+        lock = threading.Lock()
+        usage = {"threads": 0, "memory": 0, "max_threads": 0, "max_memory": 0}
+
+        def job(threads, memory):
+            with scheduler.reserve(threads, memory) as granted:
+                with lock:
+                    usage["threads"] += granted
+                    usage["memory"] += memory
+                    usage["max_threads"] = max(usage["max_threads"], usage["threads"])
+                    usage["max_memory"] = max(usage["max_memory"], usage["memory"])
+                time.sleep(0.01)
+                with lock:
+                    usage["threads"] -= granted
+                    usage["memory"] -= memory
+
+        jobs = [threading.Thread(target=job, args=(1 + i % 3, 200 + 100 * (i % 4))) for i in range(20)]
+        for thread in jobs:
+            thread.start()
+        for thread in jobs:
+            thread.join()
+        assert usage["max_threads"] <= 4 and usage["max_memory"] <= 1000
+        assert (usage["threads"], usage["memory"]) == (0, 0)
+
+    def test_oversized_requests_are_reduced(self):
+        scheduler = ResourceScheduler(2, memory=100)
+        with scheduler.reserve(16, 10_000) as granted:
+            assert granted == 2
+
+
+class TestBlasterScheduling:
+    def _blaster(self, tmp_path, monkeypatch, threads):
+        monkeypatch.chdir(tmp_path)
+        os.makedirs(LoganBlaster.LOGAN_DIR_NAME)
+        return LoganBlaster(None, None, "query.fa", False, False, 17, 0, str(tmp_path),
+                            scheduler=ResourceScheduler(threads))
+
+    def test_small_target_is_aligned_against_the_fasta_file(self, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, monkeypatch, 8)
+        (tmp_path / "recruited.fa").write_text(">tig\nACGT\n")
+        with blaster._blast_target("recruited.fa") as (target, options):
+            assert (target, options) == ("recruited.fa", {})
+
+    def test_large_target_is_aligned_against_the_fasta_file(self, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, monkeypatch, 8)
+        with open(tmp_path / "recruited.fa", "wb") as f:
+            f.truncate(3 * BLAST_BYTES_PER_THREAD)
+        blaster._make_blast_db = lambda fasta_file, database: pytest.fail("no database without --makeblastdb")
+        with blaster._blast_target("recruited.fa") as (target, options):
+            assert (target, options) == ("recruited.fa", {})
+            # blastn ignores -num_threads with -subject: a single core is reserved
+            assert blaster.scheduler._free_threads == 7
+
+    def test_large_target_gets_threads_with_makeblastdb(self, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, monkeypatch, 8)
+        blaster.makeblastdb = True
+        with open(tmp_path / "recruited.fa", "wb") as f:
+            f.truncate(3 * BLAST_BYTES_PER_THREAD)
+        databases = []
+        blaster._make_blast_db = lambda fasta_file, database: databases.append(database) or True
+        with blaster._blast_target("recruited.fa") as (target, options):
+            assert target == databases[0]
+            assert options == {"database": True, "threads": 3}
+            assert os.path.isdir(os.path.dirname(target))
+        assert not os.path.exists(os.path.dirname(target)), "the database is removed"
+
+    def test_blastn_threads(self, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, monkeypatch, 8)
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        stub = bin_dir / "blastn"
+        stub.write_text(f"#!/bin/sh\necho \"$@\" > {tmp_path}/blastn_args\n")
+        stub.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        assert blaster._blastn("query.fa", "db", "out.txt", "0", database=True, threads=5)
+        assert "-num_threads 5" in (tmp_path / "blastn_args").read_text()
+
+    def test_back_to_sequences_threads(self, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, monkeypatch, 4)
+        with open(tmp_path / "SRR1.contigs.fa.zst", "wb") as f:
+            f.truncate(2 * RECRUITMENT_BYTES_PER_THREAD)
+        calls = []
+        blaster._run_back_to_sequences = lambda source, recruited_file, stats=None, threads=None: calls.append(threads) or (True, "")
+        assert blaster._recruit("SRR1.contigs.fa.zst", "recruited.fa") == (True, "")
+        assert blaster._recruit("https://example.org/SRR2.contigs.fa.zst", "recruited.fa") == (True, "")
+        assert calls == [2, 1]
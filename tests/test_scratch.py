@@ -0,0 +1,155 @@
+"""Unit tests for the scratch space budget (no external tools or network required)."""
+import os
+import threading
+import time
+
+from logan_blaster import LoganBlaster, ScratchSpace
+
+
+def _write(directory, name, size, mtime=None):
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+class TestScratchSpace:
+    def test_reserve_within_budget(self, tmp_path):
+        _write(tmp_path, "SRR1.contigs.fa.zst", 100)
+        scratch = ScratchSpace(str(tmp_path), 1000)
+        scratch.reserve("SRR2", 900)
+        assert scratch.usage() == 100
+        assert (tmp_path / "SRR1.contigs.fa.zst").exists()
+
+    def test_released_accessions_are_evicted_first(self, tmp_path):
+        # Leftovers of a previous run, older than the released accessions
+        _write(tmp_path, "SRR0.contigs.fa.zst", 100, mtime=1)
+        scratch = ScratchSpace(str(tmp_path), 400)
+        for accession in ("SRR1", "SRR2"):
+            scratch.reserve(accession, 0)
+            _write(tmp_path, f"{accession}.contigs.fa.zst", 100)
+            _write(tmp_path, f"{accession}.contigs.fa_recruited_query.fa", 10)
+        scratch.release("SRR2")
+        scratch.release("SRR1")
+        scratch.reserve("SRR3", 150)
+        assert sorted(os.listdir(tmp_path)) == ["SRR0.contigs.fa.zst", "SRR1.contigs.fa.zst", "SRR1.contigs.fa_recruited_query.fa"]
+        scratch.downloaded("SRR3")
+        scratch.reserve("SRR4", 350)
+        assert os.listdir(tmp_path) == []
+
+    def test_held_accessions_are_not_evicted(self, tmp_path):
+        scratch = ScratchSpace(str(tmp_path), 150)
+        scratch.reserve("SRR1", 0)
+        _write(tmp_path, "SRR1.contigs.fa.zst", 100)
+        resumed = threading.Event()
+
+        def reserve():
+            scratch.reserve("SRR2", 100)
+            resumed.set()
+        thread = threading.Thread(target=reserve, daemon=True)
+        thread.start()
+        # The download of SRR2 is paused until SRR1 is released
+        assert not resumed.wait(timeout=0.2)
+        assert (tmp_path / "SRR1.contigs.fa.zst").exists()
+        scratch.release("SRR1")
+        assert resumed.wait(timeout=5)
+        thread.join()
+        assert not (tmp_path / "SRR1.contigs.fa.zst").exists()
+
+    def test_reservations_are_counted_until_downloaded(self, tmp_path):
+        scratch = ScratchSpace(str(tmp_path), 150)
+        scratch.reserve("SRR1", 100)
+        resumed = threading.Event()
+        thread = threading.Thread(target=lambda: (scratch.reserve("SRR2", 100), resumed.set()), daemon=True)
+        thread.start()
+        assert not resumed.wait(timeout=0.2)
+        # The download of SRR1 failed: nothing on disk, the reservation ends
+        scratch.downloaded("SRR1")
+        assert resumed.wait(timeout=5)
+        thread.join()
+
+    def test_downloads_in_progress_are_counted_once(self, tmp_path):
+        scratch = ScratchSpace(str(tmp_path), 200)
+        scratch.reserve("SRR1", 100)
+        # The partial file of a download is allocated to its full size when it starts
+        _write(tmp_path, "SRR1.contigs.fa.zst.part", 100)
+        resumed = threading.Event()
+        thread = threading.Thread(target=lambda: (scratch.reserve("SRR2", 100), resumed.set()), daemon=True)
+        thread.start()
+        assert resumed.wait(timeout=5), "both downloads fit in the budget"
+        thread.join()
+        assert (tmp_path / "SRR1.contigs.fa.zst.part").exists()
+
+    def test_parked_accessions_do_not_deadlock(self, tmp_path):
+        scratch = ScratchSpace(str(tmp_path), 150)
+        scratch.reserve("SRR1", 0)
+        _write(tmp_path, "SRR1.contigs.fa_recruited_query.fa", 100)
+        scratch.park("SRR1")
+        # SRR1 waits for a blast batch which waits for SRR2: SRR2 proceeds over the budget
+        scratch.reserve("SRR2", 100)
+        assert (tmp_path / "SRR1.contigs.fa_recruited_query.fa").exists()
+        scratch.release_parked("SRR1")
+        scratch.reserve("SRR3", 0)
+        assert not (tmp_path / "SRR1.contigs.fa_recruited_query.fa").exists()
+
+    def test_release_parked_ignores_active_accessions(self, tmp_path):
+        scratch = ScratchSpace(str(tmp_path), 150)
+        scratch.reserve("SRR1", 0)
+        _write(tmp_path, "SRR1.contigs.fa.zst", 200)
+        scratch.release_parked("SRR1")
+        scratch.release("SRR2")
+        assert scratch._eviction_candidate(scratch._files()) is None
+
+
+class TestBlasterScratch:
+    def _blaster(self, tmp_path, monkeypatch, accessions, max_bytes, **kwargs):
+        monkeypatch.chdir(tmp_path)
+        os.makedirs(LoganBlaster.LOGAN_DIR_NAME)
+        (tmp_path / "accessions.txt").write_text("".join(f"{a}\n" for a in accessions))
+        blaster = LoganBlaster(None, str(tmp_path / "accessions.txt"), "query.fa", False, False, 17, 0, str(tmp_path),
+                               scratch=ScratchSpace(LoganBlaster.LOGAN_DIR_NAME, max_bytes), **kwargs)
+        blaster.queries = ["query.fa"]
+        return blaster
+
+    def test_intermediate_files_stay_within_budget(self, tmp_path, monkeypatch):
+        accessions = [f"SRR{i}" for i in range(8)]
+        blaster = self._blaster(tmp_path, monkeypatch, accessions, 350, download_workers=3, workers=2)
+        blaster.downloader.size = lambda url: 100
+        peak = []
+        lock = threading.Lock()
+
+        def download(accession):
+            local_file = os.path.join(LoganBlaster.LOGAN_DIR_NAME, f"{accession}.contigs.fa.zst")
+            _write(tmp_path, local_file, 100)
+            with lock:
+                peak.append(blaster.scratch.usage())
+            return local_file
+
+        def process(accession, local_file):
+            # Recruited sequences are not anticipated by the reservations: kept empty here
+            _write(tmp_path, f"{local_file[:-4]}_recruited_query.fa", 0)
+            time.sleep(0.01)
+            with lock:
+                peak.append(blaster.scratch.usage())
+
+        blaster._download_accession = download
+        blaster._recruit_and_align = process
+        blaster._process_accessions()
+        assert len(peak) == 16 and max(peak) <= 300
+        assert len(os.listdir(LoganBlaster.LOGAN_DIR_NAME)) < 16
+
+    def test_failed_download_is_released(self, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, monkeypatch, ["SRR1"], 1000)
+        blaster.downloader.size = lambda url: 100
+        blaster._download_accession = lambda accession: None
+        blaster._process_accessions()
+        assert blaster.scratch._held == {} and blaster.scratch._reservations == {}
+
+    def test_batched_accessions_are_parked_until_the_batch_is_done(self, tmp_path, monkeypatch):
+        blaster = self._blaster(tmp_path, monkeypatch, ["SRR1"], 1000)
+        blaster.scratch.reserve("SRR1", 0)
+        with blaster._blast_batches_lock:
+            blaster._batched["SRR1"] = 1
+        blaster._release_scratch("SRR1")
+        assert blaster.scratch._held == {"SRR1": "parked"}
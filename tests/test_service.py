@@ -0,0 +1,333 @@
+"""Tests of the search service: jobs queued, coalesced and run with stubbed downloads and the stub
+blastn of benchmarks/stubs, and its HTTP API (no external tools or network required)."""
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+import logan_blaster
+from benchmarks import synthetic
+from logan_blaster import LoganBlasterError, LoganSession, SearchService, iter_fasta_records, make_service_server
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "stubs")
+
+
+@pytest.fixture
+def stubs_on_path(monkeypatch):
+    monkeypatch.setenv("PATH", f"{STUBS_DIR}{os.pathsep}{os.environ['PATH']}")
+
+
+@pytest.fixture
+def data(tmp_path):
+    """Queries qa and qb, and the contigs of SRR1 (sharing pieces of qa), SRR2 (qb) and SRR3 (both)"""
+    queries = {}
+    for seed, name in enumerate(("qa", "qb")):
+        synthetic.make_query(str(tmp_path / f"{name}.fa"), 600, seed=seed, name=name)
+        queries[name] = (tmp_path / f"{name}.fa").read_text()
+    sequences = {name: text.split("\n")[1] for name, text in queries.items()}
+    contigs = {}
+    for accession, names in (("SRR1", ["qa"]), ("SRR2", ["qb"]), ("SRR3", ["qa", "qb"])):
+        contigs[accession] = str(tmp_path / f"{accession}.fa")
+        with open(contigs[accession], "w") as out:
+            for seed, name in enumerate(names):
+                for header, seq in synthetic.iter_contigs(sequences[name], 100, matching_fraction=0.1, seed=seed + 10,
+                                                          accession=f"{accession}{name}"):
+                    out.write(f"{header}\n{seq}\n")
+    return queries, contigs
+
+
+class StubService(SearchService):
+    """Downloads are replaced by the synthetic contigs, and recruitment keeps the tigs sharing k-mers with the queries"""
+
+    def __init__(self, directory, contigs, **options):
+        super().__init__(directory, tabular=True, **options)
+        self.contigs = contigs
+        self.downloads = []
+        self.recruitments = []
+        self.runs = []
+
+    def _blaster(self, query_file, run_dir, query_accessions=None):
+        blaster = super()._blaster(query_file, run_dir, query_accessions)
+        self.runs.append(run_dir)
+
+        def download(accession):
+            self.downloads.append(accession)
+            return self.contigs.get(accession)
+
+        def recruit(source, recruited_file, stats=None):
+            self.recruitments.append(source)
+            index = blaster._get_query_index()
+            with open(source, "rb") as f, open(recruited_file, "wb") as out:
+                for header, seq in iter_fasta_records(f):
+                    if index.sharing_queries(seq.upper()):
+                        out.write(b"%s\n%s\n" % (header, seq))
+            return True, ""
+
+        blaster._download_accession = download
+        blaster._recruit = recruit
+        return blaster
+
+
+def _wait(service, *jobs, timeout=30):
+    deadline = time.time() + timeout
+    while any(job.status in ("queued", "running") for job in jobs):
+        assert time.time() < deadline, "jobs not done in time"
+        time.sleep(0.02)
+
+
+def _hits(job):
+    return {result["accession"]: result["hits"] for result in job.results}
+
+
+class TestSearchService:
+    def test_queued_jobs_are_coalesced(self, tmp_path, data, stubs_on_path):
+        queries, contigs = data
+        service = StubService(str(tmp_path / "service"), contigs, runners=1)
+        job_a = service.submit(queries["qa"], ["SRR1", "SRR3"])
+        job_b = service.submit(queries["qb"], ["SRR2", "SRR3", "SRR2"])
+        # The same query under another name
+        job_again = service.submit(queries["qa"].replace(">qa", ">again"), ["SRR1"])
+        service.start()
+        _wait(service, job_a, job_b, job_again)
+        service.close()
+
+        assert [job.status for job in (job_a, job_b, job_again)] == ["done"] * 3
+        assert len(service.runs) == 1 and job_a.run_dir == job_b.run_dir == service.runs[0]
+        # Accessions shared by the jobs are downloaded and recruited once
+        assert sorted(service.downloads) == ["SRR1", "SRR2", "SRR3"]
+        assert len(service.recruitments) == 3
+        assert _hits(job_a) == {"SRR1": ["qa"], "SRR3": ["qa"]}
+        assert _hits(job_b) == {"SRR2": ["qb"], "SRR3": ["qb"]}
+        assert _hits(job_again) == {"SRR1": ["again"]}
+        # The query submitted twice is aligned once
+        result_a = next(result for result in job_a.results if result["accession"] == "SRR1")
+        assert job_again.results[0]["files"]["again"] == result_a["files"]["qa"]
+        assert sorted(os.listdir(os.path.join(job_a.run_dir, "alignments"))) == [
+            f"{prefix}{query}_vs_{accession}.{extension}"
+            for prefix, extension in (("", "hsp"), ("synth_", "txt"))
+            for query, accession in (("qa", "SRR1"), ("qa", "SRR3"), ("qb", "SRR2"), ("qb", "SRR3"))]
+        record = job_b.results[0]
+        assert record["hits"] == ["qb"] and record["nb_hsps"]["qb"] > 0 and record["covered_positions"]["qb"] > 0
+
+    def test_queries_are_aligned_with_the_accessions_of_their_jobs(self, tmp_path, data, stubs_on_path):
+        queries, contigs = data
+        service = StubService(str(tmp_path / "service"), contigs, runners=1)
+        # SRR3 shares k-mers with both queries, but is searched by the job of qa only
+        job_a = service.submit(queries["qa"], ["SRR1", "SRR3"])
+        job_b = service.submit(queries["qb"], ["SRR2"])
+        service.start()
+        _wait(service, job_a, job_b)
+        service.close()
+        assert len(service.runs) == 1
+        assert _hits(job_a) == {"SRR1": ["qa"], "SRR3": ["qa"]} and _hits(job_b) == {"SRR2": ["qb"]}
+        assert sorted(name for name in os.listdir(os.path.join(job_a.run_dir, "alignments")) if name.endswith(".hsp")) == [
+            "qa_vs_SRR1.hsp", "qa_vs_SRR3.hsp", "qb_vs_SRR2.hsp"]
+
+    def test_jobs_run_separately(self, tmp_path, data, stubs_on_path):
+        queries, contigs = data
+        service = StubService(str(tmp_path / "service"), contigs, runners=2, batch_jobs=1)
+        jobs = [service.submit(queries["qa"], [accession]) for accession in ("SRR1", "SRR2", "SRR3")]
+        service.start()
+        _wait(service, *jobs)
+        service.close()
+        assert len(set(service.runs)) == 3
+        assert [_hits(job) for job in jobs] == [{"SRR1": ["qa"]}, {"SRR2": []}, {"SRR3": ["qa"]}]
+        assert [job.results[0]["status"] for job in jobs] == ["aligned", "not_aligned", "aligned"]
+
+    def test_failed_accessions(self, tmp_path, data, stubs_on_path):
+        queries, contigs = data
+        service = StubService(str(tmp_path / "service"), contigs, runners=1)
+        job = service.submit(queries["qa"], ["SRR1", "SRR9"])
+        service.start()
+        _wait(service, job)
+        service.close()
+        assert job.status == "done"
+        assert {result["accession"]: result["status"] for result in job.results} == {"SRR1": "aligned", "SRR9": "failed"}
+        assert service.summary(job)["nb_failed"] == 1
+
+    def test_session_jobs(self, tmp_path, data, stubs_on_path, monkeypatch):
+        queries, contigs = data
+
+        def download_file(url, destination):
+            raise OSError(f"{url} not found")
+        monkeypatch.setattr(logan_blaster, "download_file", download_file)
+        service = StubService(str(tmp_path / "service"), contigs, runners=1)
+        LoganSession("qb", queries["qb"].split("\n")[1], {"ID": ["SRR2", "SRR3"]}).save(
+            str(tmp_path / "service" / "sessions" / "kmviz-1.session.json"))
+        job = service.submit(session="kmviz-1")
+        missing = service.submit(session="kmviz-2")
+        service.start()
+        _wait(service, job, missing)
+        service.close()
+        assert job.status == "done" and _hits(job) == {"SRR2": ["qb"], "SRR3": ["qb"]}
+        assert missing.status == "failed" and "kmviz-2" in missing.error
+
+    def test_failed_runs_do_not_stop_the_runner(self, tmp_path, data, stubs_on_path, monkeypatch):
+        queries, contigs = data
+
+        def download(self, url, destination):
+            raise OSError(f"{url}: 404 Not Found")
+        monkeypatch.setattr(logan_blaster.HTTPDownloader, "download", download)
+        service = StubService(str(tmp_path / "service"), contigs, runners=1, batch_jobs=1)
+        blaster = service._blaster
+
+        def exiting_blaster(query_file, run_dir, query_accessions=None):
+            if not service.runs:
+                service.runs.append(run_dir)
+                raise SystemExit(1)
+            return blaster(query_file, run_dir, query_accessions)
+        service._blaster = exiting_blaster
+        exiting = service.submit(queries["qa"], ["SRR1"])
+        missing = service.submit(session="kmviz-missing")
+        job = service.submit(queries["qa"], ["SRR1"])
+        service.start()
+        _wait(service, exiting, missing, job)
+        service.close()
+        assert exiting.status == "failed" and missing.status == "failed" and "kmviz-missing" in missing.error
+        assert job.status == "done" and _hits(job) == {"SRR1": ["qa"]}
+
+    def test_finished_jobs_are_forgotten(self, tmp_path, data, stubs_on_path):
+        queries, contigs = data
+        service = StubService(str(tmp_path / "service"), contigs, runners=1, batch_jobs=1, keep_jobs=2)
+        jobs = [service.submit(queries["qa"], ["SRR1"]) for _ in range(3)]
+        cancelled = service.submit(queries["qa"], ["SRR1"])
+        service.cancel(cancelled.id)
+        service.start()
+        _wait(service, *jobs)
+        service.close()
+        assert [job.status for job in jobs] == ["done"] * 3
+        assert [summary["id"] for summary in service.summaries()] == [job.id for job in jobs[1:]]
+        assert service.job(cancelled.id) is None and service.job(jobs[0].id) is None
+
+    def test_cancel_queued_job(self, tmp_path, data):
+        queries, contigs = data
+        service = StubService(str(tmp_path / "service"), contigs)
+        job = service.submit(queries["qa"], ["SRR1"])
+        assert service.cancel(job.id) is job and job.status == "cancelled"
+        assert service.cancel("unknown") is None
+        service.start()
+        service.close()
+        assert service.runs == []
+
+    @pytest.mark.parametrize("kwargs", [
+        {"query": "", "accessions": ["SRR1"]},
+        {"query": "ACGT", "accessions": ["SRR1"]},
+        {"query": ">q\nACGT\n>q\nAAAA\n", "accessions": ["SRR1"]},
+        {"query": ">q\nACGT\n", "accessions": []},
+        {"query": ">q\nACGT\n", "accessions": "SRR1"},
+        {"query": ">q\nACGT\n", "accessions": ["../SRR1"]},
+        {"session": "kmviz-1", "accessions": ["SRR1"]},
+        {"session": "../kmviz"},
+    ])
+    def test_invalid_jobs(self, tmp_path, kwargs):
+        service = SearchService(str(tmp_path / "service"))
+        with pytest.raises(LoganBlasterError):
+            service.submit(**kwargs)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def _request(connection, method, path, document=None):
+    body = json.dumps(document) if document is not None else None
+    connection.request(method, path, body=body, headers={"Content-Type": "application/json"} if body else {})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+@pytest.fixture
+def serve(tmp_path, data):
+    """Starts the service and its server, given the arguments of make_service_server"""
+    servers = []
+
+    def start(**kwargs):
+        service = StubService(str(tmp_path / "service"), data[1], runners=1)
+        service.start()
+        server = make_service_server(service, port=0, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.service.close()
+
+
+def _wait_for_job(connection, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        status, job = _request(connection, "GET", f"/jobs/{job_id}")
+        if job["status"] not in ("queued", "running"):
+            return job
+        assert time.time() < deadline, "job not done in time"
+        time.sleep(0.02)
+
+
+class TestServiceAPI:
+    def test_http_api(self, data, serve, stubs_on_path):
+        queries, _ = data
+        server = serve()
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        status, job = _request(connection, "POST", "/jobs", {"query": queries["qa"], "accessions": ["SRR1", "SRR2"]})
+        assert status == 201 and job["status"] in ("queued", "running") and job["queries"] == ["qa"]
+        job = _wait_for_job(connection, job["id"])
+        assert job["status"] == "done" and job["nb_processed"] == 2 and job["hits"] == ["SRR1"]
+
+        status, results = _request(connection, "GET", f"/jobs/{job['id']}/results")
+        assert status == 200
+        records = {record["accession"]: record for record in results["results"]}
+        assert records["SRR1"]["hits"] == ["qa"] and records["SRR1"]["nb_hsps"]["qa"] > 0
+        assert records["SRR2"]["status"] == "not_aligned"
+        assert all(os.path.exists(file) for file in records["SRR1"]["files"]["qa"])
+
+        status, jobs = _request(connection, "GET", "/jobs")
+        assert status == 200 and [listed["id"] for listed in jobs["jobs"]] == [job["id"]]
+        status, cancelled = _request(connection, "DELETE", f"/jobs/{job['id']}")
+        assert status == 200 and cancelled["status"] == "done", "finished jobs are not cancelled"
+
+    def test_http_errors(self, serve):
+        server = serve()
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        assert _request(connection, "GET", "/jobs/unknown")[0] == 404
+        assert _request(connection, "DELETE", "/jobs/unknown")[0] == 404
+        assert _request(connection, "GET", "/other")[0] == 404
+        status, error = _request(connection, "POST", "/jobs", {"query": ">q\nACGT\n", "accessions": ["SRR1"], "kmer_size": 3})
+        assert status == 400 and "kmer_size" in error["error"]
+        status, error = _request(connection, "POST", "/jobs", {"query": ">q\nACGT\n"})
+        assert status == 400 and "accessions" in error["error"]
+
+    def test_unix_socket(self, tmp_path, data, serve, stubs_on_path):
+        queries, _ = data
+        socket_path = str(tmp_path / "service.sock")
+        serve(socket_path=socket_path)
+        connection = UnixHTTPConnection(socket_path)
+        status, job = _request(connection, "POST", "/jobs", {"query": queries["qb"], "accessions": ["SRR3"]})
+        assert status == 201
+        job = _wait_for_job(connection, job["id"])
+        assert job["hits"] == ["SRR3"]
+
+
+class TestColdStart:
+    def test_version_is_resolved_on_first_use(self):
+        assert "__version__" not in vars(logan_blaster)
+        assert logan_blaster.__version__ == logan_blaster._resolve_version()
+
+    def test_version_option(self, monkeypatch, capsys):
+        monkeypatch.setattr(sys, "argv", ["logan_blaster", "--version"])
+        with pytest.raises(SystemExit):
+            logan_blaster.main()
+        assert capsys.readouterr().out.strip().endswith(logan_blaster.__version__)
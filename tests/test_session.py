@@ -0,0 +1,113 @@
+"""Unit tests for the Logan-Search session loader (no external tools or network required)."""
+import json
+import os
+import zipfile
+
+import pytest
+
+from logan_blaster import LoganBlaster, LoganBlasterError, LoganSession, order_accessions, read_accession_table, walk_json
+
+SESSION = {
+    "_query": {"_name": "my_query", "_seq": "ACGTACGTACGT\n"},
+    "results": [
+        {"_metadata": {"ID": ["SRR1", "SRR2"], "organism": ["human gut", "soil"], "kmer_coverage": [0.9, 0.5]}},
+        {"nested": {"_metadata": {"ID": ["SRR3"], "organism": ["sea water"], "date": ["2021"]}}},
+    ],
+}
+
+
+def _session_zip(path, session=SESSION):
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(LoganSession.JSON_MEMBER, json.dumps(session))
+        archive.writestr("README.txt", "other member")
+    return str(path)
+
+
+class TestWalkJson:
+    def test_document_order(self):
+        document = {"a": {"b": [{"c": 1}, {"d": {"e": 2}}]}, "f": {"g": 3}}
+        assert [sorted(node) for node in walk_json(document)] == [["a", "f"], ["b"], ["c"], ["d"], ["e"], ["g"]]
+
+
+class TestLoganSession:
+    def test_from_zip(self, tmp_path):
+        session = LoganSession.from_zip(_session_zip(tmp_path / "s.zip"))
+        assert (session.query_name, session.query_seq) == ("my_query", "ACGTACGTACGT\n")
+        assert session.accessions == ["SRR1", "SRR2", "SRR3"]
+        assert session.metadata["organism"] == ["human gut", "soil", "sea water"]
+        assert session.metadata["kmer_coverage"] == [0.9, 0.5, None]
+        assert session.metadata["date"] == [None, None, "2021"]
+
+    def test_scalar_id(self):
+        session = LoganSession.from_document({"_query": {"_seq": "ACGT"}, "_metadata": {"ID": "SRR1", "organism": "soil"}})
+        assert session.accessions == ["SRR1"]
+        assert session.metadata["organism"] == ["soil"]
+
+    def test_missing_query(self):
+        with pytest.raises(ValueError):
+            LoganSession.from_document({"_metadata": {"ID": ["SRR1"]}})
+
+    def test_save_load(self, tmp_path):
+        session = LoganSession.from_document(SESSION)
+        session.save(str(tmp_path / "parsed.json"))
+        loaded = LoganSession.load(str(tmp_path / "parsed.json"))
+        assert (loaded.query_name, loaded.query_seq, loaded.metadata) == (session.query_name, session.query_seq, session.metadata)
+
+    def test_write_inputs(self, tmp_path):
+        LoganSession.from_document(SESSION).write_inputs(str(tmp_path / "acc.txt"), str(tmp_path / "query.fa"))
+        assert (tmp_path / "acc.txt").read_text() == "SRR1\nSRR2\nSRR3\n"
+        assert (tmp_path / "query.fa").read_text() == ">my_query\nACGTACGTACGT\n"
+
+
+class TestBlasterSession:
+    def test_session_is_parsed_once(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.makedirs(LoganBlaster.INPUT_DATA_DIR_NAME)
+        zip_file = _session_zip(os.path.join(LoganBlaster.INPUT_DATA_DIR_NAME, "abc.zip"))
+        blaster = LoganBlaster("abc", None, None, False, False, 17, 0, None)
+        blaster._setup_session()
+        assert blaster.accession_file == os.path.join(LoganBlaster.INPUT_DATA_DIR_NAME, "abc_acc.txt")
+        assert open(blaster.accession_file).read() == "SRR1\nSRR2\nSRR3\n"
+        assert open(blaster.query_file).read() == ">my_query\nACGTACGTACGT\n"
+
+        # Later runs use the parsed session
+        os.remove(zip_file)
+        again = LoganBlaster("abc", None, None, False, False, 17, 0, None)
+        again._setup_session()
+        assert again.session.accessions == ["SRR1", "SRR2", "SRR3"]
+
+
+class TestAccessionOrdering:
+    def test_read_accession_table(self, tmp_path):
+        for delimiter in (",", "\t"):
+            table = tmp_path / "acc.csv"
+            table.write_text(delimiter.join(["run", "score", "organism"]) + "\n"
+                             + delimiter.join(["SRR1", "0.5", "soil"]) + "\n\nSRR2" + delimiter + "2\n")
+            assert read_accession_table(str(table)) == (
+                "run", {"run": ["SRR1", "SRR2"], "score": ["0.5", "2"], "organism": ["soil", ""]})
+
+    def test_order_accessions(self):
+        ids = ["SRR1", "SRR2", "SRR3", "SRR4", "SRR5"]
+        assert order_accessions(ids, ids, ["0.5", "2", None, "n/a", 2]) == ["SRR2", "SRR5", "SRR1", "SRR3", "SRR4"]
+
+    def test_blaster_orders_by_session_metadata(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.makedirs(LoganBlaster.INPUT_DATA_DIR_NAME)
+        _session_zip(os.path.join(LoganBlaster.INPUT_DATA_DIR_NAME, "abc.zip"))
+        blaster = LoganBlaster("abc", None, None, False, False, 17, 1, None, order_by="kmer_coverage")
+        blaster._setup_session()
+        assert blaster._read_accessions() == ["SRR1"]
+        blaster.limit = 0
+        assert blaster._read_accessions() == ["SRR1", "SRR2", "SRR3"]
+        blaster.order_by = "missing"
+        with pytest.raises(LoganBlasterError):
+            blaster._read_accessions()
+
+    def test_blaster_orders_by_csv_column(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "query.fa").write_text(">q\nACGT\n")
+        (tmp_path / "hits.csv").write_text("acc,hits\nSRR1,3\nSRR2,10\nSRR3,7\n")
+        blaster = LoganBlaster(None, None, None, False, False, 17, 0, None, order_by="hits")
+        blaster._setup_local_files(str(tmp_path / "query.fa"), str(tmp_path / "hits.csv"))
+        assert open(blaster.accession_file).read() == "SRR1\nSRR2\nSRR3\n"
+        assert blaster._read_accessions() == ["SRR2", "SRR3", "SRR1"]
@@ -0,0 +1,152 @@
+"""Unit tests for sharded runs and the merge of their outputs (no external tools or network required)."""
+import json
+import os
+from array import array
+
+import pytest
+
+from logan_blaster import (
+    CoverageMatrix,
+    LoganBlaster,
+    LoganBlasterError,
+    RunMetrics,
+    merge_main,
+    merge_shards,
+    parse_shard,
+    shard_accessions,
+)
+
+ACCESSIONS = [f"SRR{i}" for i in range(100)]
+
+
+class TestParseShard:
+    def test_valid(self):
+        assert parse_shard("2/8") == (2, 8)
+        assert parse_shard(" 1 / 1 ") == (1, 1)
+
+    @pytest.mark.parametrize("shard", ["0/4", "5/4", "1", "a/b", "-1/4"])
+    def test_invalid(self, shard):
+        with pytest.raises(ValueError):
+            parse_shard(shard)
+
+
+class TestShardAccessions:
+    def test_partition(self):
+        shards = [shard_accessions(ACCESSIONS, index, 4) for index in range(1, 5)]
+        assert sorted(sum(shards, [])) == sorted(ACCESSIONS)
+        assert all(shard == sorted(shard, key=ACCESSIONS.index) for shard in shards), "original order is kept"
+        assert all(10 < len(shard) < 40 for shard in shards)
+
+    def test_independent_of_other_accessions(self):
+        # An accession is in the same shard whatever the rest of the list
+        assert set(shard_accessions(ACCESSIONS[:50], 3, 4)) <= set(shard_accessions(ACCESSIONS, 3, 4))
+
+    def test_balanced_by_size(self):
+        sizes = {"SRR1": 100, "SRR2": 60, "SRR3": 50, "SRR4": 30, "SRR5": 20, "SRR6": 0}
+        accessions = list(sizes)
+        shards = [shard_accessions(accessions, index, 2, sizes) for index in (1, 2)]
+        assert shards == [["SRR1", "SRR4", "SRR6"], ["SRR2", "SRR3", "SRR5"]]
+        assert [sum(sizes[accession] for accession in shard) for shard in shards] == [130, 130]
+
+    def test_empty_files_are_spread(self):
+        sizes = dict.fromkeys(ACCESSIONS[:9], 0)
+        assert [len(shard_accessions(list(sizes), index, 3, sizes)) for index in (1, 2, 3)] == [3, 3, 3]
+
+
+class TestBlasterShard:
+    def _blaster(self, tmp_path, **kwargs):
+        (tmp_path / "accessions.txt").write_text("".join(f"{accession}\n" for accession in ACCESSIONS))
+        return LoganBlaster(None, str(tmp_path / "accessions.txt"), "query.fa", False, False, 17, 0, None, **kwargs)
+
+    def test_accessions_of_the_shard(self, tmp_path):
+        blaster = self._blaster(tmp_path, shard=(2, 3))
+        assert blaster._read_accessions() == shard_accessions(ACCESSIONS, 2, 3)
+
+    def test_balanced_by_size(self, tmp_path):
+        sizes = {accession: i * 1000 for i, accession in enumerate(ACCESSIONS)}
+
+        class Downloader:
+            def size(self, url):
+                accession = os.path.basename(url).split(".")[0]
+                if accession == "SRR7":
+                    raise FileNotFoundError(url)
+                return sizes[accession]
+
+        blaster = self._blaster(tmp_path, shard=(1, 2), shard_by_size=True, downloader=Downloader())
+        sizes["SRR7"] = 0
+        assert blaster._read_accessions() == shard_accessions(ACCESSIONS, 1, 2, sizes)
+
+    def test_size_errors_stop_the_run(self, tmp_path):
+        class Downloader:
+            def size(self, url):
+                raise OSError("connection lost")
+
+        blaster = self._blaster(tmp_path, shard=(1, 2), shard_by_size=True, downloader=Downloader())
+        with pytest.raises(LoganBlasterError):
+            blaster._read_accessions()
+
+    def test_shard_directory(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        blaster = LoganBlaster("abc", None, None, False, False, 17, 0, None, shard=(3, 10))
+        blaster._setup_directories()
+        assert blaster.main_dir_name == str(tmp_path / "session_abc_shard3of10")
+        assert os.path.isdir(tmp_path / "session_abc_shard3of10" / LoganBlaster.LOGAN_DIR_NAME)
+
+
+def _shard(tmp_path, name, accessions, query_length=4):
+    shard_dir = tmp_path / name
+    (shard_dir / LoganBlaster.ALIGNEMENT_DIR_NAME).mkdir(parents=True)
+    (shard_dir / LoganBlaster.INPUT_DATA_DIR_NAME).mkdir()
+    (shard_dir / LoganBlaster.INPUT_DATA_DIR_NAME / "query.fa").write_text(">q\nACGT\n")
+    matrix = CoverageMatrix.create(str(shard_dir / LoganBlaster.COVERAGE_MATRIX_FILE_NAME.format(query="q")), query_length)
+    for rank, accession in enumerate(accessions):
+        (shard_dir / LoganBlaster.ALIGNEMENT_DIR_NAME / f"synth_q_vs_{accession}.txt").write_text(accession)
+        (shard_dir / LoganBlaster.COVERAGE_STATS_FILE_NAME).open("a").write(json.dumps({"accession": accession}) + "\n")
+        (shard_dir / LoganBlaster.SHARED_KMERS_FILE_NAME).open("a").write(json.dumps({"accession": accession}) + "\n")
+        matrix.add(accession, array("I", [rank + 1] * query_length))
+    matrix.close()
+    (shard_dir / LoganBlaster.FAILED_ACCESSIONS_FILE_NAME).write_text(f"{name}_failed\n")
+    metrics = RunMetrics(str(shard_dir / "metrics.jsonl"))
+    metrics.record(accessions[0], "download", 1.0, {})
+    metrics.summary(2.0)
+    return str(shard_dir)
+
+
+class TestMergeShards:
+    def test_merge(self, tmp_path):
+        shards = [_shard(tmp_path, "shard1", ["SRR1", "SRR2"]), _shard(tmp_path, "shard2", ["SRR3"])]
+        output = tmp_path / "merged"
+        assert merge_shards(shards, str(output), [os.path.join(shard, "metrics.jsonl") for shard in shards]) == 3
+        assert sorted(os.listdir(output / LoganBlaster.ALIGNEMENT_DIR_NAME)) == [
+            "synth_q_vs_SRR1.txt", "synth_q_vs_SRR2.txt", "synth_q_vs_SRR3.txt"]
+        assert (output / LoganBlaster.INPUT_DATA_DIR_NAME / "query.fa").read_text() == ">q\nACGT\n"
+        assert (output / LoganBlaster.FAILED_ACCESSIONS_FILE_NAME).read_text() == "shard1_failed\nshard2_failed\n"
+        assert [json.loads(line)["accession"] for line in (output / LoganBlaster.COVERAGE_STATS_FILE_NAME).open()] == [
+            "SRR1", "SRR2", "SRR3"]
+        assert [json.loads(line)["accession"] for line in (output / LoganBlaster.SHARED_KMERS_FILE_NAME).open()] == [
+            "SRR1", "SRR2", "SRR3"]
+        with CoverageMatrix.open(str(output / "coverage_matrix_q.npy")) as matrix:
+            assert matrix.accessions == ["SRR1", "SRR2", "SRR3"]
+            assert [list(matrix.row(accession)) for accession in matrix.accessions] == [[1] * 4, [2] * 4, [1] * 4]
+        summary = json.loads((output / "metrics.jsonl").read_text().splitlines()[-1])
+        assert summary["stages"]["download"]["count"] == 2
+
+    def test_merge_again(self, tmp_path):
+        shards = [_shard(tmp_path, "shard1", ["SRR1"]), _shard(tmp_path, "shard2", ["SRR2"])]
+        merge_shards(shards, str(tmp_path / "merged"))
+        merge_shards(shards, str(tmp_path / "merged"))
+        with CoverageMatrix.open(str(tmp_path / "merged" / "coverage_matrix_q.npy")) as matrix:
+            assert matrix.accessions == ["SRR1", "SRR2"]
+        assert len(os.listdir(tmp_path / "merged" / LoganBlaster.ALIGNEMENT_DIR_NAME)) == 2
+
+    def test_query_length_mismatch(self, tmp_path):
+        shards = [_shard(tmp_path, "shard1", ["SRR1"]), _shard(tmp_path, "shard2", ["SRR2"], query_length=5)]
+        with pytest.raises(ValueError):
+            merge_shards(shards, str(tmp_path / "merged"))
+
+    def test_command(self, tmp_path, capsys):
+        shards = [_shard(tmp_path, "shard1", ["SRR1"]), _shard(tmp_path, "shard2", ["SRR2"])]
+        merge_main(shards + ["-o", str(tmp_path / "merged")])
+        assert "2 shards merged" in capsys.readouterr().out
+        with pytest.raises(SystemExit):
+            merge_main([str(tmp_path / "missing"), "-o", str(tmp_path / "merged")])